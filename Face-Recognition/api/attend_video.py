@@ -0,0 +1,62 @@
+"""Headless attendance from a recorded lecture video.
+
+Scans the video for the students of a class (see services/video_attendance.py) and writes their
+first appearance as AttendanceRecords. Run from the api directory so .env and the model paths
+resolve like in the API:
+
+    python attend_video.py lecture.mp4 --class_id 3 --started_at 2026-03-02T07:30:00
+"""
+
+import argparse
+import json
+import sys
+from datetime import datetime
+
+from database import SessionLocal
+from services.video_attendance import scan_video, class_roster, record_attendance
+
+
+def main(args):
+    db = SessionLocal()
+    try:
+        roster = class_roster(db, args.class_id)
+        if not roster:
+            print(f"Class {args.class_id} has no enrolled students")
+            return 1
+
+        def on_progress(progress):
+            print(f"PROGRESS {json.dumps(progress)}", flush=True)
+
+        result = scan_video(args.video, candidates=set(roster), on_progress=on_progress if args.progress else None)
+        if not args.dry_run:
+            result.update(record_attendance(db, args.class_id, roster, result, session_id=args.session_id,
+                                            started_at=args.started_at))
+    finally:
+        db.close()
+
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    print(f"Processed {result['frames_decoded']} frames ({result['duration_sec']}s of video) "
+          f"in {result['elapsed_sec']}s: {result['fps']} frames/sec, {len(result['students'])} students recognized")
+    return 0
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('video', type=str,
+        help='Path of the video file.')
+    parser.add_argument('--class_id', type=int, required=True,
+        help='Class whose students are looked for.')
+    parser.add_argument('--session_id', type=int,
+        help='Attendance session to mark (default: the class session of that day, created if missing).')
+    parser.add_argument('--started_at', type=datetime.fromisoformat,
+        help='Wall-clock time of the first frame, e.g. 2026-03-02T07:30:00.')
+    parser.add_argument('--dry_run', action='store_true',
+        help='Only print the recognized students, do not write attendance.')
+    parser.add_argument('--progress', action='store_true',
+        help='Print a PROGRESS line after every sampled frame.')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    sys.exit(main(parse_arguments(sys.argv[1:])))
@@ -0,0 +1,71 @@
+"""PNet calls, detection latency and faces found per detection profile.
+
+Run from the api/ directory so the service resolves ../Models:
+    python benchmarks/benchmark_detection_profiles.py ../Dataset/FaceData/raw --profiles default selfie classroom
+"""
+import os
+import sys
+import argparse
+
+import cv2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from services.face_recognition import FaceRecognitionService
+
+
+def load_frames(image_dir, limit):
+    frames = []
+    for root, _, files in os.walk(image_dir):
+        for name in sorted(files):
+            if name.lower().endswith(('.jpg', '.jpeg', '.png')):
+                frame = cv2.imread(os.path.join(root, name))
+                if frame is not None:
+                    frames.append(frame)
+                if len(frames) >= limit:
+                    return frames
+    return frames
+
+
+def main(args):
+    frames = load_frames(args.image_dir, args.max_images)
+    if not frames:
+        print('No images found in %s' % args.image_dir)
+        return
+
+    service = FaceRecognitionService()
+    service.load_model()
+    with service._use_model() as bundle:
+        # One untimed pass per profile so first-run graph optimisation is excluded
+        for name in args.profiles:
+            bundle.detect(frames[0], service._profile(name))
+        for profile in service.detection_profiles.values():
+            profile.reset()
+
+        for _ in range(args.repeats):
+            for frame in frames:
+                for name in args.profiles:
+                    bundle.detect(frame, service._profile(name))
+
+    print('%-10s %10s %10s %12s %12s %8s' % ('profile', 'min_face', 'max_face', 'pnet calls', 'detect ms', 'faces'))
+    baseline = None
+    for name in args.profiles:
+        stats = service.detection_profiles[name].stats()
+        baseline = baseline or stats["mean_detect_ms"]
+        print('%-10s %10s %10s %12.1f %12.2f %8.2f   (x%.2f)' % (
+            name, stats["min_face"], stats["max_face"], stats["mean_pnet_calls"], stats["mean_detect_ms"],
+            stats["faces"] / float(max(stats["frames"], 1)), baseline / max(stats["mean_detect_ms"], 1e-9)))
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('image_dir', type=str, help='Directory (searched recursively) with photos to run detection on.')
+    parser.add_argument('--profiles', type=str, nargs='+', default=['default', 'selfie', 'classroom'],
+        help='Detection profiles to compare; the first one is the baseline.')
+    parser.add_argument('--repeats', type=int, default=3, help='Passes over the images per profile.')
+    parser.add_argument('--max_images', type=int, default=50, help='Distinct images to use.')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    main(parse_arguments(sys.argv[1:]))
@@ -0,0 +1,83 @@
+"""Throughput of FaceRecognitionService.recognize_face with 0..N pool workers.
+
+Run from the api/ directory so the service resolves ../Models:
+    python benchmarks/benchmark_inference_pool.py ../Dataset/FaceData/raw --workers 0 1 2 4
+"""
+import os
+import sys
+import time
+import base64
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from services.face_recognition import FaceRecognitionService
+from services.inference_pool import InferencePool
+
+
+def load_images(image_dir, limit):
+    images = []
+    for root, _, files in os.walk(image_dir):
+        for name in sorted(files):
+            if name.lower().endswith(('.jpg', '.jpeg', '.png')):
+                with open(os.path.join(root, name), 'rb') as f:
+                    images.append(base64.b64encode(f.read()).decode('ascii'))
+                if len(images) >= limit:
+                    return images
+    return images
+
+
+def run(service, images, requests, concurrency):
+    # One untimed pass so model loading and first-run graph optimisation are excluded
+    service.recognize_face(images[0])
+
+    payloads = [images[i % len(images)] for i in range(requests)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(service.recognize_face, payloads))
+    elapsed = time.perf_counter() - started
+    errors = sum(1 for _, _, message in results if message.startswith("Error"))
+    return requests / elapsed, elapsed, errors
+
+
+def main(args):
+    images = load_images(args.image_dir, args.max_images)
+    if not images:
+        print('No images found in %s' % args.image_dir)
+        return
+
+    print('%8s %12s %10s %8s' % ('workers', 'req/s', 'seconds', 'errors'))
+    baseline = None
+    for workers in args.workers:
+        service = FaceRecognitionService()
+        if not args.cache:
+            # Requests cycle through --max_images images; keep them all on the inference path
+            service.result_cache = None
+        if workers > 0:
+            service.pool = InferencePool(workers)
+            service.pool.start()
+        try:
+            throughput, elapsed, errors = run(service, images, args.requests, args.concurrency)
+        finally:
+            if service.pool is not None:
+                service.pool.stop()
+        baseline = baseline or throughput
+        print('%8d %12.2f %10.2f %8d   (x%.2f)' % (workers, throughput, elapsed, errors, throughput / baseline))
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('image_dir', type=str, help='Directory (searched recursively) with face images to send.')
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 1, 2, 4],
+        help='Pool sizes to measure; 0 runs inference in-process.')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per configuration.')
+    parser.add_argument('--concurrency', type=int, default=16, help='Concurrent client threads.')
+    parser.add_argument('--max_images', type=int, default=50, help='Distinct images to cycle through.')
+    parser.add_argument('--cache', action='store_true',
+        help='Keep the recognition result cache on, so repeated images are answered from it.')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    main(parse_arguments(sys.argv[1:]))
@@ -0,0 +1,121 @@
+"""Decode + detect time of full-resolution and reduced JPEG decoding across upload sizes.
+
+Every face image is upscaled to each --sizes resolution and JPEG-encoded like a phone upload.
+The "full" path is the previous one: IMREAD_COLOR and MTCNN on the whole frame. The "reduced"
+path decodes with IMREAD_REDUCED_COLOR_2/4/8 as far as the profile's smallest face allows and
+detects on a second copy where that face is FACE_DETECT_FACE_PX pixels. Alongside the timings
+the table shows how often a face was found, how often both paths agree on the identity and the
+mean L2 distance between the two paths' embeddings of the first face.
+
+Run from the api/ directory so the service resolves ../Models:
+    python benchmarks/benchmark_reduced_decode.py ../Dataset/FaceData/raw --sizes 640x480 1920x1080 4032x3024
+"""
+import os
+import sys
+import time
+import argparse
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import services.face_recognition as face_recognition
+from services.face_recognition import FaceRecognitionService
+from services.detection import decode_reduced
+
+
+def load_frames(image_dir, limit):
+    frames = []
+    for root, _, files in os.walk(image_dir):
+        for name in sorted(files):
+            if name.lower().endswith(('.jpg', '.jpeg', '.png')):
+                frame = cv2.imread(os.path.join(root, name))
+                if frame is not None:
+                    frames.append(frame)
+                if len(frames) >= limit:
+                    return frames
+    return frames
+
+
+def encode(frames, width, height, quality):
+    payloads = []
+    for frame in frames:
+        resized = cv2.resize(frame, (width, height), interpolation=cv2.INTER_CUBIC)
+        payloads.append(cv2.imencode('.jpg', resized, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes())
+    return payloads
+
+
+def run_path(service, bundle, payloads, profile, reduced, detect_face_px):
+    face_recognition.DETECT_FACE_PX = detect_face_px if reduced else 0
+    decode_time, detect_time, results = 0.0, 0.0, []
+    for data in payloads:
+        started = time.perf_counter()
+        if reduced:
+            frame, scale = decode_reduced(data, profile)
+        else:
+            frame, scale = service._decode_bytes(data), 1.0
+        decoded = time.perf_counter()
+        bounding_boxes = bundle.detect(frame, profile, scale)
+        detect_time += time.perf_counter() - decoded
+        decode_time += decoded - started
+
+        if len(bounding_boxes) == 0:
+            results.append((None, None))
+            continue
+        crop = service._align(frame, bounding_boxes[0, 0:4], margin=32 / scale)
+        emb = bundle.embed(crop[np.newaxis])[0]
+        names, _ = bundle.classify([emb])
+        results.append((names[0], emb))
+    count = float(len(payloads))
+    return 1000.0 * decode_time / count, 1000.0 * detect_time / count, results
+
+
+def main(args):
+    frames = load_frames(args.image_dir, args.max_images)
+    if not frames:
+        print('No images found in %s' % args.image_dir)
+        return
+
+    service = FaceRecognitionService()
+    service.load_model()
+    profile = service._profile(args.profile)
+    print('%-11s %-8s %10s %10s %10s %8s %8s %10s' % (
+        'size', 'path', 'decode ms', 'detect ms', 'total ms', 'found', 'agree', 'emb L2'))
+    with service._use_model() as bundle:
+        for size in args.sizes:
+            width, height = (int(v) for v in size.split('x'))
+            payloads = encode(frames, width, height, args.quality)
+            # One untimed pass per path so first-run graph optimisation for this size is excluded
+            for reduced in (False, True):
+                run_path(service, bundle, payloads[:1], profile, reduced, args.detect_face_px)
+
+            full = run_path(service, bundle, payloads, profile, False, args.detect_face_px)
+            reduced = run_path(service, bundle, payloads, profile, True, args.detect_face_px)
+            both = [(a, b) for a, b in zip(full[2], reduced[2]) if a[1] is not None and b[1] is not None]
+            agree = np.mean([a[0] == b[0] for a, b in both]) if both else float('nan')
+            distance = np.mean([np.linalg.norm(a[1] - b[1]) for a, b in both]) if both else float('nan')
+
+            for name, (decode_ms, detect_ms, results) in (('full', full), ('reduced', reduced)):
+                found = np.mean([emb is not None for _, emb in results])
+                print('%-11s %-8s %10.2f %10.2f %10.2f %8.2f %8s %10s' % (
+                    size, name, decode_ms, detect_ms, decode_ms + detect_ms, found,
+                    '%.2f' % agree if name == 'reduced' else '', '%.3f' % distance if name == 'reduced' else ''))
+            print('%-11s %-8s %43s' % (size, '', '(x%.2f)' % ((full[0] + full[1]) / max(reduced[0] + reduced[1], 1e-9))))
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('image_dir', type=str, help='Directory (searched recursively) with face images.')
+    parser.add_argument('--sizes', type=str, nargs='+', default=['640x480', '1280x960', '1920x1440', '4032x3024'],
+        help='Upload resolutions as WIDTHxHEIGHT.')
+    parser.add_argument('--profile', type=str, default='selfie', help='Detection profile to use.')
+    parser.add_argument('--detect_face_px', type=float, default=face_recognition.DETECT_FACE_PX,
+        help='Size of the smallest wanted face in the detection copy.')
+    parser.add_argument('--quality', type=int, default=92, help='JPEG quality of the synthetic uploads.')
+    parser.add_argument('--max_images', type=int, default=30, help='Face images to use.')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    main(parse_arguments(sys.argv[1:]))
@@ -0,0 +1,128 @@
+"""Request size, allocation and latency of the base64 JSON and the binary image upload paths.
+
+A small app serves the three encodings the API accepts: the JSON ``image_base64`` body of
+/api/face/recognize, and a raw image/jpeg body or a multipart ``image`` file as read by
+/api/face/recognize-image. Each request is decoded (with --recognize: fully recognized) by
+FaceRecognitionService. The table shows the bytes sent, the peak Python allocation while a
+request is served (tracemalloc, includes numpy buffers, excludes OpenCV's own) and the median
+and p95 end-to-end latency through the ASGI stack.
+
+Run from the api/ directory:
+    python benchmarks/benchmark_upload_paths.py ../Dataset/FaceData/raw --requests 200
+"""
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+import tracemalloc
+
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from services.face_recognition import FaceRecognitionService
+from routers.uploads import read_image_upload
+
+
+class Base64Body(BaseModel):
+    image_base64: str
+
+
+def load_images(image_dir, limit):
+    images = []
+    for root, _, files in os.walk(image_dir):
+        for name in sorted(files):
+            if name.lower().endswith(('.jpg', '.jpeg')):
+                with open(os.path.join(root, name), 'rb') as f:
+                    images.append(f.read())
+                if len(images) >= limit:
+                    return images
+    return images
+
+
+def build_app(service, recognize):
+    app = FastAPI()
+
+    @app.post("/json")
+    def json_path(body: Base64Body):
+        if recognize:
+            return service.recognize_face(body.image_base64)[2]
+        return service._decode_image(body.image_base64).shape
+
+    @app.post("/binary")
+    async def binary_path(request: Request):
+        async with read_image_upload(request) as upload:
+            if recognize:
+                return (await run_in_threadpool(service.recognize_bytes, upload.view()))[2]
+            return (await run_in_threadpool(service._decode_bytes, upload.view())).shape
+
+    return app
+
+
+def build_request(client, path, image):
+    if path == "json":
+        body = json.dumps({"image_base64": base64.b64encode(image).decode("ascii")}).encode()
+        return client.build_request("POST", "/json", content=body, headers={"content-type": "application/json"})
+    if path == "raw":
+        return client.build_request("POST", "/binary", content=image, headers={"content-type": "image/jpeg"})
+    return client.build_request("POST", "/binary", files={"image": ("face.jpg", image, "image/jpeg")})
+
+
+def run(client, path, images, requests):
+    # One untimed request so model loading and first-run costs are excluded
+    client.send(build_request(client, path, images[0])).raise_for_status()
+
+    sizes, peaks, latencies = [], [], []
+    for i in range(requests):
+        request = build_request(client, path, images[i % len(images)])
+        sizes.append(len(request.read()))
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        client.send(request).raise_for_status()
+        latencies.append(time.perf_counter() - started)
+        peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+    return np.mean(sizes), np.mean(peaks), 1000.0 * np.median(latencies), 1000.0 * np.percentile(latencies, 95)
+
+
+def main(args):
+    images = load_images(args.image_dir, args.max_images)
+    if not images:
+        print('No JPEG images found in %s' % args.image_dir)
+        return
+
+    service = FaceRecognitionService()
+    if not args.cache:
+        # Requests cycle through --max_images images; keep them all on the inference path
+        service.result_cache = None
+    client = TestClient(build_app(service, args.recognize))
+    tracemalloc.start()
+
+    print('%-10s %12s %14s %12s %10s' % ('path', 'request KB', 'peak alloc KB', 'median ms', 'p95 ms'))
+    for path in args.paths:
+        size, peak, median, p95 = run(client, path, images, args.requests)
+        print('%-10s %12.1f %14.1f %12.2f %10.2f' % (path, size / 1024.0, peak / 1024.0, median, p95))
+
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('image_dir', type=str, help='Directory (searched recursively) with JPEG images to send.')
+    parser.add_argument('--paths', type=str, nargs='+', default=['json', 'raw', 'multipart'],
+        choices=['json', 'raw', 'multipart'], help='Upload encodings to measure.')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per encoding.')
+    parser.add_argument('--max_images', type=int, default=50, help='Distinct images to cycle through.')
+    parser.add_argument('--recognize', action='store_true',
+        help='Run full recognition (needs the models) instead of decoding only.')
+    parser.add_argument('--cache', action='store_true',
+        help='With --recognize, keep the recognition result cache on, so repeated images are answered from it.')
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    main(parse_arguments(sys.argv[1:]))
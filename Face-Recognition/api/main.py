@@ -1,14 +1,34 @@
-from fastapi import FastAPI
+import os
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from database import engine, Base
 from routers import auth, admin, face, teacher, teacher_requests, attendance_reports, admin_requests
+from services.face_recognition import face_recognition_service
+from services.inference_dispatch import inference_dispatcher, InferenceBusy
+from services.metrics import pipeline_metrics
 
 Base.metadata.create_all(bind=engine)
 
+PRELOAD_MODELS = os.getenv("FACE_PRELOAD_MODELS", "false").lower() == "true"
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if PRELOAD_MODELS:
+        # Load in the background so /health answers while /ready reports progress
+        loop = asyncio.get_event_loop()
+        loop.run_in_executor(None, face_recognition_service.warm_up)
+    yield
+    inference_dispatcher.shutdown()
+    face_recognition_service.shutdown()
+
 app = FastAPI(
     title="Face Recognition Attendance API",
     description="API for face recognition based attendance system",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 app.add_middleware(
@@ -31,6 +51,14 @@ app.include_router(admin_requests.router)
 from routers import student
 app.include_router(student.router)
 
+@app.exception_handler(InferenceBusy)
+async def inference_busy_handler(request: Request, exc: InferenceBusy):
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": exc.message},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
 @app.get("/")
 def root():
     return {
@@ -42,6 +70,21 @@ def root():
 def health_check():
     return {"status": "healthy"}
 
+@app.get("/ready")
+def readiness_check():
+    readiness = face_recognition_service.readiness()
+    if not PRELOAD_MODELS:
+        # Lazy mode: the model loads on the first request, so never hold back traffic
+        return {**readiness, "ready": True, "preload": False}
+    return JSONResponse(status_code=200 if readiness["ready"] else 503, content={**readiness, "preload": True})
+
+@app.get("/metrics")
+def metrics():
+    """Per-stage pipeline histograms in the Prometheus text format."""
+    if not pipeline_metrics.enabled:
+        return PlainTextResponse("metrics disabled (FACE_METRICS_ENABLED=false)\n", status_code=404)
+    return PlainTextResponse(pipeline_metrics.render(), media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
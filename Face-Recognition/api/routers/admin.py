@@ -151,6 +151,10 @@ def delete_student(student_id: int, db: Session = Depends(get_db), current_user
 
     db.delete(student)
     db.commit()
+
+    from services.face_recognition import face_recognition_service
+    face_recognition_service.remove_student(student.student_code)
+
     return {"message": "Student deleted"}
 
 @router.post("/students/{student_id}/face-data")
@@ -166,10 +170,46 @@ async def upload_face_data(student_id: int, data: dict, db: Session = Depends(ge
     existing_files = list(student_dir.glob("*.jpg"))
     next_index = len(existing_files) + 1
     image_data = base64.b64decode(data["image_base64"])
+
+    def check_distinct():
+        import cv2
+        import numpy as np
+        from services.enrolment import enrolment_filter, filter_report
+
+        img = cv2.imdecode(np.frombuffer(image_data, np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            raise HTTPException(status_code=400, detail="Invalid image data")
+        diversity = enrolment_filter(student_dir)
+        kept, reason = diversity.offer(img)
+        return kept, reason, filter_report(diversity)
+
+    import asyncio
+    loop = asyncio.get_event_loop()
+    kept, reason, diversity = await loop.run_in_executor(None, check_distinct)
+    # One image per request never reaches FACE_ENROLL_TARGET (it caps each upload,
+    # not the images on disk), so a rejection here is always a near-duplicate
+    if not kept:
+        return {"message": "Image skipped: near-duplicate of an existing face image",
+                "kept": False, "reason": reason, "diversity": diversity}
+
     image_path = student_dir / f"{next_index}.jpg"
     with open(image_path, "wb") as f:
         f.write(image_data)
-    return {"message": "Image uploaded", "path": str(image_path)}
+
+    # Align, crop and embed in the background so the student is recognisable in seconds
+    from services.ingest import enrolment_ingest
+    ingest = enrolment_ingest.submit(student.student_code, image_path.resolve())
+    return {"message": "Image uploaded", "path": str(image_path), "kept": True, "diversity": diversity,
+            "ingest": ingest}
+
+@router.get("/ingest/{ticket_id}")
+def get_ingest_status(ticket_id: str, _admin = Depends(require_admin)):
+    from services.ingest import enrolment_ingest
+
+    ticket = enrolment_ingest.get(ticket_id)
+    if ticket is None:
+        raise HTTPException(status_code=404, detail="Ingest ticket not found")
+    return ticket
 
 @router.post("/capture-face/{student_id}")
 async def capture_face(student_id: int, db: Session = Depends(get_db), _admin = Depends(require_admin)):
@@ -213,6 +253,8 @@ async def capture_face(student_id: int, db: Session = Depends(get_db), _admin =
                 "message": f"Capture failed: {result.stderr or 'Unknown error'}"
             }
 
+        from services.enrolment import capture_report
+
         # Count captured images
         raw_dir = project_root / "Dataset" / "FaceData" / "raw" / student_code
         if raw_dir.exists():
@@ -224,6 +266,7 @@ async def capture_face(student_id: int, db: Session = Depends(get_db), _admin =
             "success": True,
             "message": f"Captured {images_count} images successfully for {student.full_name}",
             "images_count": images_count,
+            "diversity": capture_report(result.stdout),
             "student_code": student_code,
             "student_name": student.full_name
         }
@@ -641,18 +684,38 @@ def get_student_absence_statistics(student_id: int, db: Session = Depends(get_db
 # Train model
 @router.post("/train-model")
 async def train_model(_admin = Depends(require_admin)):
-    """Train face recognition model (admin only)"""
-    from services.training import training_service
+    """Queue a face recognition training job (admin only); poll it with /train-model/jobs/{job_id}"""
+    from services.training_jobs import training_jobs
+
+    job, coalesced = training_jobs.submit("admin")
+    return {"success": True, "job_id": job["id"], "coalesced": coalesced, "job": job}
+
+@router.get("/train-model/jobs/{job_id}")
+def get_training_job(job_id: str, _admin = Depends(require_admin)):
+    from services.training_jobs import training_jobs
+
+    job = training_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Training job not found")
+    return job
+
+@router.get("/train-model/status")
+def get_training_status(_admin = Depends(require_admin)):
+    from services.training_jobs import training_jobs
+
+    return training_jobs.status()
+
+@router.post("/gallery/sync")
+async def sync_gallery(_admin = Depends(require_admin)):
+    """Incrementally enroll new students into the embedding gallery (admin only)"""
+    from services.face_recognition import face_recognition_service
     import asyncio
 
+    processed_dir = str(Path(__file__).parent.parent.parent / "Dataset" / "FaceData" / "processed")
     loop = asyncio.get_event_loop()
-    success, message = await loop.run_in_executor(None, training_service.train_model)
-
-    if success:
-        from services.face_recognition import face_recognition_service
-        face_recognition_service.model_loaded = False
+    result = await loop.run_in_executor(None, face_recognition_service.sync_gallery, processed_dir)
 
-    return {"success": success, "message": message}
+    return {"success": True, **result}
 
 @router.get("/subjects")
 def get_all_subjects(db: Session = Depends(get_db), _admin = Depends(require_admin)):
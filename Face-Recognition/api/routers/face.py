@@ -1,11 +1,22 @@
-from fastapi import APIRouter, Depends
+import shutil
+import uuid
+from pathlib import Path
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Request, Header
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from database import get_db
 from pydantic import BaseModel
-from typing import Optional
-from models import Student, AttendanceRecord, AttendanceSession
+from typing import List, Optional
+from models import Student, AttendanceRecord, AttendanceSession, ClassStudent
 from services.face_recognition import face_recognition_service
+from services.ingest import enrolment_ingest
+from services.upload_buffers import upload_buffers
+from services.inference_dispatch import inference_dispatcher
+from services.result_cache import idempotency_keys
+from services.metrics import pipeline_metrics
+from services.video_attendance import video_attendance_jobs, VIDEO_UPLOAD_DIR
 from routers.auth import require_admin
+from routers.uploads import read_image_upload
 from datetime import datetime, date
 
 router = APIRouter(prefix="/api/face", tags=["Face Recognition"])
@@ -20,6 +31,27 @@ class FaceRecognitionResponse(BaseModel):
     confidence: Optional[float] = None
     message: str
 
+class ClassPhotoRequest(BaseModel):
+    image_base64: str
+    class_id: int
+
+class RecognizedFace(BaseModel):
+    box: List[int]
+    detection_score: float
+    confidence: Optional[float] = None
+    student_id: Optional[int] = None
+    student_name: Optional[str] = None
+    student_code: Optional[str] = None
+    status: Optional[str] = None
+
+class ClassPhotoResponse(BaseModel):
+    success: bool
+    session_id: Optional[int] = None
+    marked_count: int = 0
+    recognized: List[RecognizedFace] = []
+    unmatched: List[RecognizedFace] = []
+    message: str
+
 def get_or_create_session(db: Session, class_id: int):
     today = date.today()
 
@@ -40,10 +72,43 @@ def get_or_create_session(db: Session, class_id: int):
     return session
 
 @router.post("/recognize", response_model=FaceRecognitionResponse)
-def recognize_face(request: FaceRecognitionRequest, db: Session = Depends(get_db), admin_session = Depends(require_admin)):
-    from models import Class
+async def recognize_face(
+    request: FaceRecognitionRequest,
+    idempotency_key: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+    admin_session = Depends(require_admin)
+):
+    """A retry sent with the same ``Idempotency-Key`` header gets the first
+    response back instead of being recognized and marked again."""
+    async def handle():
+        name, confidence, message = await inference_dispatcher.run(
+            face_recognition_service.recognize_face, request.image_base64, "selfie"
+        )
+        return await run_in_threadpool(mark_recognized, db, name, confidence, message)
+
+    return await idempotency_keys.run(("recognize", admin_session.id, idempotency_key), handle)
 
-    name, confidence, message = face_recognition_service.recognize_face(request.image_base64)
+@router.post("/recognize-image", response_model=FaceRecognitionResponse)
+async def recognize_face_image(
+    request: Request,
+    idempotency_key: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+    admin_session = Depends(require_admin)
+):
+    """/recognize for an image sent as a raw body (Content-Type: image/jpeg or
+    image/png) or as the ``image`` file of a multipart form, without base64."""
+    async def handle():
+        async with read_image_upload(request) as upload:
+            name, confidence, message = await inference_dispatcher.run(
+                face_recognition_service.recognize_bytes, upload.view(), "selfie", on_submit=upload.hold
+            )
+        return await run_in_threadpool(mark_recognized, db, name, confidence, message)
+
+    return await idempotency_keys.run(("recognize-image", admin_session.id, idempotency_key), handle)
+
+@pipeline_metrics.timed("db_write")
+def mark_recognized(db: Session, name, confidence, message):
+    from models import Class
 
     if name is None:
         return {
@@ -59,8 +124,8 @@ def recognize_face(request: FaceRecognitionRequest, db: Session = Depends(get_db
         return text
 
     normalized_recognized = normalize_name(name)
-    student = None
-    for s in db.query(Student).all():
+    student = db.query(Student).filter(Student.student_code == name).first()
+    for s in ([] if student else db.query(Student).all()):
         if normalize_name(s.full_name) == normalized_recognized:
             student = s
             break
@@ -117,11 +182,160 @@ def recognize_face(request: FaceRecognitionRequest, db: Session = Depends(get_db
             "message": "Student recognized (no active session)"
         }
 
+@router.post("/recognize-class", response_model=ClassPhotoResponse)
+async def recognize_class_photo(request: ClassPhotoRequest, db: Session = Depends(get_db), admin_session = Depends(require_admin)):
+    roster = await run_in_threadpool(class_photo_roster, db, request.class_id)
+    if not roster:
+        return {"success": False, "message": "Class has no enrolled students"}
+
+    faces, message = await inference_dispatcher.run(
+        face_recognition_service.recognize_faces, request.image_base64, set(roster), "classroom"
+    )
+    if not faces:
+        return {"success": False, "message": message}
+
+    return await run_in_threadpool(mark_class_photo, db, request, roster, faces, admin_session.id)
+
+def class_photo_roster(db: Session, class_id: int):
+    from models import Class
+
+    cls = db.query(Class).filter(Class.id == class_id).first()
+    if not cls:
+        raise HTTPException(status_code=404, detail="Class not found")
+
+    return {
+        s.student_code: s for s in db.query(Student).join(
+            ClassStudent, ClassStudent.student_id == Student.id
+        ).filter(ClassStudent.class_id == class_id).all()
+    }
+
+@pipeline_metrics.timed("db_write")
+def mark_class_photo(db: Session, request: ClassPhotoRequest, roster, faces, created_by):
+    today = date.today()
+    now = datetime.now().replace(microsecond=0)
+    attendance_session = db.query(AttendanceSession).filter(
+        AttendanceSession.class_id == request.class_id,
+        AttendanceSession.session_date == today
+    ).first()
+    if not attendance_session:
+        attendance_session = AttendanceSession(
+            class_id=request.class_id,
+            session_date=today,
+            start_time=now.time(),
+            end_time=now.time(),
+            created_by=created_by
+        )
+        db.add(attendance_session)
+        db.flush()
+
+    already_marked = {
+        r.student_id for r in db.query(AttendanceRecord.student_id).filter(
+            AttendanceRecord.session_id == attendance_session.id
+        ).all()
+    }
+
+    # One face per student: keep the most confident detection of each
+    best_faces = {}
+    unmatched = []
+    for face in faces:
+        student = roster.get(face["name"]) if face["name"] else None
+        if student is None:
+            unmatched.append({"box": face["box"], "detection_score": face["detection_score"],
+                              "confidence": face["confidence"]})
+            continue
+        current = best_faces.get(student.id)
+        if current is None or face["confidence"] > current[1]["confidence"]:
+            best_faces[student.id] = (student, face)
+
+    recognized = []
+    new_records = []
+    for student, face in best_faces.values():
+        status = "already_marked" if student.id in already_marked else "present"
+        if status == "present":
+            new_records.append(AttendanceRecord(
+                session_id=attendance_session.id,
+                student_id=student.id,
+                status="present",
+                confidence=face["confidence"],
+                check_in_time=now
+            ))
+        recognized.append({
+            "box": face["box"],
+            "detection_score": face["detection_score"],
+            "confidence": face["confidence"],
+            "student_id": student.id,
+            "student_name": student.full_name,
+            "student_code": student.student_code,
+            "status": status
+        })
+
+    db.add_all(new_records)
+    db.commit()
+
+    return {
+        "success": True,
+        "session_id": attendance_session.id,
+        "marked_count": len(new_records),
+        "recognized": recognized,
+        "unmatched": unmatched,
+        "message": f"Marked {len(new_records)} of {len(faces)} detected faces"
+    }
+
+@router.post("/recognize-video")
+def recognize_class_video(
+    class_id: int = Form(...),
+    video: UploadFile = File(...),
+    session_id: Optional[int] = Form(None),
+    started_at: Optional[datetime] = Form(None),
+    db: Session = Depends(get_db),
+    admin_session = Depends(require_admin)
+):
+    """Queue attendance from a recorded lecture video; poll it with /video-jobs/{job_id}.
+
+    ``started_at`` is the wall-clock time of the first frame, used to turn each
+    student's first appearance into a check-in time.
+    """
+    from models import Class
+
+    if not db.query(Class).filter(Class.id == class_id).first():
+        raise HTTPException(status_code=404, detail="Class not found")
+
+    upload_dir = Path(VIDEO_UPLOAD_DIR)
+    upload_dir.mkdir(parents=True, exist_ok=True)
+    video_path = upload_dir / (uuid.uuid4().hex + (Path(video.filename or "").suffix or ".mp4"))
+    with open(video_path, "wb") as out:
+        shutil.copyfileobj(video.file, out, 1 << 20)
+
+    job = video_attendance_jobs.submit(class_id, video_path, session_id=session_id,
+                                       started_at=started_at, created_by=admin_session.id)
+    return {"success": True, "job_id": job["id"], "job": job}
+
+@router.get("/video-jobs/{job_id}")
+def get_video_job(job_id: str, _admin = Depends(require_admin)):
+    job = video_attendance_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Video attendance job not found")
+    return job
+
 @router.get("/status")
 def get_model_status():
     return {
         "model_loaded": face_recognition_service.model_loaded,
+        "model_version": face_recognition_service.model_version,
+        "registry_version": face_recognition_service.registry.current_version(),
+        "last_reload": face_recognition_service.last_reload,
         "model_path": face_recognition_service.model_path,
-        "classifier_path": face_recognition_service.classifier_path
+        "classifier_path": face_recognition_service.classifier_path,
+        "matcher": face_recognition_service.matcher_backend,
+        "gallery": face_recognition_service.gallery.stats(),
+        "batching": face_recognition_service.batching_stats(),
+        "detection_profiles": face_recognition_service.detection_stats(),
+        "inference_pool": face_recognition_service.pool_health(),
+        "ingest": enrolment_ingest.stats(),
+        "upload_buffers": upload_buffers.stats(),
+        "inference": inference_dispatcher.stats(),
+        "result_cache": face_recognition_service.result_cache_stats(),
+        "idempotency": idempotency_keys.stats(),
+        "video_attendance": video_attendance_jobs.stats()
     }
 
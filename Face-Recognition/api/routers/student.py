@@ -1,18 +1,24 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Request, Header
 from fastapi.responses import FileResponse
 from sqlalchemy.orm import Session
 from database import get_db
 from models import User, Student, Class, ClassSchedule, ClassStudent, AttendanceSession, AttendanceRecord, Teacher, Subject, TeacherRequest
 from routers.auth import require_student
+from routers.uploads import read_image_upload
+from services.inference_dispatch import inference_dispatcher, InferenceBusy
+from services.result_cache import idempotency_keys
+from services.metrics import pipeline_metrics
 from datetime import datetime, date, time
-from typing import List
+from typing import List, Optional
 from pydantic import BaseModel
 import os
-import shutil
 from pathlib import Path
 
 router = APIRouter(prefix="/api/student", tags=["student"])
 
+RAW_DIR = Path(__file__).parent.parent.parent / "Dataset" / "FaceData" / "raw"
+PROCESSED_DIR = Path(__file__).parent.parent.parent / "Dataset" / "FaceData" / "processed"
+
 class ChangePasswordRequest(BaseModel):
     old_password: str
     new_password: str
@@ -319,11 +325,25 @@ def get_my_attendance(
 
 @router.post("/check-in")
 async def student_check_in(
+    request: Request,
     class_id: int,
-    image_base64: str,
+    image_base64: Optional[str] = None,
+    idempotency_key: Optional[str] = Header(None),
     user: User = Depends(require_student),
     db: Session = Depends(get_db)
 ):
+    """Check in with a selfie, sent as a raw image/jpeg body or a multipart
+    ``image`` file; the ``image_base64`` query parameter is still accepted.
+
+    A retry sent with the same ``Idempotency-Key`` header gets the first
+    successful response back instead of "Already checked in".
+    """
+    return await idempotency_keys.run(
+        ("check-in", user.id, class_id, idempotency_key),
+        lambda: check_in(request, class_id, image_base64, user, db)
+    )
+
+async def check_in(request: Request, class_id: int, image_base64: Optional[str], user: User, db: Session):
     if not user.student:
         raise HTTPException(status_code=404, detail="Student profile not found")
     
@@ -375,17 +395,23 @@ async def student_check_in(
     if existing_record:
         raise HTTPException(status_code=400, detail="Already checked in for this session")
     
-    import base64
     from services.face_recognition import face_recognition_service
     
     try:
-        image_data = base64.b64decode(image_base64)
-        result = await face_recognition_service.recognize_face(image_data)
+        if image_base64:
+            student_code, confidence, message = await inference_dispatcher.run(
+                face_recognition_service.recognize_face, image_base64, "selfie"
+            )
+        else:
+            async with read_image_upload(request) as upload:
+                student_code, confidence, message = await inference_dispatcher.run(
+                    face_recognition_service.recognize_bytes, upload.view(), "selfie", on_submit=upload.hold
+                )
         
-        if not result or not result.get("student_code"):
-            raise HTTPException(status_code=400, detail="Face not recognized")
+        if not student_code:
+            raise HTTPException(status_code=400, detail=f"Face not recognized: {message}")
         
-        if result["student_code"] != user.student.student_code:
+        if student_code != user.student.student_code:
             raise HTTPException(status_code=400, detail="Face does not match your profile")
         
         status = "present"
@@ -399,19 +425,22 @@ async def student_check_in(
             student_id=user.student.id,
             status=status,
             check_in_time=now,
-            confidence=result.get("confidence")
+            confidence=confidence
         )
-        db.add(record)
-        db.commit()
+        with pipeline_metrics.stage("db_write"):
+            db.add(record)
+            db.commit()
         
         return {
             "success": True,
             "status": status,
             "check_in_time": str(now),
-            "confidence": result.get("confidence"),
+            "confidence": confidence,
             "message": f"Checked in successfully as {status}"
         }
         
+    except (HTTPException, InferenceBusy):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Check-in failed: {str(e)}")
 
@@ -458,6 +487,8 @@ async def capture_face(
                 "message": f"Capture failed: {result.stderr or 'Unknown error'}"
             }
 
+        from services.enrolment import capture_report
+
         # Count captured images
         raw_dir = project_root / "Dataset" / "FaceData" / "raw" / student_code
         if raw_dir.exists():
@@ -469,6 +500,7 @@ async def capture_face(
             "success": True,
             "message": f"Đã chụp {images_count} ảnh thành công cho {user.student.full_name}. Vui lòng bấm 'Train Model' để hoàn tất.",
             "images_count": images_count,
+            "diversity": capture_report(result.stdout),
             "student_code": student_code,
             "student_name": user.student.full_name
         }
@@ -490,9 +522,7 @@ async def train_model(
     user: User = Depends(require_student),
     db: Session = Depends(get_db)
 ):
-    """Train face recognition model (student only)"""
-    import asyncio
-
+    """Queue a face recognition training job (student only); poll it with /train-model/jobs/{job_id}"""
     if not user.student:
         raise HTTPException(status_code=404, detail="Student profile not found")
 
@@ -508,37 +538,31 @@ async def train_model(
             "message": "Chưa có ảnh để train. Vui lòng chụp ảnh trước."
         }
 
-    try:
-        print(f"Training model for {student_code}...")
-        from services.training import training_service
+    from services.training_jobs import training_jobs
 
-        loop = asyncio.get_event_loop()
-        train_success, train_message = await loop.run_in_executor(None, training_service.train_model)
+    job, coalesced = training_jobs.submit(student_code)
+    print(f"Training requested by {student_code}: job {job['id']} ({'joined' if coalesced else 'queued'})")
 
-        if train_success:
-            from services.face_recognition import face_recognition_service
-            face_recognition_service.model_loaded = False
-            print(f"Training completed: {train_message}")
+    return {
+        "success": True,
+        "message": f"Đã đưa yêu cầu train model của {user.student.full_name} vào hàng đợi.",
+        "student_code": student_code,
+        "student_name": user.student.full_name,
+        "job_id": job["id"],
+        "coalesced": coalesced,
+        "job": job
+    }
 
-            return {
-                "success": True,
-                "message": f"Train model thành công cho {user.student.full_name}!",
-                "student_code": student_code,
-                "student_name": user.student.full_name,
-                "train_message": train_message
-            }
-        else:
-            print(f"Training failed: {train_message}")
-            return {
-                "success": False,
-                "message": f"Train model thất bại: {train_message}"
-            }
 
-    except Exception as e:
-        return {
-            "success": False,
-            "message": f"Training error: {str(e)}"
-        }
+@router.get("/train-model/jobs/{job_id}")
+def get_training_job(job_id: str, user: User = Depends(require_student)):
+    """Progress of a training job (stage, images processed, ETA)"""
+    from services.training_jobs import training_jobs
+
+    job = training_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Training job not found")
+    return job
 
 
 @router.post("/upload-face-images")
@@ -553,39 +577,90 @@ async def upload_face_images(
 
     student_code = user.student.student_code
 
-    # Create directory for student's face data
-    base_dir = Path("Dataset/FaceData/processed")
-    student_dir = base_dir / student_code
+    # Uploads are raw images like captures; the ingest pipeline aligns them
+    student_dir = RAW_DIR / student_code
     student_dir.mkdir(parents=True, exist_ok=True)
 
-    uploaded_files = []
+    uploads = []
     for file in files:
         if not file.content_type.startswith("image/"):
             continue
+        uploads.append((file.filename, await file.read()))
+
+    def save_distinct():
+        import cv2
+        import numpy as np
+        from services.enrolment import enrolment_filter, filter_report
+
+        # Near-duplicates of images already kept (on disk or earlier in this
+        # upload) are dropped, as are images of this upload beyond the target
+        # pose count
+        diversity = enrolment_filter(student_dir)
+        saved = []
+        rejected = []
+        for original_name, content in uploads:
+            img = cv2.imdecode(np.frombuffer(content, np.uint8), cv2.IMREAD_COLOR)
+            if img is None:
+                continue
+            kept, reason = diversity.offer(img)
+            if not kept:
+                rejected.append({"filename": original_name, "reason": reason})
+                continue
+
+            # Generate unique filename
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+            ext = os.path.splitext(original_name)[1]
+            filename = f"{student_code}_{timestamp}{ext}"
+            file_path = student_dir / filename
+
+            # Save file
+            with open(file_path, "wb") as buffer:
+                buffer.write(content)
+
+            saved.append({
+                "filename": filename,
+                "path": str(file_path)
+            })
+        return saved, rejected, filter_report(diversity)
 
-        # Generate unique filename
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
-        ext = os.path.splitext(file.filename)[1]
-        filename = f"{student_code}_{timestamp}{ext}"
-        file_path = student_dir / filename
-
-        # Save file
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-
-        uploaded_files.append({
-            "filename": filename,
-            "path": str(file_path)
-        })
-
+    import asyncio
+    from services.ingest import enrolment_ingest
+
+    loop = asyncio.get_event_loop()
+    uploaded_files, rejected_files, diversity = await loop.run_in_executor(None, save_distinct)
+    # Align, crop and embed in the background so the student is recognisable in seconds
+    for uploaded in uploaded_files:
+        uploaded["ingest"] = enrolment_ingest.submit(student_code, uploaded["path"])
+
+    over_target = sum(1 for rejected in rejected_files if rejected["reason"] == "target")
+    skipped = []
+    if len(rejected_files) > over_target:
+        skipped.append(f"{len(rejected_files) - over_target} near-duplicate images skipped")
+    if over_target:
+        skipped.append(f"{over_target} images beyond the {diversity['target']} distinct poses per upload skipped")
     return {
         "success": True,
         "uploaded_count": len(uploaded_files),
+        "rejected_count": len(rejected_files),
         "files": uploaded_files,
+        "rejected": rejected_files,
+        "diversity": diversity,
         "message": f"Uploaded {len(uploaded_files)} images for {student_code}"
+                   + (f" ({'; '.join(skipped)})" if skipped else "")
     }
 
 
+@router.get("/ingest/{ticket_id}")
+def get_ingest_status(ticket_id: str, user: User = Depends(require_student)):
+    """Whether an uploaded image has been aligned and added to the gallery yet"""
+    from services.ingest import enrolment_ingest
+
+    ticket = enrolment_ingest.get(ticket_id)
+    if ticket is None or not user.student or ticket["student_code"] != user.student.student_code:
+        raise HTTPException(status_code=404, detail="Ingest ticket not found")
+    return ticket
+
+
 @router.get("/my-face-images")
 def get_my_face_images(
     user: User = Depends(require_student),
@@ -596,7 +671,7 @@ def get_my_face_images(
         raise HTTPException(status_code=404, detail="Student profile not found")
 
     student_code = user.student.student_code
-    student_dir = Path("Dataset/FaceData/processed") / student_code
+    student_dir = RAW_DIR / student_code
 
     if not student_dir.exists():
         return {"images": [], "count": 0}
@@ -628,7 +703,7 @@ def delete_my_face_image(
         raise HTTPException(status_code=404, detail="Student profile not found")
 
     student_code = user.student.student_code
-    file_path = Path("Dataset/FaceData/processed") / student_code / filename
+    file_path = RAW_DIR / student_code / filename
 
     if not file_path.exists():
         raise HTTPException(status_code=404, detail="Image not found")
@@ -638,6 +713,13 @@ def delete_my_face_image(
         raise HTTPException(status_code=400, detail="Invalid filename")
 
     file_path.unlink()
+    # The aligned crop and the gallery template embedded from it go too, so
+    # the deleted face stops matching now rather than after the next training
+    crop_path = PROCESSED_DIR / student_code / (file_path.stem + ".png")
+    if crop_path.exists():
+        crop_path.unlink()
+    from services.face_recognition import face_recognition_service
+    face_recognition_service.remove_face_file(crop_path)
 
     return {
         "success": True,
@@ -649,13 +731,12 @@ def delete_my_face_image(
 async def recognize_attendance(
     class_id: int,
     session_date: str = None,
+    files: List[UploadFile] = File(...),
     user: User = Depends(require_student),
     db: Session = Depends(get_db)
 ):
-    """Recognize face using computer camera and mark attendance"""
-    import subprocess
-    import sys
-    import asyncio
+    """Recognize face from uploaded camera frames and mark attendance"""
+    from services.face_recognition import face_recognition_service
 
     if not user.student:
         raise HTTPException(status_code=404, detail="Student profile not found")
@@ -677,42 +758,24 @@ async def recognize_attendance(
     if not cls:
         raise HTTPException(status_code=404, detail="Class not found")
 
-    # Path to recognize script
-    project_root = Path(__file__).parent.parent.parent
-    recognize_script = project_root / "src" / "recognize.py"
-
-    if not recognize_script.exists():
-        raise HTTPException(status_code=500, detail=f"Recognition script not found: {recognize_script}")
-
     try:
-        # Run recognition script
-        print(f"Starting face recognition for {user.student.full_name}...")
-        result = subprocess.run(
-            [sys.executable, str(recognize_script)],
-            cwd=str(project_root / "src"),
-            capture_output=True,
-            text=True,
-            timeout=60  # 1 minute timeout
-        )
-
-        print("Recognition stdout:", result.stdout)
-        if result.stderr:
-            print("Recognition stderr:", result.stderr)
-
-        if result.returncode != 0:
-            # Extract only the last error line from stderr (skip TensorFlow warnings)
-            error_lines = [line for line in result.stderr.split('\n') if line.strip() and 'ERROR' in line.upper()]
-            error_msg = error_lines[-1] if error_lines else "Không thể nhận diện khuôn mặt. Vui lòng thử lại."
+        frames = [await file.read() for file in files]
+        if not frames:
             return {
                 "success": False,
-                "message": error_msg
+                "message": "No frames uploaded"
             }
 
-        # Get recognized student_code from stdout (last non-empty line)
-        stdout_lines = [line.strip() for line in result.stdout.split('\n') if line.strip()]
-        recognized_code = stdout_lines[-1] if stdout_lines else ""
+        # Same two-hit confirmation as src/recognize.py, on the shared warm model
+        recognized_code, confidence, frames_used, message = await inference_dispatcher.run(
+            face_recognition_service.confirm_identity, frames
+        )
 
-        print(f"Recognized code: {recognized_code}", file=sys.stderr)
+        if recognized_code is None:
+            return {
+                "success": False,
+                "message": f"Không thể nhận diện khuôn mặt. Vui lòng thử lại. ({message})"
+            }
 
         # Verify it matches the logged-in student
         if recognized_code != user.student.student_code:
@@ -754,17 +817,20 @@ async def recognize_attendance(
             # Update existing record
             attendance_record.status = "present"
             attendance_record.check_in_time = current_time
+            attendance_record.confidence = confidence
         else:
             # Create new record
             attendance_record = AttendanceRecord(
                 session_id=attendance_session.id,
                 student_id=user.student.id,
                 status="present",
-                check_in_time=current_time
+                check_in_time=current_time,
+                confidence=confidence
             )
             db.add(attendance_record)
 
-        db.commit()
+        with pipeline_metrics.stage("db_write"):
+            db.commit()
 
         return {
             "success": True,
@@ -774,14 +840,13 @@ async def recognize_attendance(
             "class_name": cls.class_name,
             "date": str(target_date),
             "check_in_time": str(current_time),
-            "status": "present"
+            "status": "present",
+            "confidence": confidence,
+            "frames_used": frames_used
         }
 
-    except subprocess.TimeoutExpired:
-        return {
-            "success": False,
-            "message": "Recognition timeout (exceeded 1 minute)"
-        }
+    except InferenceBusy:
+        raise
     except Exception as e:
         print(f"Recognition error: {str(e)}")
         return {
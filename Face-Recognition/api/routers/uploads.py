@@ -0,0 +1,47 @@
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException, Request
+from starlette.concurrency import run_in_threadpool
+
+from services.upload_buffers import upload_buffers, UploadTooLarge
+
+RAW_IMAGE_TYPES = ("image/jpeg", "image/png", "image/webp", "application/octet-stream")
+
+
+@asynccontextmanager
+async def read_image_upload(request: Request, field: str = "image"):
+    """Read an image sent as a raw body (``Content-Type: image/jpeg`` etc.) or as
+    the ``field`` file of a multipart form into a pooled buffer.
+
+    Yields the UploadBuffer; ``view()`` is the encoded image, valid inside the
+    ``async with`` block. A call that reads the view on another thread must
+    ``hold()`` the buffer for its future (``on_submit=upload.hold`` with
+    InferenceDispatcher.run), so a cancelled request cannot hand the buffer to
+    the next upload while the call still decodes it.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    with upload_buffers.buffer() as buffer:
+        try:
+            if content_type == "multipart/form-data":
+                form = await request.form()
+                upload = form.get(field)
+                if upload is None or isinstance(upload, str):
+                    raise HTTPException(status_code=400, detail=f"Missing '{field}' file")
+                await run_in_threadpool(buffer.read_from, upload.file)
+            elif content_type in RAW_IMAGE_TYPES:
+                length = request.headers.get("content-length")
+                if length and length.isdigit():
+                    buffer.reserve(int(length))
+                async for chunk in request.stream():
+                    buffer.write(chunk)
+            else:
+                raise HTTPException(
+                    status_code=415,
+                    detail=f"Send the image as a raw image/jpeg or image/png body or a multipart '{field}' file"
+                )
+        except UploadTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+
+        if buffer.size == 0:
+            raise HTTPException(status_code=400, detail="Empty image")
+        yield buffer
@@ -0,0 +1,145 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class EmbeddingBatcher:
+    """Collects aligned crops from concurrent requests and embeds them together.
+
+    Callers block in ``embed`` while a single dispatcher thread drains the queue,
+    waiting at most ``max_wait_ms`` after the first crop arrives (or until
+    ``max_batch_size`` crops are queued) before running one batched forward pass.
+    """
+
+    def __init__(self, run_batch, max_batch_size=16, max_wait_ms=10.0, name="embedding-batcher"):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.name = name
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+        self._stats_lock = threading.Lock()
+        self._started_at = time.time()
+        self._total_batches = 0
+        self._total_crops = 0
+        self._total_wait = 0.0
+        self._total_run = 0.0
+        self._largest_batch = 0
+        self._errors = 0
+        self._recent = deque()  # (finished_at, batch_size) for the throughput window
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def submit(self, crop):
+        """Queue one prewhitened crop and return a Future for its embedding."""
+        future = Future()
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError("Embedding batcher is stopped")
+            self._queue.append((crop, future, time.perf_counter()))
+            self._cond.notify()
+        if self._thread is None:
+            self.start()
+        return future
+
+    def embed(self, crops):
+        """Embed a list of crops, returning an array with one row per crop."""
+        futures = [self.submit(crop) for crop in crops]
+        return np.stack([future.result() for future in futures])
+
+    def _take_batch(self):
+        with self._cond:
+            while not self._queue and not self._stopped:
+                self._cond.wait()
+            if not self._queue:
+                return []
+
+            deadline = self._queue[0][2] + self.max_wait
+            while len(self._queue) < self.max_batch_size and not self._stopped:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch = []
+            while self._queue and len(batch) < self.max_batch_size:
+                batch.append(self._queue.popleft())
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if not batch:
+                return
+
+            started = time.perf_counter()
+            try:
+                embeddings = self.run_batch(np.stack([crop for crop, _, _ in batch]))
+            except Exception as e:
+                with self._stats_lock:
+                    self._errors += 1
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            finished = time.perf_counter()
+
+            for i, (_, future, _) in enumerate(batch):
+                future.set_result(embeddings[i])
+
+            self._record(batch, started, finished)
+
+    def _record(self, batch, started, finished):
+        size = len(batch)
+        now = time.time()
+        with self._stats_lock:
+            self._total_batches += 1
+            self._total_crops += size
+            self._total_wait += sum(started - queued_at for _, _, queued_at in batch)
+            self._total_run += finished - started
+            self._largest_batch = max(self._largest_batch, size)
+            self._recent.append((now, size))
+            while self._recent and now - self._recent[0][0] > 60:
+                self._recent.popleft()
+
+    def stats(self):
+        with self._stats_lock:
+            batches = self._total_batches
+            crops = self._total_crops
+            now = time.time()
+            window = min(60.0, max(now - self._started_at, 1e-6))
+            recent_crops = sum(size for finished_at, size in self._recent if now - finished_at <= 60)
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "queue_depth": len(self._queue),
+                "total_batches": batches,
+                "total_crops": crops,
+                "errors": self._errors,
+                "largest_batch": self._largest_batch,
+                "mean_batch_size": crops / batches if batches else 0.0,
+                "mean_batch_fill": crops / (batches * self.max_batch_size) if batches else 0.0,
+                "mean_queue_wait_ms": self._total_wait / crops * 1000.0 if crops else 0.0,
+                "mean_run_ms": self._total_run / batches * 1000.0 if batches else 0.0,
+                "throughput_crops_per_sec": recent_crops / window,
+            }
@@ -0,0 +1,136 @@
+import os
+import threading
+
+import cv2
+import numpy as np
+
+# JPEG reductions OpenCV can decode in the DCT domain, coarsest first
+REDUCED_DECODE_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                        (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+
+class DetectionProfile:
+    """Expected face size range for one kind of input.
+
+    ``min_face`` and ``max_face`` are absolute pixels when above 1 and a
+    fraction of the shorter image side otherwise; ``max_face=None`` leaves the
+    top of the MTCNN pyramid open. Only the pyramid scales that can produce
+    faces in the range are run through PNet.
+    """
+
+    def __init__(self, name, min_face=20, max_face=None):
+        self.name = name
+        self.min_face = min_face
+        self.max_face = max_face
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.frames = 0
+            self.pnet_calls = 0
+            self.pnet_time = 0.0
+            self.detect_time = 0.0
+            self.faces = 0
+
+    @staticmethod
+    def _to_pixels(size, shorter_side):
+        return size if size > 1 else size * shorter_side
+
+    def sizes(self, height, width):
+        """``(minsize, maxsize)`` in pixels for a ``height`` x ``width`` frame."""
+        shorter_side = min(height, width)
+        minsize = max(self._to_pixels(self.min_face, shorter_side), 1.0)
+        maxsize = None
+        if self.max_face is not None:
+            maxsize = max(self._to_pixels(self.max_face, shorter_side), minsize)
+        return minsize, maxsize
+
+    def record(self, pnet_calls, pnet_time, detect_time, faces):
+        with self._lock:
+            self.frames += 1
+            self.pnet_calls += pnet_calls
+            self.pnet_time += pnet_time
+            self.detect_time += detect_time
+            self.faces += faces
+
+    def stats(self):
+        with self._lock:
+            frames = max(self.frames, 1)
+            return {
+                "min_face": self.min_face,
+                "max_face": self.max_face,
+                "frames": self.frames,
+                "faces": self.faces,
+                "mean_pnet_calls": self.pnet_calls / frames,
+                "mean_pnet_ms": self.pnet_time * 1000.0 / frames,
+                "mean_detect_ms": self.detect_time * 1000.0 / frames
+            }
+
+
+def _parse_size(value):
+    value = value.strip().lower()
+    if value in ("", "none"):
+        return None
+    return float(value)
+
+
+def _profile_from_env(name, default):
+    """Read ``FACE_PROFILE_<NAME>=<min>:<max>``, e.g. ``0.15:none`` or ``20:0.3``."""
+    min_face, max_face = os.getenv(f"FACE_PROFILE_{name.upper()}", default).split(":")
+    return DetectionProfile(name, _parse_size(min_face) or 20, _parse_size(max_face))
+
+
+def load_profiles():
+    """Detection profiles by name. ``default`` keeps the historic minsize=20 pyramid."""
+    return {
+        "default": DetectionProfile("default", 20, None),
+        # Check-in selfies and webcam frames hold one face filling a good part of the frame
+        "selfie": _profile_from_env("selfie", "0.15:none"),
+        # Group photos: many small faces, none taking up a large part of the picture
+        "classroom": _profile_from_env("classroom", "16:0.35")
+    }
+
+
+def jpeg_size(data):
+    """``(height, width)`` from the frame header of a JPEG, or ``None`` for other formats."""
+    view = memoryview(data)
+    if len(view) < 4 or view[0] != 0xFF or view[1] != 0xD8:
+        return None
+    i = 2
+    while i + 9 < len(view):
+        if view[i] != 0xFF:
+            return None
+        marker = view[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:  # markers without a length
+            i += 2
+            continue
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            return (view[i + 5] << 8) | view[i + 6], (view[i + 7] << 8) | view[i + 8]
+        i += 2 + ((view[i + 2] << 8) | view[i + 3])
+    return None
+
+
+def decode_reduced(data, profile, crop_size=160):
+    """Decode an encoded image at the coarsest JPEG scale (1/2, 1/4 or 1/8) at
+    which the smallest face ``profile`` looks for still spans ``crop_size``
+    pixels, so face crops are only ever downscaled.
+
+    Returns ``(frame, scale)`` with ``scale`` the full-resolution pixels per
+    decoded pixel; other formats and small images decode at full size.
+    """
+    buffer = np.frombuffer(data, np.uint8)
+    size = jpeg_size(data) if profile is not None else None
+    if size is not None:
+        minsize, _ = profile.sizes(size[0], size[1])
+        for factor, flag in REDUCED_DECODE_FLAGS:
+            if minsize / factor >= crop_size:
+                frame = cv2.imdecode(buffer, flag)
+                if frame is None:
+                    break
+                # EXIF orientation may have swapped the sides
+                return frame, max(size) / float(max(frame.shape[0], frame.shape[1]))
+    return cv2.imdecode(buffer, cv2.IMREAD_COLOR), 1.0
@@ -0,0 +1,106 @@
+import os
+import sys
+import json
+import threading
+from collections import OrderedDict
+
+import cv2
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '../../'))
+
+from src.face_diversity import DiversityFilter, dhash
+
+ENROLL_TARGET = int(os.getenv("FACE_ENROLL_TARGET", "30"))
+ENROLL_HASH_DISTANCE = int(os.getenv("FACE_ENROLL_HASH_DISTANCE", "6"))
+ENROLL_EMBEDDING_DISTANCE = float(os.getenv("FACE_ENROLL_EMBEDDING_DISTANCE", "0.3"))
+ENROLL_CACHED_FOLDERS = int(os.getenv("FACE_ENROLL_CACHED_FOLDERS", "64"))
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# student folder -> {path: (mtime, dhash, embedding)} of the images already on
+# disk, so each upload does not re-read and re-embed the student's whole folder.
+# Each scan keeps only the files still present; the least recently scanned
+# folders are evicted beyond ENROLL_CACHED_FOLDERS.
+_existing_cache = OrderedDict()
+_cache_lock = threading.Lock()
+# Embedding slot of an image in which face_embedding found no face
+NO_FACE = "no_face"
+
+
+def _face_embedding():
+    """FaceNet embedding function when the model is already loaded; enrolment
+    never triggers a model load by itself and falls back to hashes only."""
+    from services.face_recognition import face_recognition_service
+
+    if ENROLL_EMBEDDING_DISTANCE <= 0 or not face_recognition_service.model_loaded:
+        return None
+    return face_recognition_service.face_embedding
+
+
+def _existing_entry(cached, path, embed):
+    """``(mtime, dhash, embedding)`` of one image on disk. The embedding is None
+    when it was not computed (no model) and NO_FACE when there is no face, which
+    is cached like an embedding so the image is not re-detected on every upload."""
+    mtime = os.path.getmtime(path)
+    if cached is not None and cached[0] == mtime and (cached[2] is not None or embed is None):
+        return cached
+    img = cv2.imread(path)
+    if img is None:
+        return None
+    embedding = None
+    if embed is not None:
+        embedding = embed(img)
+        if embedding is None:
+            embedding = NO_FACE
+    return mtime, dhash(img), embedding
+
+
+def enrolment_filter(student_dir):
+    """DiversityFilter for new images of a student, seeded with the images
+    already in ``student_dir`` so repeated uploads do not add duplicates.
+    FACE_ENROLL_TARGET caps the images kept from one upload; the images
+    already on disk do not count towards it."""
+    embed = _face_embedding()
+    diversity = DiversityFilter(max_hash_distance=ENROLL_HASH_DISTANCE,
+                                min_embedding_distance=ENROLL_EMBEDDING_DISTANCE,
+                                target=ENROLL_TARGET, embed=embed)
+    student_dir = str(student_dir)
+    with _cache_lock:
+        cached = _existing_cache.pop(student_dir, {})
+    scanned = {}
+    if os.path.isdir(student_dir):
+        for name in sorted(os.listdir(student_dir)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                path = os.path.join(student_dir, name)
+                entry = _existing_entry(cached.get(path), path, embed)
+                if entry is None:
+                    continue
+                scanned[path] = entry
+                diversity.add_existing(entry[1], None if entry[2] is NO_FACE else entry[2])
+    with _cache_lock:
+        _existing_cache[student_dir] = scanned
+        while len(_existing_cache) > ENROLL_CACHED_FOLDERS:
+            _existing_cache.popitem(last=False)
+    return diversity
+
+
+def filter_report(diversity):
+    """Kept/rejected counts plus the training time the rejected frames would have cost."""
+    return _with_savings(diversity.stats())
+
+
+def capture_report(stdout):
+    """filter_report of a src/capture.py run, from the DIVERSITY line it prints."""
+    for line in reversed(stdout.splitlines()):
+        if line.startswith("DIVERSITY "):
+            return _with_savings(json.loads(line[len("DIVERSITY "):]))
+    return None
+
+
+def _with_savings(stats):
+    from services.training import training_service
+
+    seconds_per_image = training_service.seconds_per_image()
+    stats["estimated_training_seconds_saved"] = (
+        None if seconds_per_image is None else round(stats["rejected"] * seconds_per_image, 2)
+    )
+    return stats
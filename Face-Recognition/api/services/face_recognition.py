@@ -5,15 +5,278 @@ import cv2
 import numpy as np
 from datetime import datetime
 import threading
+import collections
+import time
+from contextlib import contextmanager
+
+from services.batching import EmbeddingBatcher
+from services.gallery import EmbeddingGallery
+from services.matchers import ClassifierMatcher, GalleryMatcher
+from services.inference_pool import InferencePool
+from services.model_registry import ModelRegistry
+from services.detection import load_profiles, decode_reduced
+from services.metrics import pipeline_metrics
+from services.result_cache import ResultCache, content_hash, RESULT_CACHE_SIZE, RESULT_CACHE_TTL
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '../../'))
 
+BATCHING_ENABLED = os.getenv("FACE_BATCHING_ENABLED", "true").lower() == "true"
+BATCH_MAX_SIZE = int(os.getenv("FACE_BATCH_MAX_SIZE", "16"))
+BATCH_MAX_WAIT_MS = float(os.getenv("FACE_BATCH_MAX_WAIT_MS", "10"))
+MATCHER_BACKEND = os.getenv("FACE_MATCHER", "classifier").lower()
+GALLERY_DIR = os.getenv("FACE_GALLERY_DIR", "../Models/gallery")
+GALLERY_THRESHOLD = float(os.getenv("FACE_GALLERY_THRESHOLD", "1.0"))
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+INFERENCE_WORKERS = int(os.getenv("FACE_INFERENCE_WORKERS", "0"))
+INFERENCE_SLOT_MB = int(os.getenv("FACE_INFERENCE_SLOT_MB", "12"))
+MODEL_REGISTRY_DIR = os.getenv("FACE_MODEL_REGISTRY_DIR", "../Models/registry")
+MODEL_REGISTRY_KEEP = int(os.getenv("FACE_MODEL_REGISTRY_KEEP", "5"))
+MODEL_PATH = os.getenv("FACE_MODEL_PATH", "../Models/20180402-114759.pb")
+TFLITE_THREADS = int(os.getenv("FACE_TFLITE_THREADS", "0")) or None
+LOADER_THREADS = int(os.getenv("FACE_LOADER_THREADS", "0")) or max(1, min(4, os.cpu_count() or 1))
+REDUCED_DECODE = os.getenv("FACE_REDUCED_DECODE", "true").lower() == "true"
+DETECT_FACE_PX = float(os.getenv("FACE_DETECT_FACE_PX", "48"))
+WARMUP_SIZES = [tuple(int(v) for v in size.split("x"))
+                for size in os.getenv("FACE_WARMUP_SIZES", "600x450,640x480,1280x720").split(",") if size]
+
+def face_source(path):
+    """Key a gallery template by the absolute path and modification time of the
+    crop it was embedded from, so a crop rewritten in place (the aligner and the
+    ingest write the same processed/<code>/<stem>.png) no longer matches its key."""
+    path = os.path.normpath(os.path.abspath(str(path)))
+    return f"{path}@{os.stat(path).st_mtime_ns}"
+
+def source_path(source):
+    """Crop path of a face_source key (keys written before they held the mtime are bare paths)."""
+    path, sep, mtime = source.rpartition("@")
+    return path if sep and mtime.isdigit() else source
+
+def student_crops(student_dir):
+    """The aligned face crops in one student's processed folder, sorted."""
+    if not os.path.isdir(student_dir):
+        return []
+    return [os.path.join(student_dir, f) for f in sorted(os.listdir(student_dir))
+            if f.lower().endswith(IMAGE_EXTENSIONS)]
+
+class ModelBundle:
+    """One loaded model version: its own TF graph and session, MTCNN nets,
+    FaceNet tensors, matcher and embedding batcher.
+
+    ``refs`` counts requests currently using the bundle; a retired bundle is
+    closed by whichever request releases the last reference.
+    """
+
+    def __init__(self, manifest, matcher, use_batcher=True):
+        self.manifest = manifest
+        self.version = manifest["version"]
+        self.matcher = matcher
+        self.refs = 0
+        self.retired = False
+        self.closed = False
+        self.batcher = None
+        if use_batcher:
+            self.batcher = EmbeddingBatcher(
+                self.embed,
+                max_batch_size=BATCH_MAX_SIZE,
+                max_wait_ms=BATCH_MAX_WAIT_MS,
+                name=f"embedding-batcher-{self.version}"
+            )
+
+    def load(self):
+        import tensorflow as tf
+        tf.compat.v1.disable_v2_behavior()
+
+        from src import facenet
+        from src.align import detect_face
+
+        self.detect_face = detect_face
+
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            gpu_options = tf.compat.v1.GPUOptions(per_process_gpu_memory_fraction=0.6)
+            self.sess = tf.compat.v1.Session(
+                graph=self.graph,
+                config=tf.compat.v1.ConfigProto(gpu_options=gpu_options, log_device_placement=False)
+            )
+
+            graph_path = self.manifest["graph"]
+            self.tflite = None
+            if graph_path.endswith(".tflite"):
+                # int8 variant from src/export_inference_graph.py; MTCNN stays on the TF session
+                self.tflite = facenet.TFLiteEmbedder(graph_path, num_threads=TFLITE_THREADS)
+                self.embedding_size = self.tflite.embedding_size
+            else:
+                facenet.load_model(graph_path)
+
+                self.images_placeholder = self.graph.get_tensor_by_name("input:0")
+                self.embeddings = self.graph.get_tensor_by_name("embeddings:0")
+                # Inference-only graphs have phase_train folded away
+                try:
+                    self.phase_train_placeholder = self.graph.get_tensor_by_name("phase_train:0")
+                except KeyError:
+                    self.phase_train_placeholder = None
+                self.embedding_size = self.embeddings.get_shape()[1]
+
+            self.pnet, self.rnet, self.onet = detect_face.create_mtcnn(self.sess, None)
+        return self
+
+    @staticmethod
+    def detection_geometry(height, width, profile=None, scale=1.0):
+        """``(shrink, minsize, maxsize)`` MTCNN runs with on an ``height`` x ``width``
+        frame decoded at ``1/scale`` of the original image.
+
+        Profile sizes refer to the original image. When the smallest wanted face
+        is well above DETECT_FACE_PX (ONet's 48 px input by default), detection
+        runs on a copy shrunk by ``shrink`` so that face is about that size.
+        """
+        if profile is None:
+            return 1.0, 20, None
+        minsize, maxsize = profile.sizes(height * scale, width * scale)
+        minsize /= scale
+        maxsize = None if maxsize is None else maxsize / scale
+        shrink = minsize / DETECT_FACE_PX if DETECT_FACE_PX > 0 else 1.0
+        if shrink < 1.5:
+            return 1.0, minsize, maxsize
+        return shrink, minsize / shrink, None if maxsize is None else maxsize / shrink
+
+    def detect(self, frame, profile=None, scale=1.0):
+        """Run MTCNN on a frame, restricted to the face sizes of a DetectionProfile.
+
+        Boxes are in ``frame`` pixels; ``scale`` is the original image pixels
+        per frame pixel when the frame was decoded reduced.
+        """
+        stats = {}
+        started = time.perf_counter()
+        height, width = frame.shape[0], frame.shape[1]
+        shrink, minsize, maxsize = self.detection_geometry(height, width, profile, scale)
+        image = frame
+        if shrink > 1.0:
+            image = cv2.resize(frame, (max(1, int(round(width / shrink))), max(1, int(round(height / shrink)))),
+                               interpolation=cv2.INTER_AREA)
+        bounding_boxes, _ = self.detect_face.detect_face(
+            image, minsize, self.pnet, self.rnet, self.onet,
+            [0.6, 0.7, 0.7], 0.709, maxsize=maxsize, stats=stats
+        )
+        if shrink > 1.0 and len(bounding_boxes):
+            bounding_boxes[:, 0] *= width / float(image.shape[1])
+            bounding_boxes[:, 2] *= width / float(image.shape[1])
+            bounding_boxes[:, 1] *= height / float(image.shape[0])
+            bounding_boxes[:, 3] *= height / float(image.shape[0])
+        if profile is not None:
+            profile.record(stats["pnet_calls"], stats["pnet_time"],
+                           time.perf_counter() - started, len(bounding_boxes))
+        pipeline_metrics.record_detection(stats)
+        return bounding_boxes
+
+    def embed(self, crops):
+        """Run the FaceNet embedding net on a stacked batch of prewhitened crops."""
+        pipeline_metrics.record_batch("embedding", len(crops))
+        with pipeline_metrics.stage("embedding"):
+            if self.tflite is not None:
+                return self.tflite.embed(crops)
+            feed_dict = {self.images_placeholder: crops}
+            if self.phase_train_placeholder is not None:
+                feed_dict[self.phase_train_placeholder] = False
+            return self.sess.run(self.embeddings, feed_dict=feed_dict)
+
+    def embed_faces(self, crops):
+        """Embed crops, going through the batching dispatcher when it is enabled."""
+        if self.batcher is not None:
+            return self.batcher.embed(crops)
+        return self.embed(np.stack(crops))
+
+    def classify(self, embs, candidates=None):
+        pipeline_metrics.record_batch("classification", len(embs))
+        with pipeline_metrics.stage("classification"):
+            return self.matcher.match(embs, candidates=candidates)
+
+    def warm_up(self, frame_sizes, profiles=None):
+        """Push dummy tensors through every network and return timings in seconds.
+
+        PNet is run at each pyramid scale the detection ``profiles`` use on the
+        given ``(width, height)`` frame sizes, RNet/ONet at single and batched
+        inputs, and the embedding net at batch 1 and the batcher's max batch size.
+        """
+        timings = {}
+        seen = set()
+        for profile in profiles or [None]:
+            for width, height in frame_sizes:
+                started = time.perf_counter()
+                shrink, minsize, maxsize = self.detection_geometry(height, width, profile)
+                h, w = int(round(height / shrink)), int(round(width / shrink))
+                for scale in self.detect_face.pyramid_scales(h, w, minsize, 0.709, maxsize):
+                    hs, ws = int(np.ceil(h * scale)), int(np.ceil(w * scale))
+                    if (hs, ws) in seen:
+                        continue
+                    seen.add((hs, ws))
+                    self.pnet(np.zeros((1, ws, hs, 3), dtype=np.float32))
+                name = "default" if profile is None else profile.name
+                timings[f"pnet_{name}_{width}x{height}"] = time.perf_counter() - started
+
+        for n in sorted({1, 16}):
+            started = time.perf_counter()
+            self.rnet(np.zeros((n, 24, 24, 3), dtype=np.float32))
+            timings[f"rnet_batch{n}"] = time.perf_counter() - started
+            started = time.perf_counter()
+            self.onet(np.zeros((n, 48, 48, 3), dtype=np.float32))
+            timings[f"onet_batch{n}"] = time.perf_counter() - started
+
+        for n in sorted({1, self.batcher.max_batch_size if self.batcher is not None else 1}):
+            started = time.perf_counter()
+            self.embed(np.zeros((n, 160, 160, 3), dtype=np.float32))
+            timings[f"embedding_batch{n}"] = time.perf_counter() - started
+
+        return timings
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.batcher is not None:
+            self.batcher.stop()
+        self.sess.close()
+        print(f"Closed face recognition model version {self.version}")
+
 class FaceRecognitionService:
     def __init__(self):
-        self.model_path = "../Models/20180402-114759.pb"
+        self.model_path = MODEL_PATH
         self.classifier_path = "../Models/facemodel.pkl"
-        self.model_loaded = False
+        self.matcher_backend = MATCHER_BACKEND
+        self.gallery = EmbeddingGallery(GALLERY_DIR, threshold=GALLERY_THRESHOLD)
+        self.registry = ModelRegistry(MODEL_REGISTRY_DIR, self.model_path, self.classifier_path, GALLERY_DIR,
+                                      keep=MODEL_REGISTRY_KEEP, in_use=self._versions_in_use)
+        self.pool = None
+        if INFERENCE_WORKERS > 0:
+            self.pool = InferencePool(INFERENCE_WORKERS, slot_bytes=INFERENCE_SLOT_MB * 1024 * 1024)
+        self.batching_enabled = BATCHING_ENABLED
+        self.result_cache = None
+        if RESULT_CACHE_SIZE > 0:
+            self.result_cache = ResultCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL)
+        self.detection_profiles = load_profiles()
+        self.load_state = "not_loaded"
+        self.load_error = None
+        self.load_duration = None
+        self.warmup_timings = {}
+        self.last_reload = None
+        self._bundle = None
+        self._draining = set()  # retired bundles requests still hold
         self._load_lock = threading.Lock()
+        self._swap_lock = threading.Lock()
+
+    @property
+    def model_loaded(self):
+        return self._bundle is not None
+
+    @property
+    def model_version(self):
+        return self._bundle.version if self._bundle is not None else None
+
+    def _build_bundle(self, manifest):
+        from src import facenet
+        self.facenet = facenet
+
+        bundle = ModelBundle(manifest, self._create_matcher(manifest), use_batcher=self.batching_enabled)
+        return bundle.load()
 
     def load_model(self):
         if self.model_loaded:
@@ -23,101 +286,503 @@ class FaceRecognitionService:
             if self.model_loaded:
                 return
 
+            self.load_state = "loading"
+            started = time.perf_counter()
             try:
-                import tensorflow as tf
-                tf.compat.v1.disable_v2_behavior()
-                import pickle
+                self._bundle = self._build_bundle(self.registry.manifest())
+                self.load_duration = time.perf_counter() - started
+                self.load_state = "loaded"
+                self.load_error = None
+                print(f"Face recognition model {self._bundle.version} loaded successfully")
 
-                with open(self.classifier_path, 'rb') as f:
-                    self.model, self.class_names = pickle.load(f)
+            except Exception as e:
+                self.load_state = "failed"
+                self.load_error = str(e)
+                print(f"Error loading model: {e}")
+                raise
 
-                from src import facenet
-                from src.align import detect_face
+    def reload_model(self, version=None):
+        """Build ``version`` (default: the registry's current one) beside the live
+        model, warm it, and swap it in. Requests already holding the old bundle
+        finish on it; it is closed once the last of them releases it.
+        """
+        with self._load_lock:
+            started = time.perf_counter()
+            manifest = self.registry.manifest(version)
+            bundle = self._build_bundle(manifest)
+            try:
+                bundle.warm_up(WARMUP_SIZES[:1], self.detection_profiles.values())
+            except Exception:
+                bundle.close()
+                raise
 
-                self.facenet = facenet
-                self.detect_face = detect_face
+            with self._swap_lock:
+                old = self._bundle
+                self._bundle = bundle
+                close_old = False
+                if old is not None:
+                    old.retired = True
+                    close_old = old.refs == 0
+                    if not close_old:
+                        self._draining.add(old)
+            if close_old:
+                old.close()
+            if self.result_cache is not None:
+                self.result_cache.clear()
 
-                gpu_options = tf.compat.v1.GPUOptions(per_process_gpu_memory_fraction=0.6)
-                self.sess = tf.compat.v1.Session(config=tf.compat.v1.ConfigProto(gpu_options=gpu_options, log_device_placement=False))
+            self.load_state = "ready" if self.load_state == "ready" else "loaded"
+            self.last_reload = {
+                "version": bundle.version,
+                "previous_version": old.version if old is not None else None,
+                "latency_ms": round((time.perf_counter() - started) * 1000.0, 2),
+                "at": datetime.now().isoformat(timespec="seconds")
+            }
+            print(f"Face recognition model swapped to {bundle.version} in {self.last_reload['latency_ms']} ms")
 
-                self.facenet.load_model(self.model_path)
+        if self.pool is not None and self.pool.started:
+            self.pool.recycle()
+        return self.last_reload
 
-                self.images_placeholder = tf.compat.v1.get_default_graph().get_tensor_by_name("input:0")
-                self.embeddings = tf.compat.v1.get_default_graph().get_tensor_by_name("embeddings:0")
-                self.phase_train_placeholder = tf.compat.v1.get_default_graph().get_tensor_by_name("phase_train:0")
-                self.embedding_size = self.embeddings.get_shape()[1]
+    @contextmanager
+    def _use_model(self):
+        """Pin the live bundle for the duration of one request."""
+        if not self.model_loaded:
+            self.load_model()
 
-                pnet, rnet, onet = self.detect_face.create_mtcnn(self.sess, None)
-                self.pnet = pnet
-                self.rnet = rnet
-                self.onet = onet
+        with self._swap_lock:
+            bundle = self._bundle
+            bundle.refs += 1
+        try:
+            yield bundle
+        finally:
+            with self._swap_lock:
+                bundle.refs -= 1
+                close = bundle.retired and bundle.refs == 0
+                if close:
+                    self._draining.discard(bundle)
+            if close:
+                bundle.close()
 
-                self.model_loaded = True
-                print("Face recognition model loaded successfully")
+    def _versions_in_use(self):
+        """Model versions loaded in this process, which the registry must keep on disk."""
+        with self._swap_lock:
+            bundles = list(self._draining) + ([self._bundle] if self._bundle is not None else [])
+        return {bundle.version for bundle in bundles}
 
-            except Exception as e:
-                print(f"Error loading model: {e}")
-                raise
-    
-    def recognize_face(self, image_base64: str):
-        if not self.model_loaded:
-            self.load_model()
+    def warm_up(self, frame_sizes=None):
+        """Load the models and run every network once on dummy tensors, so the
+        first real request does not pay for graph optimisation.
+        """
+        try:
+            with self._use_model() as bundle:
+                timings = bundle.warm_up(frame_sizes or WARMUP_SIZES, self.detection_profiles.values())
+
+            if self.pool is not None:
+                started = time.perf_counter()
+                self.pool.start()
+                timings["inference_pool_start"] = time.perf_counter() - started
+
+            self.warmup_timings = {name: round(seconds * 1000.0, 2) for name, seconds in timings.items()}
+            self.load_state = "ready"
+            print(f"Face recognition warm-up finished: {self.warmup_timings}")
+
+        except Exception as e:
+            self.load_state = "failed"
+            self.load_error = str(e)
+            print(f"Error warming up model: {e}")
+
+    def readiness(self):
+        return {
+            "ready": self.load_state == "ready",
+            "state": self.load_state,
+            "error": self.load_error,
+            "load_duration_ms": round(self.load_duration * 1000.0, 2) if self.load_duration is not None else None,
+            "warmup_ms": self.warmup_timings
+        }
 
+    def shutdown(self):
+        if self._bundle is not None:
+            self._bundle.close()
+        if self.pool is not None:
+            self.pool.stop()
+
+    def _create_matcher(self, manifest):
+        if self.matcher_backend == "gallery":
+            return GalleryMatcher(self.gallery)
+        if self.matcher_backend == "classifier":
+            return ClassifierMatcher(manifest["classifier"], self.gallery)
+        raise ValueError(f"Unknown matcher backend: {self.matcher_backend}")
+
+    def _profile(self, name):
         try:
-            if ',' in image_base64:
-                image_base64 = image_base64.split(',')[1]
+            return self.detection_profiles[name]
+        except KeyError:
+            raise ValueError(f"Unknown detection profile: {name}")
 
-            image_data = base64.b64decode(image_base64)
-            nparr = np.frombuffer(image_data, np.uint8)
-            frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    def detection_stats(self):
+        return {name: profile.stats() for name, profile in self.detection_profiles.items()}
 
-            if frame is None:
-                return None, 0.0, "Failed to decode image"
+    def _decode_image(self, image_base64: str):
+        return self._decode_bytes(self._base64_bytes(image_base64))
 
-            bounding_boxes, _ = self.detect_face.detect_face(
-                frame, 20, self.pnet, self.rnet, self.onet,
-                [0.6, 0.7, 0.7], 0.709
-            )
+    def _decode_bytes(self, image_data):
+        nparr = np.frombuffer(image_data, np.uint8)
+        return cv2.imdecode(nparr, cv2.IMREAD_COLOR)
 
-            if len(bounding_boxes) == 0:
-                return None, 0.0, "No face detected"
+    def _decode_for(self, image_data, profile):
+        """``(frame, scale)``: JPEG uploads are decoded as small as the profile's
+        smallest face allows (see services.detection.decode_reduced)."""
+        with pipeline_metrics.stage("decode"):
+            if not REDUCED_DECODE:
+                return self._decode_bytes(image_data), 1.0
+            return decode_reduced(image_data, self._profile(profile))
 
-            det = bounding_boxes[0, 0:4]
+    def _base64_bytes(self, image_base64: str):
+        if ',' in image_base64:
+            image_base64 = image_base64.split(',')[1]
+        return base64.b64decode(image_base64)
 
-            bb = np.zeros(4, dtype=np.int32)
-            bb[0] = np.maximum(det[0] - 32 / 2, 0)
-            bb[1] = np.maximum(det[1] - 32 / 2, 0)
-            bb[2] = np.minimum(det[2] + 32 / 2, frame.shape[1])
-            bb[3] = np.minimum(det[3] + 32 / 2, frame.shape[0])
+    def _align(self, frame, det, margin=32, image_size=160):
+        return self.facenet.prewhiten(self._crop(frame, det, margin, image_size))
 
-            cropped = frame[bb[1]:bb[3], bb[0]:bb[2], :]
-            aligned = cv2.resize(cropped, (160, 160))
+    def _crop(self, frame, det, margin=32, image_size=160):
+        """The face crop training uses: box plus margin, resized to image_size."""
+        bb = np.zeros(4, dtype=np.int32)
+        bb[0] = np.maximum(det[0] - margin / 2, 0)
+        bb[1] = np.maximum(det[1] - margin / 2, 0)
+        bb[2] = np.minimum(det[2] + margin / 2, frame.shape[1])
+        bb[3] = np.minimum(det[3] + margin / 2, frame.shape[0])
 
-            prewhitened = self.facenet.prewhiten(aligned)
+        cropped = frame[bb[1]:bb[3], bb[0]:bb[2], :]
+        return cv2.resize(cropped, (image_size, image_size))
 
-            feed_dict = {
-                self.images_placeholder: [prewhitened],
-                self.phase_train_placeholder: False
-            }
-            emb = self.sess.run(self.embeddings, feed_dict=feed_dict)[0]
+    def recognize_face(self, image_base64: str, profile="selfie"):
+        try:
+            return self._recognize_encoded(self._base64_bytes(image_base64), profile)
+
+        except Exception as e:
+            return None, 0.0, f"Error: {str(e)}"
+
+    def recognize_bytes(self, image_data, profile="selfie"):
+        """recognize_face for an encoded image already in memory; a bytearray or
+        memoryview (e.g. a pooled upload buffer) is decoded in place, without a copy."""
+        try:
+            return self._recognize_encoded(image_data, profile)
+
+        except Exception as e:
+            return None, 0.0, f"Error: {str(e)}"
+
+    def _recognize_encoded(self, image_data, profile):
+        """Recognize an encoded image, answering repeats of the same bytes from
+        the result cache while the model and gallery are unchanged."""
+        if self.result_cache is None:
+            return self._recognize_decoded(*self._decode_for(image_data, profile), profile)
+
+        key = (self.model_version, self._gallery_revision(), profile, content_hash(image_data))
+        return self.result_cache.get_or_compute(
+            key,
+            lambda: self._recognize_decoded(*self._decode_for(image_data, profile), profile),
+            cacheable=lambda result: not result[2].startswith("Error")
+        )
+
+    def _gallery_revision(self):
+        # Both matchers read the gallery (the classifier for students it was not trained on)
+        return self.gallery.revision
 
-            predictions = self.model.predict_proba([emb])
-            best_class_indices = np.argmax(predictions, axis=1)
-            best_class_probabilities = predictions[
-                np.arange(len(best_class_indices)),
-                best_class_indices
-            ]
+    def _recognize_decoded(self, frame, scale, profile):
+        if frame is None:
+            return None, 0.0, "Failed to decode image"
 
-            name = self.class_names[best_class_indices[0]]
-            confidence = best_class_probabilities[0]
+        if self.pool is not None:
+            return self.pool.recognize(frame, profile, scale)
 
-            return name, confidence, "Success"
+        return self.recognize_frame(frame, profile, scale)
+
+    def recognize_frame(self, frame, profile="selfie", scale=1.0):
+        """Recognize the first detected face of an already decoded BGR frame
+        (decoded at ``1/scale`` of the original image)."""
+        try:
+            with self._use_model() as bundle:
+                bounding_boxes = bundle.detect(frame, self._profile(profile), scale)
+
+                if len(bounding_boxes) == 0:
+                    return None, 0.0, "No face detected"
+
+                prewhitened = self._align(frame, bounding_boxes[0, 0:4], margin=32 / scale)
+                emb = bundle.embed_faces([prewhitened])[0]
+
+                names, confidences = bundle.classify([emb])
+
+            if names[0] is None:
+                return None, float(confidences[0]), "Unknown face"
+
+            return names[0], float(confidences[0]), "Success"
 
         except Exception as e:
             return None, 0.0, f"Error: {str(e)}"
-    
+
+    def recognize_faces(self, image_base64: str, candidates=None, profile="classroom"):
+        """Recognize every face in one frame with a single batched embedding run.
+
+        Returns ``(faces, message)`` where each face is a dict holding its box,
+        detection score, matched name (``None`` when unmatched) and confidence.
+        """
+        try:
+            frame, scale = self._decode_for(self._base64_bytes(image_base64), profile)
+
+            if frame is None:
+                return [], "Failed to decode image"
+
+            with self._use_model() as bundle:
+                bounding_boxes = bundle.detect(frame, self._profile(profile), scale)
+
+                if len(bounding_boxes) == 0:
+                    return [], "No face detected"
+
+                crops = np.stack([self._align(frame, det[0:4], margin=32 / scale) for det in bounding_boxes])
+                embs = bundle.embed(crops)
+                names, confidences = bundle.classify(embs, candidates=candidates)
+
+            faces = []
+            for det, name, confidence in zip(bounding_boxes, names, confidences):
+                faces.append({
+                    # Boxes are reported in pixels of the uploaded image
+                    "box": [int(round(v * scale)) for v in det[0:4]],
+                    "detection_score": float(det[4]),
+                    "name": name,
+                    "confidence": float(confidence)
+                })
+            return faces, "Success"
+
+        except Exception as e:
+            return [], f"Error: {str(e)}"
+
+    def largest_face(self, bundle, frame, profile="selfie"):
+        """Bounding box of the largest face MTCNN finds in a BGR frame, or ``None``."""
+        bounding_boxes = bundle.detect(frame, self._profile(profile))
+        if len(bounding_boxes) == 0:
+            return None
+        areas = (bounding_boxes[:, 2] - bounding_boxes[:, 0]) * (bounding_boxes[:, 3] - bounding_boxes[:, 1])
+        return bounding_boxes[np.argmax(areas), 0:4]
+
+    def face_embedding(self, frame, profile="selfie"):
+        """Embedding of the largest face in a BGR frame, or ``None`` without a face."""
+        with self._use_model() as bundle:
+            det = self.largest_face(bundle, frame, profile)
+            if det is None:
+                return None
+            return bundle.embed_faces([self._align(frame, det)])[0]
+
+    def align_faces(self, frames, profile="selfie"):
+        """Training crops of the largest face in each BGR frame plus their embeddings.
+
+        Returns ``(crops, embeddings)``: ``crops[i]`` is the uint8 crop of frame
+        ``i`` or ``None`` without a face; ``embeddings`` has one row per found
+        crop, computed in a single batch.
+        """
+        with self._use_model() as bundle:
+            crops = []
+            for frame in frames:
+                det = self.largest_face(bundle, frame, profile)
+                crops.append(None if det is None else self._crop(frame, det))
+            found = [self.facenet.prewhiten(crop) for crop in crops if crop is not None]
+            embeddings = bundle.embed(np.stack(found)) if found else np.zeros((0, 0), dtype=np.float32)
+        return crops, embeddings
+
+    def recognize_stream(self, frames, candidates=None, profile="classroom", batch_size=32, on_detect=None):
+        """Recognize every face of a stream of ``(timestamp, frame)`` pairs.
+
+        Faces are cropped as frames arrive and embedded ``batch_size`` at a time
+        across frames; after each embedding run this yields a list of
+        ``(timestamp, name, confidence)`` for the faces of that batch.
+        ``on_detect(timestamp, nrof_faces)`` is called once each frame is
+        detected. The model version is pinned for the whole stream.
+        """
+        profile = self._profile(profile)
+        with self._use_model() as bundle:
+            crops, timestamps = [], []
+            for timestamp, frame in frames:
+                bounding_boxes = bundle.detect(frame, profile)
+                for det in bounding_boxes:
+                    crops.append(self._align(frame, det[0:4]))
+                    timestamps.append(timestamp)
+                if on_detect is not None:
+                    on_detect(timestamp, len(bounding_boxes))
+                if len(crops) >= batch_size:
+                    yield self._classify_crops(bundle, crops, timestamps, candidates)
+                    crops, timestamps = [], []
+            if crops:
+                yield self._classify_crops(bundle, crops, timestamps, candidates)
+
+    def _classify_crops(self, bundle, crops, timestamps, candidates):
+        names, confidences = bundle.classify(bundle.embed(np.stack(crops)), candidates=candidates)
+        return [(timestamp, name, float(confidence))
+                for timestamp, name, confidence in zip(timestamps, names, confidences)]
+
+    def confirm_identity(self, frames_data, required_hits=2, threshold=0.75, min_face_ratio=0.25, frame_width=600,
+                         profile="selfie"):
+        """Two-hit confirmation over uploaded camera frames, as done by src/recognize.py.
+
+        Frames are processed in order; a frame counts only when it holds exactly one
+        face taller than ``min_face_ratio`` of the frame and the match confidence
+        exceeds ``threshold``. Returns ``(name, confidence, frames_used, message)``
+        as soon as one identity reaches ``required_hits``.
+        """
+        with self._use_model() as bundle:
+            return self._confirm_identity(bundle, frames_data, required_hits, threshold, min_face_ratio, frame_width,
+                                          self._profile(profile))
+
+    def _confirm_identity(self, bundle, frames_data, required_hits, threshold, min_face_ratio, frame_width, profile):
+        person_detected = collections.Counter()
+        best_confidence = {}
+        message = "No face recognized"
+
+        for index, image_data in enumerate(frames_data):
+            with pipeline_metrics.stage("decode"):
+                frame = self._decode_bytes(image_data)
+            if frame is None:
+                message = "Failed to decode image"
+                continue
+
+            if frame.shape[1] != frame_width:
+                height = int(round(frame.shape[0] * frame_width / frame.shape[1]))
+                frame = cv2.resize(frame, (frame_width, height), interpolation=cv2.INTER_AREA)
+
+            bounding_boxes = bundle.detect(frame, profile)
+            faces_found = bounding_boxes.shape[0]
+            if faces_found > 1:
+                message = "Only one face allowed"
+                continue
+            if faces_found == 0:
+                message = "No face detected"
+                continue
+
+            bb = bounding_boxes[0, 0:4].astype(np.int32)
+            if (bb[3] - bb[1]) / frame.shape[0] <= min_face_ratio:
+                message = "Face too small, please move closer"
+                continue
+
+            cropped = frame[max(bb[1], 0):bb[3], max(bb[0], 0):bb[2], :]
+            scaled = cv2.resize(cropped, (160, 160), interpolation=cv2.INTER_CUBIC)
+            emb = bundle.embed_faces([self.facenet.prewhiten(scaled)])
+
+            names, confidences = bundle.classify(emb)
+            name, confidence = names[0], float(confidences[0])
+            if name is None or confidence <= threshold:
+                message = "Unknown face"
+                continue
+
+            person_detected[name] += 1
+            best_confidence[name] = max(confidence, best_confidence.get(name, 0.0))
+            if person_detected[name] >= required_hits:
+                return name, best_confidence[name], index + 1, "Success"
+
+        return None, 0.0, len(frames_data), message
+
+    def enroll_student(self, student_code, aligned_images, batch_size=64):
+        """Embed already aligned face crops and append them to the gallery."""
+        added = 0
+        with self._use_model() as bundle:
+            for start in range(0, len(aligned_images), batch_size):
+                batch = [self.facenet.prewhiten(img) for img in aligned_images[start:start + batch_size]]
+                added += self.gallery.add(student_code, bundle.embed(np.stack(batch)))
+        return added
+
+    def enroll_files(self, student_code, paths, batch_size=64):
+        """Embed aligned face crops stored on disk and append them to the gallery.
+
+        Crops are decoded and prewhitened by an ImageLoader into float32 batches,
+        the next batch being prepared while the current one is embedded.
+        """
+        from src.image_loader import ImageLoader
+
+        def read_bgr(path):
+            return cv2.resize(cv2.imread(path), (160, 160))
+
+        paths = [p for p in paths if cv2.haveImageReader(p)]
+        loader = ImageLoader(160, batch_size, nrof_threads=LOADER_THREADS, decode=read_bgr)
+        added = 0
+        with self._use_model() as bundle:
+            for start, batch in loader.batches(paths):
+                sources = [face_source(p) for p in paths[start:start + len(batch)]]
+                added += self.gallery.add(student_code, bundle.embed(batch), sources)
+        return added
+
+    def remove_student(self, student_code):
+        return self.gallery.remove(student_code)
+
+    def remove_face_file(self, path):
+        """Drop the gallery templates embedded from one aligned crop
+        (processed/<code>/<stem>.png), whichever version of it they came from."""
+        path = os.path.normpath(os.path.abspath(str(path)))
+        student_code = os.path.basename(os.path.dirname(path))
+        return self.gallery.remove_sources([source for source in self.gallery.sources_of(student_code)
+                                            if source is not None and source_path(source) == path])
+
+    def sync_student(self, student_code, paths):
+        """Bring a student's templates in line with their aligned crops on disk:
+        embed the crops without a template and drop templates whose crop is gone
+        or has been rewritten since.
+
+        A student with templates of unknown origin (added before the gallery
+        kept crop paths) is re-enrolled from all crops. Returns ``(enrolled, removed)``.
+        """
+        on_disk = {face_source(p): p for p in paths}
+        known = self.gallery.sources_of(student_code)
+        if None in known:
+            removed = self.remove_student(student_code)
+            return self.enroll_files(student_code, list(on_disk.values())), removed
+
+        missing = [p for source, p in on_disk.items() if source not in known]
+        removed = self.gallery.remove_sources(known - on_disk.keys())
+        return self.enroll_files(student_code, missing) if missing else 0, removed
+
+    def sync_gallery(self, processed_dir):
+        """Enroll face crops missing from the gallery and drop templates whose
+        crop (or whole student folder) is gone.
+
+        Crops are read with cv2 so templates share the BGR channel order of the
+        images decoded in recognize_face.
+        """
+        on_disk = {}
+        if os.path.isdir(processed_dir):
+            for code in sorted(os.listdir(processed_dir)):
+                paths = student_crops(os.path.join(processed_dir, code))
+                if paths:
+                    on_disk[code] = paths
+
+        enrolled = {}
+        removed = {}
+        for code, paths in on_disk.items():
+            added, dropped = self.sync_student(code, paths)
+            if added:
+                enrolled[code] = added
+            if dropped:
+                removed[code] = dropped
+
+        for code in self.gallery.student_codes():
+            if code not in on_disk:
+                removed[code] = self.remove_student(code)
+
+        return {"enrolled": enrolled, "removed": removed, "gallery": self.gallery.stats()}
+
+    def pool_health(self):
+        if self.pool is None:
+            return {"enabled": False}
+        return self.pool.health()
+
+    def batching_stats(self):
+        bundle = self._bundle
+        if bundle is None or bundle.batcher is None:
+            return {"enabled": self.batching_enabled}
+        return {"enabled": True, **bundle.batcher.stats()}
+
+    def result_cache_stats(self):
+        if self.result_cache is None:
+            return {"enabled": False}
+        return {"enabled": True, **self.result_cache.stats()}
+
     def train_model(self):
         return "Training not implemented in API yet. Please run training scripts manually."
 
 face_recognition_service = FaceRecognitionService()
-
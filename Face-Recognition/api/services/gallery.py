@@ -0,0 +1,252 @@
+import os
+import json
+import threading
+
+import numpy as np
+
+
+class EmbeddingGallery:
+    """Per-student FaceNet templates stored as a memory-mapped float32 matrix.
+
+    Every row is one L2-normalised embedding and ``labels[i]`` is the
+    student_code that owns row ``i``. Matching is a single matrix product
+    against the live rows, so adding or removing a student never needs a
+    retrain of anything. ``sources[i]`` is the face crop row ``i`` was
+    embedded from (None for templates added without one), so a single image
+    can be added or removed without touching the student's other templates.
+    """
+
+    MATRIX_FILE = "embeddings.f32"
+    INDEX_FILE = "index.json"
+    # Rows shortlisted per requested student before de-duplicating by label
+    SHORTLIST_PER_STUDENT = 32
+
+    def __init__(self, gallery_dir, threshold=1.0, initial_capacity=1024):
+        self.gallery_dir = gallery_dir
+        self.threshold = threshold
+        self.initial_capacity = initial_capacity
+        self.dim = None
+        self.size = 0
+        self.capacity = 0
+        self.labels = []
+        self.sources = []
+        self._label_array = np.asarray([], dtype=object)
+        self._matrix = None
+        # Bumped whenever the templates change, so cached matches can be told apart
+        self.revision = 0
+        self._lock = threading.RLock()
+        self.load()
+
+    @property
+    def matrix_path(self):
+        return os.path.join(self.gallery_dir, self.MATRIX_FILE)
+
+    @property
+    def index_path(self):
+        return os.path.join(self.gallery_dir, self.INDEX_FILE)
+
+    def load(self):
+        with self._lock:
+            if not os.path.exists(self.index_path):
+                return
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+            self.dim = index["dim"]
+            self.size = index["size"]
+            self.capacity = index["capacity"]
+            self.labels = index["labels"]
+            # Galleries written before per-file bookkeeping have no sources
+            self.sources = index.get("sources") or [None] * self.size
+            self._label_array = np.asarray(self.labels, dtype=object)
+            self._matrix = np.memmap(self.matrix_path, dtype=np.float32, mode='r+',
+                                     shape=(self.capacity, self.dim))
+            self.revision += 1
+
+    def _save_index(self):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                "dim": self.dim,
+                "size": self.size,
+                "capacity": self.capacity,
+                "labels": self.labels,
+                "sources": self.sources
+            }, f)
+        os.replace(tmp_path, self.index_path)
+
+    def _reserve(self, rows):
+        """Make room for ``rows`` more embeddings, doubling the backing file when full."""
+        needed = self.size + rows
+        if self._matrix is not None and needed <= self.capacity:
+            return
+
+        capacity = max(self.capacity, self.initial_capacity)
+        while capacity < needed:
+            capacity *= 2
+
+        os.makedirs(self.gallery_dir, exist_ok=True)
+        tmp_path = self.matrix_path + ".tmp"
+        grown = np.memmap(tmp_path, dtype=np.float32, mode='w+', shape=(capacity, self.dim))
+        if self._matrix is not None and self.size:
+            grown[:self.size] = self._matrix[:self.size]
+        grown.flush()
+        del grown
+        self._matrix = None
+        os.replace(tmp_path, self.matrix_path)
+
+        self.capacity = capacity
+        self._matrix = np.memmap(self.matrix_path, dtype=np.float32, mode='r+',
+                                 shape=(self.capacity, self.dim))
+
+    @staticmethod
+    def _normalize(embeddings):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if embeddings.ndim == 1:
+            embeddings = embeddings[np.newaxis, :]
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.maximum(norms, 1e-10)
+
+    def add(self, student_code, embeddings, sources=None):
+        """Append templates for a student, optionally with the crop path of each.
+        Returns the number of rows written."""
+        embeddings = self._normalize(embeddings)
+        if len(embeddings) == 0:
+            return 0
+        sources = [None] * len(embeddings) if sources is None else list(sources)
+        if len(sources) != len(embeddings):
+            raise ValueError(f"{len(sources)} sources given for {len(embeddings)} embeddings")
+
+        with self._lock:
+            if self.dim is None:
+                self.dim = int(embeddings.shape[1])
+            elif embeddings.shape[1] != self.dim:
+                raise ValueError(f"Embedding size {embeddings.shape[1]} does not match gallery size {self.dim}")
+
+            self._reserve(len(embeddings))
+            self._matrix[self.size:self.size + len(embeddings)] = embeddings
+            self._matrix.flush()
+            self.labels.extend([student_code] * len(embeddings))
+            self.sources.extend(sources)
+            self._label_array = np.asarray(self.labels, dtype=object)
+            self.size += len(embeddings)
+            self.revision += 1
+            self._save_index()
+            return len(embeddings)
+
+    def remove(self, student_code):
+        """Drop every template of a student by compacting the live rows. Returns rows removed."""
+        with self._lock:
+            return self._compact_locked([i for i, label in enumerate(self.labels) if label != student_code])
+
+    def remove_sources(self, sources):
+        """Drop the templates embedded from the given crop paths. Returns rows removed."""
+        sources = set(sources) - {None}
+        with self._lock:
+            return self._compact_locked([i for i, source in enumerate(self.sources) if source not in sources])
+
+    def _compact_locked(self, keep):
+        """Keep only the rows ``keep`` (in order); the caller holds the lock."""
+        removed = self.size - len(keep)
+        if removed == 0:
+            return 0
+
+        self._matrix[:len(keep)] = self._matrix[keep]
+        self._matrix.flush()
+        self.labels = [self.labels[i] for i in keep]
+        self.sources = [self.sources[i] for i in keep]
+        self._label_array = np.asarray(self.labels, dtype=object)
+        self.size = len(keep)
+        self.revision += 1
+        self._save_index()
+        return removed
+
+    def replace(self, student_code, embeddings, sources=None):
+        with self._lock:
+            self.remove(student_code)
+            return self.add(student_code, embeddings, sources)
+
+    def student_codes(self):
+        with self._lock:
+            return sorted(set(self.labels))
+
+    def sources_of(self, student_code):
+        """Crop paths of a student's templates; None stands for templates without one."""
+        with self._lock:
+            return {source for label, source in zip(self.labels, self.sources) if label == student_code}
+
+    def match(self, embeddings, top_k=1, candidates=None):
+        """Find the closest students for each query embedding.
+
+        Returns one list per query of ``(student_code, distance)`` pairs, best first,
+        holding at most ``top_k`` distinct students. ``candidates`` restricts the
+        search to a set of student codes.
+        """
+        queries = self._normalize(embeddings)
+
+        with self._lock:
+            if self.size == 0:
+                return [[] for _ in range(len(queries))]
+
+            labels = self._label_array
+            rows = np.arange(self.size)
+            if candidates is not None:
+                rows = rows[np.isin(labels, list(candidates))]
+                if rows.size == 0:
+                    return [[] for _ in range(len(queries))]
+            matrix = np.asarray(self._matrix[:self.size])
+            if rows.size != self.size:
+                matrix = matrix[rows]
+                labels = labels[rows]
+
+            similarities = queries @ matrix.T
+
+        results = []
+        for sims in similarities:
+            best = self._top_students(sims, labels, top_k, self.SHORTLIST_PER_STUDENT * top_k)
+            if len(best) < top_k and len(sims) > self.SHORTLIST_PER_STUDENT * top_k:
+                best = self._top_students(sims, labels, top_k, len(sims))
+            results.append(best)
+        return results
+
+    @staticmethod
+    def _top_students(sims, labels, top_k, shortlist):
+        if shortlist < len(sims):
+            rows = np.argpartition(-sims, shortlist - 1)[:shortlist]
+            rows = rows[np.argsort(-sims[rows])]
+        else:
+            rows = np.argsort(-sims)
+
+        best = []
+        seen = set()
+        for row in rows:
+            code = labels[row]
+            if code in seen:
+                continue
+            seen.add(code)
+            distance = float(np.sqrt(max(0.0, 2.0 - 2.0 * float(sims[row]))))
+            best.append((str(code), distance))
+            if len(best) >= top_k:
+                break
+        return best
+
+    def identify(self, embeddings, candidates=None):
+        """Best match per query, or ``None`` when its distance exceeds the threshold."""
+        matches = []
+        for best in self.match(embeddings, top_k=1, candidates=candidates):
+            if best and best[0][1] <= self.threshold:
+                matches.append(best[0])
+            else:
+                matches.append((None, best[0][1] if best else None))
+        return matches
+
+    def stats(self):
+        with self._lock:
+            return {
+                "gallery_dir": self.gallery_dir,
+                "embedding_size": self.dim,
+                "templates": self.size,
+                "capacity": self.capacity,
+                "students": len(set(self.labels)),
+                "revision": self.revision,
+                "threshold": self.threshold
+            }
@@ -0,0 +1,142 @@
+import os
+import math
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from services.face_recognition import INFERENCE_WORKERS
+
+INFERENCE_THREADS = int(os.getenv("FACE_INFERENCE_THREADS", "0")) or max(4, INFERENCE_WORKERS)
+INFERENCE_MAX_QUEUE = int(os.getenv("FACE_INFERENCE_MAX_QUEUE", "32"))
+INFERENCE_QUEUE_TIMEOUT = float(os.getenv("FACE_INFERENCE_QUEUE_TIMEOUT", "10"))
+
+
+class InferenceBusy(Exception):
+    """Raised instead of queueing when recognition is saturated; the API turns it
+    into ``status_code`` with a ``Retry-After`` header."""
+
+    def __init__(self, status_code, message, retry_after):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+        self.retry_after = retry_after
+
+
+class InferenceDispatcher:
+    """Runs recognition calls from async endpoints on a dedicated thread pool.
+
+    Inference never takes a slot of the request threadpool, so a burst of
+    recognitions cannot stall login or schedule requests. At most ``threads``
+    calls run and ``max_queue`` wait; beyond that a request fails at once
+    with 429. A request still queued after ``queue_timeout`` seconds is
+    withdrawn with 503. Both carry a Retry-After estimated from the recent
+    service time.
+    """
+
+    def __init__(self, threads=4, max_queue=32, queue_timeout=10.0, name="inference"):
+        self.threads = max(1, threads)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.name = name
+
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0  # running + queued
+        self._running = 0
+        self._counts = {"submitted": 0, "completed": 0, "failed": 0, "rejected": 0, "expired": 0}
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._run_total = 0.0
+
+    async def run(self, fn, *args, on_submit=None):
+        """Await ``fn(*args)`` on the inference threads.
+
+        ``on_submit`` receives the call's concurrent future. If the awaiting
+        request is cancelled after the call started, run() returns before the
+        call does; arguments the call keeps reading (e.g. a pooled upload
+        buffer) must be held until that future is done.
+        """
+        with self._lock:
+            if self._pending >= self.threads + self.max_queue:
+                self._counts["rejected"] += 1
+                raise InferenceBusy(429, "Too many recognition requests in progress, retry shortly",
+                                    self._retry_after_locked())
+            self._pending += 1
+            self._counts["submitted"] += 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix=self.name)
+
+        submitted = time.perf_counter()
+        future = self._executor.submit(self._call, submitted, fn, args)
+        # A call cancelled before it started never reaches _call, which releases its slot otherwise
+        future.add_done_callback(lambda f: f.cancelled() and self._release())
+        if on_submit is not None:
+            on_submit(future)
+        wrapped = asyncio.wrap_future(future)
+        try:
+            done, _ = await asyncio.wait({wrapped}, timeout=self.queue_timeout)
+        except asyncio.CancelledError:
+            # The client went away; drop the call if it has not started yet
+            future.cancel()
+            raise
+        # cancel() only succeeds while the call is still queued; a started call is awaited to the end
+        if not done and future.cancel():
+            with self._lock:
+                self._counts["expired"] += 1
+                retry_after = self._retry_after_locked()
+            raise InferenceBusy(503, "Recognition is overloaded, retry shortly", retry_after)
+        return await wrapped
+
+    def stats(self):
+        with self._lock:
+            started = self._counts["completed"] + self._counts["failed"] + self._running
+            finished = self._counts["completed"] + self._counts["failed"]
+            return {
+                "threads": self.threads,
+                "max_queue": self.max_queue,
+                "running": self._running,
+                "queued": self._pending - self._running,
+                **self._counts,
+                "avg_wait_ms": round(self._wait_total / started * 1000.0, 1) if started else None,
+                "max_wait_ms": round(self._wait_max * 1000.0, 1),
+                "avg_run_ms": round(self._run_total / finished * 1000.0, 1) if finished else None
+            }
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _call(self, submitted, fn, args):
+        started = time.perf_counter()
+        with self._lock:
+            self._running += 1
+            wait = started - submitted
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+        status = "failed"
+        try:
+            result = fn(*args)
+            status = "completed"
+            return result
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._pending -= 1
+                self._counts[status] += 1
+                self._run_total += time.perf_counter() - started
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+
+    def _retry_after_locked(self):
+        finished = self._counts["completed"] + self._counts["failed"]
+        avg_run = self._run_total / finished if finished else 1.0
+        # Time for the work already admitted to drain through the threads
+        return max(1, math.ceil(avg_run * self._pending / self.threads))
+
+
+inference_dispatcher = InferenceDispatcher(INFERENCE_THREADS, INFERENCE_MAX_QUEUE, INFERENCE_QUEUE_TIMEOUT)
@@ -0,0 +1,284 @@
+import os
+import time
+import queue
+import threading
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+def _worker_main(worker_id, conn, slot_name):
+    """Worker process loop: one MTCNN + FaceNet session per process.
+
+    Frames arrive through shared memory; only the shape, dtype and segment name
+    travel over the pipe.
+    """
+    from services.face_recognition import FaceRecognitionService
+
+    service = FaceRecognitionService()
+    service.batching_enabled = False
+    service.pool = None
+    service.load_model()
+
+    segments = {}
+
+    def attach(name):
+        if name not in segments:
+            # The parent unlinks a slot when it grows it, so drop stale mappings
+            for stale in list(segments):
+                segments.pop(stale).close()
+            segments[name] = shared_memory.SharedMemory(name=name)
+        return segments[name]
+
+    attach(slot_name)
+    conn.send(("ready", os.getpid()))
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+
+        kind = message[0]
+        if kind == "stop":
+            break
+        if kind == "ping":
+            conn.send(("pong", os.getpid()))
+            continue
+
+        _, name, shape, dtype, profile, scale = message
+        try:
+            segment = attach(name)
+            frame = np.ndarray(shape, dtype=dtype, buffer=segment.buf)
+            conn.send(("result", service.recognize_frame(frame, profile, scale)))
+        except Exception as e:
+            conn.send(("result", (None, 0.0, f"Error: {str(e)}")))
+
+    for segment in segments.values():
+        segment.close()
+    conn.close()
+
+
+class _Worker:
+    def __init__(self, worker_id, slot_bytes, ctx):
+        self.worker_id = worker_id
+        self.ctx = ctx
+        self.slot_bytes = slot_bytes
+        self.process = None
+        self.conn = None
+        self.slot = None
+        self.restarts = -1
+        self.served = 0
+        self.failures = 0
+        self.last_latency = None
+        self.started_at = None
+
+    def start(self, timeout):
+        self.close()
+        self.slot = shared_memory.SharedMemory(create=True, size=self.slot_bytes)
+        parent_conn, child_conn = self.ctx.Pipe()
+        self.process = self.ctx.Process(
+            target=_worker_main,
+            args=(self.worker_id, child_conn, self.slot.name),
+            name=f"face-inference-{self.worker_id}",
+            daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+        self.restarts += 1
+        self.started_at = time.time()
+
+        if not self.conn.poll(timeout):
+            raise RuntimeError(f"Inference worker {self.worker_id} did not become ready in {timeout}s")
+        self.conn.recv()
+
+    def ensure_capacity(self, nbytes):
+        """Grow this worker's shared slot when a frame does not fit in it."""
+        if nbytes <= self.slot.size:
+            return
+        old = self.slot
+        self.slot = shared_memory.SharedMemory(create=True, size=nbytes)
+        self.slot_bytes = nbytes
+        old.close()
+        old.unlink()
+
+    def run(self, frame, profile, scale, timeout):
+        self.ensure_capacity(frame.nbytes)
+        view = np.ndarray(frame.shape, dtype=frame.dtype, buffer=self.slot.buf)
+        view[...] = frame
+        del view
+
+        started = time.perf_counter()
+        self.conn.send(("frame", self.slot.name, frame.shape, frame.dtype.str, profile, scale))
+        if not self.conn.poll(timeout):
+            raise TimeoutError(f"Inference worker {self.worker_id} timed out")
+        _, result = self.conn.recv()
+        self.last_latency = time.perf_counter() - started
+        self.served += 1
+        return result
+
+    def ping(self, timeout=2.0):
+        try:
+            self.conn.send(("ping",))
+            if not self.conn.poll(timeout):
+                return False
+            return self.conn.recv()[0] == "pong"
+        except (OSError, EOFError, BrokenPipeError):
+            return False
+
+    def is_alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def close(self):
+        if self.conn is not None:
+            try:
+                self.conn.send(("stop",))
+            except (OSError, BrokenPipeError):
+                pass
+            self.conn.close()
+            self.conn = None
+        if self.process is not None:
+            self.process.join(timeout=5)
+            if self.process.is_alive():
+                self.process.kill()
+                self.process.join(timeout=5)
+            self.process = None
+        if self.slot is not None:
+            self.slot.close()
+            self.slot.unlink()
+            self.slot = None
+
+    def info(self):
+        return {
+            "worker_id": self.worker_id,
+            "pid": self.process.pid if self.process is not None else None,
+            "alive": self.is_alive(),
+            "restarts": max(self.restarts, 0),
+            "served": self.served,
+            "failures": self.failures,
+            "slot_bytes": self.slot_bytes,
+            "last_latency_ms": self.last_latency * 1000.0 if self.last_latency is not None else None,
+            "uptime_s": time.time() - self.started_at if self.started_at else None
+        }
+
+
+class InferencePool:
+    """N worker processes, each with its own MTCNN + FaceNet session.
+
+    The parent decodes the image and copies the frame into the chosen worker's
+    shared-memory slot; workers run detection, embedding and matching off the
+    API process's GIL. Dead or hung workers are restarted by the health monitor
+    or on the next failed request.
+    """
+
+    def __init__(self, num_workers, slot_bytes=1920 * 1920 * 3, request_timeout=30.0,
+                 startup_timeout=180.0, health_interval=10.0):
+        self.num_workers = num_workers
+        self.slot_bytes = slot_bytes
+        self.request_timeout = request_timeout
+        self.startup_timeout = startup_timeout
+        self.health_interval = health_interval
+        self._ctx = mp.get_context("spawn")
+        self._workers = []
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._monitor = None
+        self._stopped = threading.Event()
+        self.started = False
+
+    def start(self):
+        with self._lock:
+            if self.started:
+                return
+            for worker_id in range(self.num_workers):
+                worker = _Worker(worker_id, self.slot_bytes, self._ctx)
+                worker.start(self.startup_timeout)
+                self._workers.append(worker)
+                self._idle.put(worker)
+            self._stopped.clear()
+            self._monitor = threading.Thread(target=self._health_loop, name="inference-pool-health", daemon=True)
+            self._monitor.start()
+            self.started = True
+            print(f"Inference pool started with {self.num_workers} workers")
+
+    def stop(self):
+        with self._lock:
+            self._stopped.set()
+            for worker in self._workers:
+                worker.close()
+            self._workers = []
+            self._idle = queue.Queue()
+            self.started = False
+
+    def recycle(self):
+        """Rolling restart so every worker loads the registry's current model version.
+
+        Workers are restarted one at a time as they become idle, so the pool keeps
+        serving with the remaining workers meanwhile.
+        """
+        pending = set(range(len(self._workers)))
+        while pending:
+            worker = self._idle.get()
+            try:
+                if worker.worker_id in pending:
+                    worker.start(self.startup_timeout)
+                    pending.discard(worker.worker_id)
+            except Exception as e:
+                pending.discard(worker.worker_id)
+                print(f"Failed to restart inference worker {worker.worker_id}: {e}")
+            finally:
+                self._idle.put(worker)
+            if pending and worker.worker_id not in pending:
+                time.sleep(0.01)
+
+    def recognize(self, frame, profile="selfie", scale=1.0):
+        """Run recognize_frame on a decoded frame in the next free worker."""
+        if not self.started:
+            self.start()
+
+        worker = self._idle.get(timeout=self.request_timeout)
+        try:
+            return worker.run(np.ascontiguousarray(frame), profile, scale, self.request_timeout)
+        except Exception as e:
+            reason = str(e) or type(e).__name__
+            worker.failures += 1
+            print(f"Inference worker {worker.worker_id} failed: {reason}, restarting")
+            worker.start(self.startup_timeout)
+            return None, 0.0, f"Error: {reason}"
+        finally:
+            self._idle.put(worker)
+
+    def _take_idle(self, worker):
+        with self._idle.mutex:
+            try:
+                self._idle.queue.remove(worker)
+                return True
+            except ValueError:
+                return False
+
+    def _health_loop(self):
+        while not self._stopped.wait(self.health_interval):
+            for worker in list(self._workers):
+                # Busy workers are skipped; a failure there is handled in recognize()
+                if not self._take_idle(worker):
+                    continue
+                try:
+                    if not worker.is_alive() or not worker.ping():
+                        print(f"Inference worker {worker.worker_id} is unhealthy, restarting")
+                        worker.failures += 1
+                        worker.start(self.startup_timeout)
+                except Exception as e:
+                    print(f"Failed to restart inference worker {worker.worker_id}: {e}")
+                finally:
+                    self._idle.put(worker)
+
+    def health(self):
+        return {
+            "enabled": True,
+            "started": self.started,
+            "num_workers": self.num_workers,
+            "idle_workers": self._idle.qsize(),
+            "workers": [worker.info() for worker in self._workers]
+        }
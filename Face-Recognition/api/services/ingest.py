@@ -0,0 +1,164 @@
+import os
+import threading
+import time
+import uuid
+from collections import deque, OrderedDict
+from pathlib import Path
+
+import cv2
+
+INGEST_BATCH_SIZE = int(os.getenv("FACE_INGEST_BATCH_SIZE", "16"))
+INGEST_MAX_QUEUE = int(os.getenv("FACE_INGEST_MAX_QUEUE", "512"))
+PROCESSED_DIR = Path(__file__).parent.parent.parent / "Dataset" / "FaceData" / "processed"
+
+
+class IngestTicket:
+    def __init__(self, student_code, image_path):
+        self.id = uuid.uuid4().hex[:12]
+        self.student_code = student_code
+        self.image_path = str(image_path)
+        self.status = "queued"
+        self.message = None
+        self.crop_path = None
+        self.submitted_at = time.time()
+        self.finished_at = None
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "student_code": self.student_code,
+            "status": self.status,
+            "message": self.message,
+            "crop_path": self.crop_path,
+            "latency_ms": None if self.finished_at is None
+            else round((self.finished_at - self.submitted_at) * 1000.0, 1)
+        }
+
+
+class EnrolmentIngest:
+    """Makes uploaded enrolment images usable right away, without a retrain.
+
+    A single background thread takes up to ``batch_size`` queued uploads at a
+    time, detects the largest face with MTCNN, writes the 160x160 crop to
+    ``processed/<student_code>/<image name>.png`` and embeds the batch on the
+    live model, appending the templates to the gallery under the crop's path.
+    Crops of the student that have no template yet (e.g. from an earlier
+    capture) are enrolled with them, so the student is never matched against
+    the new image alone. The batch aligner re-aligns the original image at the
+    next training and overwrites the crop.
+    """
+
+    def __init__(self, processed_dir, batch_size=16, max_queue=512, history=1000, name="enrolment-ingest"):
+        self.processed_dir = Path(processed_dir)
+        self.batch_size = max(1, int(batch_size))
+        self.max_queue = max_queue
+        self.history = history
+        self.name = name
+
+        self._queue = deque()
+        self._tickets = OrderedDict()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._counts = {"enrolled": 0, "no_face": 0, "failed": 0, "dropped": 0}
+        self._total_latency = 0.0
+
+    def submit(self, student_code, image_path):
+        """Queue one saved upload; returns its ticket."""
+        ticket = IngestTicket(student_code, image_path)
+        with self._cond:
+            self._tickets[ticket.id] = ticket
+            while len(self._tickets) > self.history:
+                self._tickets.popitem(last=False)
+            if len(self._queue) >= self.max_queue:
+                # The next training aligns the image anyway
+                ticket.status = "dropped"
+                ticket.message = "Ingest queue is full; the image is used from the next training"
+                self._counts["dropped"] += 1
+                return ticket.to_dict()
+            self._queue.append(ticket)
+            self._cond.notify()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+        return ticket.to_dict()
+
+    def get(self, ticket_id):
+        with self._cond:
+            ticket = self._tickets.get(ticket_id)
+            return None if ticket is None else ticket.to_dict()
+
+    def stats(self):
+        with self._cond:
+            enrolled = self._counts["enrolled"]
+            return {
+                "queued": len(self._queue),
+                **self._counts,
+                "avg_latency_ms": round(self._total_latency / enrolled * 1000.0, 1) if enrolled else None
+            }
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                batch = []
+                while self._queue and len(batch) < self.batch_size:
+                    batch.append(self._queue.popleft())
+                for ticket in batch:
+                    ticket.status = "processing"
+
+            try:
+                self._process(batch)
+            except Exception as e:
+                self._finish(batch, "failed", f"Ingest error: {str(e)}")
+
+    def _process(self, batch):
+        from services.face_recognition import face_recognition_service, face_source, student_crops
+
+        frames = []
+        readable = []
+        for ticket in batch:
+            frame = cv2.imread(ticket.image_path)
+            if frame is None:
+                self._finish([ticket], "failed", "Unreadable image")
+                continue
+            frames.append(frame)
+            readable.append(ticket)
+        if not frames:
+            return
+
+        crops, embeddings = face_recognition_service.align_faces(frames)
+        rows = {}  # student_code -> (embedding rows, crop paths, tickets)
+        row = 0
+        for ticket, crop in zip(readable, crops):
+            if crop is None:
+                self._finish([ticket], "no_face", "No face found")
+                continue
+            crop_path = self.processed_dir / ticket.student_code / (Path(ticket.image_path).stem + ".png")
+            crop_path.parent.mkdir(parents=True, exist_ok=True)
+            cv2.imwrite(str(crop_path), crop)
+            ticket.crop_path = str(crop_path)
+            indices, crop_paths, tickets = rows.setdefault(ticket.student_code, ([], [], []))
+            indices.append(row)
+            crop_paths.append(face_source(crop_path))
+            tickets.append(ticket)
+            row += 1
+
+        for student_code, (indices, crop_paths, tickets) in rows.items():
+            face_recognition_service.gallery.add(student_code, embeddings[indices], crop_paths)
+            face_recognition_service.sync_student(student_code, student_crops(self.processed_dir / student_code))
+            self._finish(tickets, "enrolled", "Face added to the gallery")
+
+    def _finish(self, tickets, status, message):
+        now = time.time()
+        with self._cond:
+            for ticket in tickets:
+                ticket.status = status
+                ticket.message = message
+                ticket.finished_at = now
+                self._counts[status] += 1
+                if status == "enrolled":
+                    self._total_latency += now - ticket.submitted_at
+
+
+enrolment_ingest = EnrolmentIngest(PROCESSED_DIR, batch_size=INGEST_BATCH_SIZE, max_queue=INGEST_MAX_QUEUE)
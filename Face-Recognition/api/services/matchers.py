@@ -0,0 +1,84 @@
+import numpy as np
+
+
+class ClassifierMatcher:
+    """Identity from the pickled ``(model, class_names)`` classifier trained by src/classifier.py.
+
+    Any backend of src/classifier_backends.py works; they all expose ``predict_proba``.
+    With a ``gallery``, students enrolled in it but not yet known to the
+    classifier (e.g. through the enrolment ingest) are still recognised: a face
+    whose nearest template belongs to such a student is given that student.
+    """
+
+    name = "classifier"
+
+    def __init__(self, classifier_path, gallery=None):
+        from src.classifier_backends import load_classifier, backend_name
+
+        self.classifier_path = classifier_path
+        self.model, self.class_names = load_classifier(classifier_path)
+        self.backend = backend_name(self.model)
+        self.gallery = gallery
+        self._known = set(self.class_names)
+        self._gallery_only = (None, frozenset())  # (gallery revision, codes)
+
+    def match(self, embs, candidates=None):
+        predictions = self.model.predict_proba(embs)
+        if candidates is not None:
+            allowed = np.array([name in candidates for name in self.class_names])
+            predictions = np.where(allowed, predictions, -1.0)
+        best_class_indices = np.argmax(predictions, axis=1)
+        best_class_probabilities = predictions[
+            np.arange(len(best_class_indices)),
+            best_class_indices
+        ]
+        names = [self.class_names[i] if best_class_probabilities[k] >= 0 else None
+                 for k, i in enumerate(best_class_indices)]
+        confidences = np.maximum(best_class_probabilities, 0.0)
+
+        new_codes = self.gallery_only_codes()
+        if candidates is not None:
+            new_codes = new_codes & set(candidates)
+        if new_codes:
+            for k, (code, distance) in enumerate(self.gallery.identify(embs, candidates=candidates)):
+                if code in new_codes:
+                    names[k] = code
+                    confidences[k] = max(0.0, 1.0 - distance * distance / 2.0)
+        return names, confidences
+
+    def gallery_only_codes(self):
+        """Gallery students the classifier was not trained on."""
+        if self.gallery is None:
+            return frozenset()
+        revision = self.gallery.revision
+        if self._gallery_only[0] != revision:
+            self._gallery_only = (revision, frozenset(set(self.gallery.student_codes()) - self._known))
+        return self._gallery_only[1]
+
+    def stats(self):
+        return {"classifier_path": self.classifier_path, "backend": self.backend, "classes": len(self.class_names),
+                "gallery_only_students": len(self.gallery_only_codes())}
+
+
+class GalleryMatcher:
+    """Identity from nearest-neighbour search over an EmbeddingGallery.
+
+    Confidence is the cosine similarity of the best template; faces farther than
+    the gallery threshold come back with a ``None`` name.
+    """
+
+    name = "gallery"
+
+    def __init__(self, gallery):
+        self.gallery = gallery
+
+    def match(self, embs, candidates=None):
+        names = []
+        confidences = []
+        for code, distance in self.gallery.identify(embs, candidates=candidates):
+            names.append(code)
+            confidences.append(0.0 if distance is None else max(0.0, 1.0 - distance * distance / 2.0))
+        return names, np.asarray(confidences, dtype=np.float32)
+
+    def stats(self):
+        return self.gallery.stats()
@@ -0,0 +1,118 @@
+import os
+import time
+import bisect
+import threading
+import functools
+from contextlib import contextmanager, nullcontext
+
+METRICS_ENABLED = os.getenv("FACE_METRICS_ENABLED", "true").lower() == "true"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BOX_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+class Histogram:
+    """Cumulative-bucket histogram with one series per label value."""
+
+    def __init__(self, name, help, buckets, label="stage"):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.label = label
+        self._series = {}  # label value -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, label_value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for label_value in sorted(series):
+            values = series[label_value]
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{self.label}="{label_value}",le="{bound:g}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{self.label}="{label_value}",le="+Inf"}} {values[-1]}')
+            lines.append(f'{self.name}_sum{{{self.label}="{label_value}"}} {values[-2]:.6f}')
+            lines.append(f'{self.name}_count{{{self.label}="{label_value}"}} {values[-1]}')
+        return "\n".join(lines)
+
+
+class PipelineMetrics:
+    """Latency, candidate-box and batch-size histograms of the recognition pipeline.
+
+    Every recording method returns at once when metrics are disabled, and
+    ``stage()`` hands out a shared no-op context manager, so instrumented code
+    pays one attribute check per call.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.latency = Histogram("face_stage_seconds", "Time spent in each recognition pipeline stage.",
+                                 LATENCY_BUCKETS)
+        self.boxes = Histogram("face_candidate_boxes", "Candidate face boxes left after each MTCNN stage.",
+                               BOX_BUCKETS)
+        self.batches = Histogram("face_batch_size", "Faces per network call.", BATCH_BUCKETS)
+        self._noop = nullcontext()
+
+    def observe(self, stage, seconds):
+        if self.enabled:
+            self.latency.observe(seconds, stage)
+
+    def stage(self, stage):
+        """Context manager timing one ``stage``."""
+        if not self.enabled:
+            return self._noop
+        return self._timed(stage)
+
+    @contextmanager
+    def _timed(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.latency.observe(time.perf_counter() - started, stage)
+
+    def timed(self, stage):
+        """Decorator timing every call of a function as ``stage``."""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                with self._timed(stage):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def record_detection(self, stats):
+        """Record the per-stage times and box counts detect_face filled into ``stats``."""
+        if not self.enabled:
+            return
+        for stage in ("pnet", "rnet", "onet"):
+            if stage + "_time" in stats:
+                self.latency.observe(stats[stage + "_time"], stage)
+                self.boxes.observe(stats[stage + "_boxes"], stage)
+
+    def record_batch(self, stage, size):
+        if self.enabled:
+            self.batches.observe(size, stage)
+
+    def render(self):
+        """All histograms in the Prometheus text exposition format."""
+        return "\n".join(h.render() for h in (self.latency, self.boxes, self.batches)) + "\n"
+
+
+pipeline_metrics = PipelineMetrics(METRICS_ENABLED)
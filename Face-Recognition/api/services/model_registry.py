@@ -0,0 +1,158 @@
+import os
+import json
+import shutil
+import time
+import threading
+
+
+class ModelRegistry:
+    """Versioned model directories under ``root``, one per published training run.
+
+    Each ``<root>/<version>/manifest.json`` names the FaceNet graph and the
+    classifier (or gallery) that belong together, with paths relative to the
+    version directory. ``<root>/CURRENT`` holds the active version and is only
+    ever replaced atomically. Without any published version the registry falls
+    back to a ``legacy`` manifest pointing at the default Models/ files.
+
+    After each publish only the newest ``keep`` versions are kept (0 keeps all).
+    The active version and any version ``in_use()`` returns (e.g. bundles that
+    requests still hold) are never deleted.
+    """
+
+    CURRENT_FILE = "CURRENT"
+    MANIFEST_FILE = "manifest.json"
+
+    def __init__(self, root, default_graph, default_classifier, default_gallery=None, keep=5, in_use=None):
+        self.root = root
+        self.default_graph = default_graph
+        self.default_classifier = default_classifier
+        self.default_gallery = default_gallery
+        self.keep = keep
+        self.in_use = in_use
+        self._lock = threading.Lock()
+
+    def current_version(self):
+        path = os.path.join(self.root, self.CURRENT_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as f:
+            return f.read().strip() or None
+
+    def versions(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(
+            name for name in os.listdir(self.root)
+            if os.path.isfile(os.path.join(self.root, name, self.MANIFEST_FILE))
+        )
+
+    def manifest(self, version=None):
+        """Manifest of ``version`` (default: the active one) with absolute paths."""
+        version = version or self.current_version()
+        if version is None:
+            return {
+                "version": "legacy",
+                "graph": os.path.abspath(self.default_graph),
+                "classifier": os.path.abspath(self.default_classifier),
+                "gallery": os.path.abspath(self.default_gallery) if self.default_gallery else None,
+                "created_at": None
+            }
+
+        version_dir = os.path.join(self.root, version)
+        with open(os.path.join(version_dir, self.MANIFEST_FILE), 'r') as f:
+            manifest = json.load(f)
+        for key in ("graph", "classifier", "gallery"):
+            if manifest.get(key):
+                manifest[key] = os.path.abspath(os.path.join(version_dir, manifest[key]))
+        return manifest
+
+    def _new_version(self):
+        version = time.strftime("%Y%m%d-%H%M%S")
+        # Above every suffix of this second, even of pruned versions' successors,
+        # so names keep sorting in publish order
+        taken = [self._publish_order(name)[1] for name in os.listdir(self.root)
+                 if name == version or name.startswith(version + "-")]
+        if not taken:
+            return version
+        return f"{version}-{max(taken) + 1}"
+
+    @staticmethod
+    def _publish_order(version):
+        # "<date>-<time>" plus "-<n>" for the n-th version published within one second
+        parts = version.split("-")
+        return parts[:2], int(parts[2]) if len(parts) > 2 and parts[2].isdigit() else 1
+
+    @staticmethod
+    def _link_or_copy(src, dst):
+        # Hard links keep the ~90 MB graph from being duplicated on every retrain
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
+
+    def publish(self, graph_path, classifier_path=None, gallery_dir=None, metadata=None, activate=True):
+        """Stage a new version directory, move it into place and optionally activate it."""
+        with self._lock:
+            os.makedirs(self.root, exist_ok=True)
+            version = self._new_version()
+            staging = os.path.join(self.root, f".staging-{version}")
+            os.makedirs(staging)
+
+            manifest = {
+                "version": version,
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "graph": os.path.basename(graph_path),
+                "classifier": None,
+                "gallery": None
+            }
+            self._link_or_copy(graph_path, os.path.join(staging, manifest["graph"]))
+            if classifier_path:
+                manifest["classifier"] = os.path.basename(classifier_path)
+                shutil.copy2(classifier_path, os.path.join(staging, manifest["classifier"]))
+            if gallery_dir:
+                # The gallery is updated incrementally in place, so versions only reference it
+                manifest["gallery"] = os.path.relpath(os.path.abspath(gallery_dir), os.path.join(self.root, version))
+            if metadata:
+                manifest["metadata"] = metadata
+
+            with open(os.path.join(staging, self.MANIFEST_FILE), 'w') as f:
+                json.dump(manifest, f, indent=2)
+            os.replace(staging, os.path.join(self.root, version))
+
+            if activate:
+                self._write_current(version)
+            self._prune_locked()
+            return self.manifest(version)
+
+    def prune(self):
+        """Delete versions beyond the newest ``keep``; returns the deleted ones."""
+        with self._lock:
+            return self._prune_locked()
+
+    def _prune_locked(self):
+        if self.keep <= 0:
+            return []
+        protected = {self.current_version()}
+        if self.in_use is not None:
+            protected.update(self.in_use())
+        removed = []
+        for version in sorted(self.versions(), key=self._publish_order)[:-self.keep]:
+            if version in protected:
+                continue
+            shutil.rmtree(os.path.join(self.root, version), ignore_errors=True)
+            removed.append(version)
+        if removed:
+            print(f"Removed model versions {', '.join(removed)}")
+        return removed
+
+    def activate(self, version):
+        with self._lock:
+            if version not in self.versions():
+                raise ValueError(f"Unknown model version: {version}")
+            self._write_current(version)
+
+    def _write_current(self, version):
+        tmp_path = os.path.join(self.root, self.CURRENT_FILE + ".tmp")
+        with open(tmp_path, 'w') as f:
+            f.write(version)
+        os.replace(tmp_path, os.path.join(self.root, self.CURRENT_FILE))
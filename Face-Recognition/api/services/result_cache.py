@@ -0,0 +1,186 @@
+import os
+import time
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+RESULT_CACHE_SIZE = int(os.getenv("FACE_RESULT_CACHE_SIZE", "1024"))
+RESULT_CACHE_TTL = float(os.getenv("FACE_RESULT_CACHE_TTL", "300"))
+IDEMPOTENCY_KEYS = int(os.getenv("FACE_IDEMPOTENCY_KEYS", "4096"))
+IDEMPOTENCY_TTL = float(os.getenv("FACE_IDEMPOTENCY_TTL", "600"))
+
+
+def content_hash(data):
+    """Digest of an encoded image; accepts bytes, bytearray or memoryview."""
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+class ResultCache:
+    """Bounded LRU of recognition results with a time-to-live.
+
+    Concurrent lookups of a key that is still being computed wait for that
+    computation instead of repeating it, so a client retrying while its first
+    request is in flight costs one recognition, not two.
+    """
+
+    def __init__(self, max_entries=1024, ttl=300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, result)
+        self._inflight = {}  # key -> threading.Event
+        self._lock = threading.Lock()
+        self._counts = {"hits": 0, "misses": 0, "coalesced": 0, "stored": 0,
+                        "expired": 0, "evicted": 0, "invalidations": 0}
+
+    def get_or_compute(self, key, compute, cacheable=None):
+        """Return the cached result for ``key`` or store ``compute()``'s.
+
+        Results for which ``cacheable(result)`` is false are returned but not
+        kept; exceptions propagate and are never cached.
+        """
+        while True:
+            with self._lock:
+                result = self._lookup_locked(key)
+                if result is not None:
+                    self._counts["hits"] += 1
+                    return result
+                pending = self._inflight.get(key)
+                if pending is None:
+                    pending = self._inflight[key] = threading.Event()
+                    self._counts["misses"] += 1
+                    break
+                self._counts["coalesced"] += 1
+            # Another thread is computing this key; take its result, or compute
+            # it ourselves if it was not cacheable or failed
+            pending.wait()
+            with self._lock:
+                result = self._lookup_locked(key)
+                if result is not None:
+                    return result
+                if key not in self._inflight:
+                    self._inflight[key] = pending = threading.Event()
+                    break
+
+        try:
+            result = compute()
+            if cacheable is None or cacheable(result):
+                with self._lock:
+                    self._store_locked(key, result)
+            return result
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            pending.set()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._counts["invalidations"] += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self._counts["hits"] + self._counts["misses"] + self._counts["coalesced"]
+            return {
+                "max_entries": self.max_entries,
+                "ttl_sec": self.ttl,
+                "entries": len(self._entries),
+                **self._counts,
+                "hit_rate": round((self._counts["hits"] + self._counts["coalesced"]) / lookups, 4) if lookups else None
+            }
+
+    def _lookup_locked(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self._entries[key]
+            self._counts["expired"] += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def _store_locked(self, key, result):
+        self._entries[key] = (time.monotonic() + self.ttl, result)
+        self._entries.move_to_end(key)
+        self._counts["stored"] += 1
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._counts["evicted"] += 1
+
+
+class IdempotencyStore:
+    """Responses of requests sent with an ``Idempotency-Key`` header.
+
+    A repeat of a key within ``ttl`` seconds gets the stored response without
+    running the endpoint again, and a repeat arriving while the first request
+    is still running waits for it. Only successful responses are stored, so a
+    request that raised can be retried with the same key.
+    """
+
+    def __init__(self, max_entries=4096, ttl=600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._responses = OrderedDict()  # key -> (expires_at, response)
+        self._inflight = {}  # key -> concurrent.futures.Future
+        self._lock = threading.Lock()
+        self._counts = {"requests": 0, "replayed": 0, "joined": 0, "stored": 0, "evicted": 0}
+
+    async def run(self, key, handler):
+        """Await ``handler()`` once per ``key``; a ``None`` key runs it every time.
+
+        ``key`` should include the endpoint and the caller, so two users (or two
+        endpoints) sending the same header value never share a response.
+        """
+        if key is None or key[-1] is None:
+            return await handler()
+
+        with self._lock:
+            self._counts["requests"] += 1
+        while True:
+            with self._lock:
+                entry = self._responses.get(key)
+                if entry is not None and entry[0] >= time.monotonic():
+                    self._responses.move_to_end(key)
+                    self._counts["replayed"] += 1
+                    return entry[1]
+                pending = self._inflight.get(key)
+                if pending is None:
+                    # A plain Future, not an asyncio one, so waiters on another event loop can join it
+                    pending = self._inflight[key] = Future()
+                    break
+                self._counts["joined"] += 1
+            succeeded, response = await asyncio.shield(asyncio.wrap_future(pending))
+            if succeeded:
+                return response
+
+        succeeded, response = False, None
+        try:
+            response = await handler()
+            succeeded = True
+            with self._lock:
+                self._responses[key] = (time.monotonic() + self.ttl, response)
+                self._responses.move_to_end(key)
+                self._counts["stored"] += 1
+                while len(self._responses) > self.max_entries:
+                    self._responses.popitem(last=False)
+                    self._counts["evicted"] += 1
+            return response
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            pending.set_result((succeeded, response))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_entries": self.max_entries,
+                "ttl_sec": self.ttl,
+                "entries": len(self._responses),
+                "in_flight": len(self._inflight),
+                **self._counts
+            }
+
+
+idempotency_keys = IdempotencyStore(IDEMPOTENCY_KEYS, IDEMPOTENCY_TTL)
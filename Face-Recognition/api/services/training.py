@@ -1,86 +1,169 @@
 import sys
 import os
+import json
+import shutil
+import threading
 import subprocess
 from pathlib import Path
 
 # Add parent directory to path
 sys.path.append(os.path.join(os.path.dirname(__file__), '../../'))
 
+ALIGN_WORKERS = int(os.getenv("FACE_ALIGN_WORKERS", "0")) or max(1, min(4, os.cpu_count() or 1))
+ALIGN_TIMEOUT = int(os.getenv("FACE_ALIGN_TIMEOUT", "1800"))
+TRAIN_TIMEOUT = int(os.getenv("FACE_TRAIN_TIMEOUT", "300"))
+CLASSIFIER_BACKEND = os.getenv("FACE_CLASSIFIER_BACKEND", "svc")
+LOADER_THREADS = int(os.getenv("FACE_LOADER_THREADS", "0")) or max(1, min(4, os.cpu_count() or 1))
+
 class TrainingService:
     def __init__(self):
         self.project_root = Path(__file__).parent.parent.parent
-        self.preprocessing_script = self.project_root / "src" / "align_dataset_mtcnn.py"
+        self.preprocessing_script = self.project_root / "src" / "align_dataset_parallel.py"
         self.classifier_script = self.project_root / "src" / "classifier.py"
         self.input_dir = self.project_root / "Dataset" / "FaceData" / "raw"
         self.output_dir = self.project_root / "Dataset" / "FaceData" / "processed"
-        
-    def train_model(self):
-        """Run preprocessing and training"""
+        self.progress = None
+        self.rates = {}  # stage -> images/sec measured in the last training
+
+    def _run_script(self, stage, script, args, timeout, on_progress=None):
+        """Run a src script, reading its PROGRESS lines as they are printed.
+
+        Returns ``(returncode, output)``; ``output`` holds the non-progress lines.
+        """
+        process = subprocess.Popen(
+            [sys.executable, str(script)] + args,
+            cwd=str(self.project_root / "src"),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            bufsize=1
+        )
+        # The scripts only print between chunks, so a hung worker is caught by the watchdog
+        timed_out = threading.Event()
+
+        def kill():
+            timed_out.set()
+            process.kill()
+
+        timer = threading.Timer(timeout, kill)
+        timer.start()
+        output = []
+        try:
+            for line in process.stdout:
+                line = line.rstrip()
+                if line.startswith("PROGRESS "):
+                    self._report(on_progress, {"stage": stage, **json.loads(line[len("PROGRESS "):])})
+                    continue
+                output.append(line)
+                print(f"[{stage}] {line}")
+            process.wait()
+        finally:
+            timer.cancel()
+        if timed_out.is_set():
+            raise subprocess.TimeoutExpired(str(script), timeout)
+        return process.returncode, "\n".join(output)
+
+    def _report(self, on_progress, progress):
+        self.progress = progress
+        if progress.get("images_per_sec"):
+            self.rates[progress["stage"]] = progress["images_per_sec"]
+        if on_progress is not None:
+            on_progress(progress)
+
+    def seconds_per_image(self):
+        """Alignment + embedding time one more image adds to a training, from the
+        rates of the last run; ``None`` before the first training."""
+        if "align" not in self.rates or "embed" not in self.rates:
+            return None
+        return 1.0 / self.rates["align"] + 1.0 / self.rates["embed"]
+
+    def train_model(self, on_progress=None):
+        """Run preprocessing and training, then publish the new classifier.
+
+        ``on_progress`` is called with each progress update: the ``stage``
+        (align, embed, publish) and, while images are processed, ``done``,
+        ``total`` and ``eta_sec``. The classifier is trained into a staging
+        file, so Models/facemodel.pkl and the registry only change when every
+        step succeeded.
+        """
+        models_dir = self.project_root / "Models"
+        staging_dir = models_dir / f".train-{os.getpid()}-{threading.get_ident()}"
         try:
             # Check if there are at least 2 students with images
-            import os
             raw_dir = self.input_dir
             student_dirs = [d for d in os.listdir(raw_dir) if os.path.isdir(os.path.join(raw_dir, d))]
 
             if len(student_dirs) < 2:
                 return False, f"Cần ít nhất 2 học sinh để training. Hiện tại chỉ có {len(student_dirs)} học sinh."
 
-            # Run preprocessing with arguments
+            # Align new or changed images only, in parallel
             print("Running preprocessing...")
-            result = subprocess.run(
-                [
-                    sys.executable,
-                    str(self.preprocessing_script),
-                    str(self.input_dir),
-                    str(self.output_dir),
-                    "--image_size", "160",
-                    "--margin", "32"
-                ],
-                cwd=str(self.project_root / "src"),
-                capture_output=True,
-                text=True,
-                timeout=300  # 5 minutes timeout
-            )
-
-            print("Preprocessing stdout:", result.stdout)
-            print("Preprocessing stderr:", result.stderr)
+            self._report(on_progress, {"stage": "align"})
+            returncode, output = self._run_script("align", self.preprocessing_script, [
+                str(self.input_dir),
+                str(self.output_dir),
+                "--image_size", "160",
+                "--margin", "32",
+                "--nrof_workers", str(ALIGN_WORKERS)
+            ], ALIGN_TIMEOUT, on_progress)
 
-            if result.returncode != 0:
-                return False, f"Preprocessing failed: {result.stderr}"
+            if returncode != 0:
+                return False, f"Preprocessing failed: {output[-2000:]}"
 
             print("Preprocessing completed")
-            
-            # Run classifier training
+
+            # The aligner may have rewritten crops the ingest had already embedded
+            from services.face_recognition import face_recognition_service
+            if face_recognition_service.model_loaded:
+                try:
+                    result = face_recognition_service.sync_gallery(str(self.output_dir))
+                    print(f"Gallery synced: enrolled {result['enrolled']}, removed {result['removed']}")
+                except Exception as e:
+                    print(f"Gallery sync failed: {e}")
+
+            # Run classifier training on the embeddings of the graph that serves
+            # (FACE_MODEL_PATH, possibly an exported inference-only or int8
+            # variant), so the published classifier matches what it will classify
+            serving_model = os.path.abspath(face_recognition_service.model_path)
             print("Running classifier training...")
-            result = subprocess.run(
-                [
-                    sys.executable,
-                    str(self.classifier_script),
-                    "TRAIN",
-                    str(self.output_dir),
-                    str(self.project_root / "Models" / "20180402-114759.pb"),
-                    str(self.project_root / "Models" / "facemodel.pkl"),
-                    "--batch_size", "90"
-                ],
-                cwd=str(self.project_root / "src"),
-                capture_output=True,
-                text=True,
-                timeout=300  # 5 minutes timeout
-            )
-            
-            print("Training stdout:", result.stdout)
-            print("Training stderr:", result.stderr)
+            self._report(on_progress, {"stage": "embed"})
+            staging_dir.mkdir(parents=True, exist_ok=True)
+            classifier_path = staging_dir / "facemodel.pkl"
+            returncode, output = self._run_script("embed", self.classifier_script, [
+                "TRAIN",
+                str(self.output_dir),
+                serving_model,
+                str(classifier_path),
+                "--classifier", CLASSIFIER_BACKEND,
+                "--batch_size", "90",
+                "--nrof_loader_threads", str(LOADER_THREADS),
+                "--embedding_store", str(models_dir / "embedding_store"),
+                "--progress"
+            ], TRAIN_TIMEOUT, on_progress)
 
-            if result.returncode != 0:
-                return False, f"Training failed: {result.stderr}"
+            if returncode != 0:
+                return False, f"Training failed: {output[-2000:]}"
 
             print("Training completed")
+
+            # Publish the serving graph + the classifier fitted on its embeddings for hot-swap
+            self._report(on_progress, {"stage": "publish"})
+            manifest = face_recognition_service.registry.publish(
+                serving_model,
+                classifier_path=str(classifier_path),
+                metadata={"source": "train_model"}
+            )
+            # The scripts in src still read the classifier from Models/
+            os.replace(classifier_path, models_dir / "facemodel.pkl")
+            print(f"Published model version {manifest['version']}")
             return True, "Model trained successfully"
-            
-        except subprocess.TimeoutExpired:
-            return False, "Training timeout (exceeded 5 minutes)"
+
+        except subprocess.TimeoutExpired as e:
+            return False, f"Training timeout (exceeded {int(e.timeout)} seconds)"
         except Exception as e:
             return False, f"Training error: {str(e)}"
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
 
 # Global instance
 training_service = TrainingService()
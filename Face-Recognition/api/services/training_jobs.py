@@ -0,0 +1,136 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+class TrainingJob:
+    """One run of alignment + classifier training, shared by every request it absorbed."""
+
+    def __init__(self, requested_by):
+        self.id = uuid.uuid4().hex[:12]
+        self.status = "queued"
+        self.requested_by = [requested_by]
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.progress = {}
+        self.message = None
+        self.model = None
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "requests": len(self.requested_by),
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "stage": self.progress.get("stage"),
+            "processed": self.progress.get("done"),
+            "total": self.progress.get("total"),
+            "eta_sec": self.progress.get("eta_sec") if self.status == "running" else None,
+            "message": self.message,
+            "model": self.model
+        }
+
+
+class TrainingJobQueue:
+    """Runs training jobs one at a time on a single worker thread.
+
+    A request that arrives while a job is queued joins that job; one that arrives
+    while a job is running queues the next run, so images captured during a
+    training are never missed and at most two jobs exist at any time.
+    ``run_job(on_progress)`` returns ``(success, message, model_info)``.
+    """
+
+    def __init__(self, run_job, history=20, name="training-worker"):
+        self.run_job = run_job
+        self.history = history
+        self.name = name
+
+        self._jobs = OrderedDict()  # id -> TrainingJob, oldest first
+        self._queued = None
+        self._running = None
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def submit(self, requested_by):
+        """Queue a training run. Returns ``(job, coalesced)``."""
+        with self._cond:
+            if self._queued is not None:
+                self._queued.requested_by.append(requested_by)
+                return self._queued.to_dict(), True
+            job = TrainingJob(requested_by)
+            self._queued = job
+            self._jobs[job.id] = job
+            self._trim()
+            self._cond.notify()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+            return job.to_dict(), False
+
+    def get(self, job_id):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            return None if job is None else job.to_dict()
+
+    def status(self):
+        with self._cond:
+            return {
+                "running": None if self._running is None else self._running.to_dict(),
+                "queued": None if self._queued is None else self._queued.to_dict(),
+                "recent": [job.to_dict() for job in reversed(self._jobs.values())
+                           if job.status in ("succeeded", "failed")]
+            }
+
+    def _trim(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in ("succeeded", "failed")]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            del self._jobs[job_id]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._queued is None:
+                    self._cond.wait()
+                job = self._queued
+                self._queued = None
+                self._running = job
+                job.status = "running"
+                job.started_at = time.time()
+
+            def on_progress(progress, job=job):
+                with self._cond:
+                    job.progress = dict(progress)
+
+            try:
+                success, message, model = self.run_job(on_progress)
+            except Exception as e:
+                success, message, model = False, f"Training error: {str(e)}", None
+
+            with self._cond:
+                job.status = "succeeded" if success else "failed"
+                job.message = message
+                job.model = model
+                job.finished_at = time.time()
+                self._running = None
+                self._trim()
+            print(f"Training job {job.id} {job.status}: {message}")
+
+
+def run_training(on_progress):
+    """Train, then hot-swap the service to the version the training published."""
+    from services.training import training_service
+    from services.face_recognition import face_recognition_service
+
+    success, message = training_service.train_model(on_progress)
+    model = None
+    if success:
+        on_progress({"stage": "reload"})
+        model = face_recognition_service.reload_model()
+    return success, message, model
+
+
+training_jobs = TrainingJobQueue(run_training)
@@ -0,0 +1,159 @@
+import os
+import threading
+from contextlib import contextmanager
+
+UPLOAD_MAX_BYTES = int(os.getenv("FACE_UPLOAD_MAX_BYTES", str(20 << 20)))
+UPLOAD_BUFFERS = int(os.getenv("FACE_UPLOAD_BUFFERS", "8"))
+UPLOAD_INITIAL_BYTES = 1 << 20
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+class UploadBuffer:
+    """Growable byte buffer an image upload is written into chunk by chunk.
+
+    ``view()`` is a zero-copy memoryview of the bytes written so far; it is
+    only valid until the buffer goes back to its pool.
+    """
+
+    def __init__(self, capacity, max_bytes, on_event=None, pool=None):
+        self.data = bytearray(capacity)
+        self.size = 0
+        self.max_bytes = max_bytes
+        self.on_event = on_event
+        self.pool = pool
+        self.holds = 0
+        self.closed = False
+
+    def hold(self, future):
+        """Keep the buffer out of the pool until ``future`` is done.
+
+        For a call reading view() on another thread: if the request is cancelled
+        while the call runs, the buffer must not be reused under it.
+        """
+        if self.pool is not None:
+            self.pool.hold(self, future)
+
+    def reserve(self, nbytes):
+        """Grow up front when the final size is known (e.g. from Content-Length)."""
+        self._ensure(nbytes)
+
+    def write(self, chunk):
+        end = self.size + len(chunk)
+        self._ensure(end)
+        self.data[self.size:end] = chunk
+        self.size = end
+
+    def read_from(self, fileobj, chunk_size=1 << 16):
+        """Read a file object to its end directly into the buffer."""
+        readinto = getattr(fileobj, "readinto", None)
+        while True:
+            if readinto is None:
+                chunk = fileobj.read(chunk_size)
+                if not chunk:
+                    return
+                self.write(chunk)
+                continue
+            if self.size == len(self.data):
+                self._ensure(self.size + chunk_size)
+            with memoryview(self.data) as view, view[self.size:] as spare:
+                nbytes = readinto(spare)
+            if not nbytes:
+                return
+            self.size += nbytes
+
+    def view(self):
+        return memoryview(self.data)[:self.size]
+
+    def _ensure(self, nbytes):
+        if nbytes > self.max_bytes:
+            self._event("too_large")
+            raise UploadTooLarge(f"Image larger than {self.max_bytes} bytes")
+        if nbytes <= len(self.data):
+            return
+        # A new array rather than an in-place resize, which fails while a view is exported
+        grown = bytearray(min(max(nbytes, 2 * len(self.data)), self.max_bytes))
+        grown[:self.size] = memoryview(self.data)[:self.size]
+        self.data = grown
+        self._event("grown")
+
+    def _event(self, name):
+        if self.on_event is not None:
+            self.on_event(name)
+
+
+class UploadBufferPool:
+    """Keeps up to ``max_buffers`` upload buffers for reuse, so steady traffic
+    stops allocating request-sized byte strings once the buffers have grown
+    to the usual upload size."""
+
+    def __init__(self, max_buffers=8, initial_bytes=UPLOAD_INITIAL_BYTES, max_bytes=UPLOAD_MAX_BYTES):
+        self.max_buffers = max_buffers
+        self.initial_bytes = initial_bytes
+        self.max_bytes = max_bytes
+
+        self._free = []
+        self._lock = threading.Lock()
+        self._counts = {"acquired": 0, "allocated": 0, "grown": 0, "too_large": 0, "deferred": 0}
+
+    @contextmanager
+    def buffer(self):
+        buffer = self._acquire()
+        try:
+            yield buffer
+        finally:
+            self._release(buffer)
+
+    def hold(self, buffer, future):
+        with self._lock:
+            buffer.holds += 1
+        future.add_done_callback(lambda _: self._unhold(buffer))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "free": len(self._free),
+                "pooled_bytes": sum(len(buffer.data) for buffer in self._free),
+                **self._counts
+            }
+
+    def _count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def _acquire(self):
+        with self._lock:
+            self._counts["acquired"] += 1
+            if self._free:
+                buffer = self._free.pop()
+                buffer.closed = False
+                return buffer
+            self._counts["allocated"] += 1
+        return UploadBuffer(self.initial_bytes, self.max_bytes, on_event=self._count, pool=self)
+
+    def _release(self, buffer):
+        with self._lock:
+            buffer.closed = True
+            if buffer.holds:
+                # A call still reads it; the last one to finish puts it back
+                self._counts["deferred"] += 1
+                return
+        self._recycle(buffer)
+
+    def _unhold(self, buffer):
+        with self._lock:
+            buffer.holds -= 1
+            if buffer.holds or not buffer.closed:
+                return
+        self._recycle(buffer)
+
+    def _recycle(self, buffer):
+        buffer.size = 0
+        with self._lock:
+            if len(self._free) < self.max_buffers:
+                self._free.append(buffer)
+
+
+upload_buffers = UploadBufferPool(max_buffers=UPLOAD_BUFFERS)
@@ -0,0 +1,386 @@
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import deque, OrderedDict
+from datetime import datetime, timedelta
+
+import cv2
+
+VIDEO_SAMPLE_SEC = float(os.getenv("FACE_VIDEO_SAMPLE_SEC", "1.0"))
+VIDEO_MIN_SAMPLE_SEC = float(os.getenv("FACE_VIDEO_MIN_SAMPLE_SEC", "0.25"))
+VIDEO_MAX_SAMPLE_SEC = float(os.getenv("FACE_VIDEO_MAX_SAMPLE_SEC", "4.0"))
+VIDEO_BATCH_SIZE = int(os.getenv("FACE_VIDEO_BATCH_SIZE", "32"))
+VIDEO_QUEUE_FRAMES = int(os.getenv("FACE_VIDEO_QUEUE_FRAMES", "4"))
+VIDEO_THRESHOLD = float(os.getenv("FACE_VIDEO_THRESHOLD", "0.75"))
+VIDEO_REQUIRED_HITS = int(os.getenv("FACE_VIDEO_REQUIRED_HITS", "2"))
+VIDEO_UPLOAD_DIR = os.getenv("FACE_VIDEO_UPLOAD_DIR", "../Dataset/videos")
+
+
+class VideoFrameReader:
+    """Decodes a video on its own thread, handing a frame every ``interval``
+    seconds of video over a bounded queue.
+
+    Frames in between are only grabbed, never converted, and the queue blocks
+    the decoder when recognition falls behind. Iterating yields
+    ``(timestamp_sec, frame)``.
+    """
+
+    _END = object()
+
+    def __init__(self, path, interval=1.0, max_queue=4):
+        self.capture = cv2.VideoCapture(str(path))
+        if not self.capture.isOpened():
+            raise ValueError(f"Cannot open video: {path}")
+        self.interval = interval
+        self.fps = self.capture.get(cv2.CAP_PROP_FPS) or 25.0
+        frame_count = self.capture.get(cv2.CAP_PROP_FRAME_COUNT)
+        self.duration = frame_count / self.fps if frame_count > 0 else None
+        self.frames_decoded = 0
+
+        self._queue = queue.Queue(maxsize=max(1, max_queue))
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._produce, name="video-decoder", daemon=True)
+        self._thread.start()
+
+    def __iter__(self):
+        while True:
+            item = self._queue.get()
+            if item is self._END:
+                return
+            yield item
+
+    def close(self):
+        self._stop.set()
+        # Unblock a decoder waiting on a full queue
+        while self._thread.is_alive():
+            try:
+                self._queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        self._thread.join()
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce(self):
+        try:
+            next_sample = 0.0
+            while not self._stop.is_set() and self.capture.grab():
+                timestamp = self.frames_decoded / self.fps
+                self.frames_decoded += 1
+                if timestamp + 1e-6 < next_sample:
+                    continue
+                ok, frame = self.capture.retrieve()
+                if not ok:
+                    continue
+                if not self._put((timestamp, frame)):
+                    break
+                next_sample = timestamp + self.interval
+        finally:
+            self.capture.release()
+            self._put(self._END)
+
+
+class AdaptiveSampler:
+    """Picks the gap to the next detected frame from the face count of the last one.
+
+    Frames without faces back off to ``maximum``; a change in the number of
+    faces (people entering or turning to the camera) drops to ``minimum``; a
+    steady face count relaxes back to ``base``.
+    """
+
+    def __init__(self, base=1.0, minimum=0.25, maximum=4.0):
+        self.base = base
+        self.minimum = min(minimum, base)
+        self.maximum = max(maximum, base)
+        self.interval = base
+        self.last_faces = 0
+
+    def update(self, nrof_faces):
+        if nrof_faces == 0:
+            self.interval = min(self.interval * 2, self.maximum)
+        elif nrof_faces != self.last_faces:
+            self.interval = self.minimum
+        elif self.interval > self.base:
+            self.interval = self.base
+        else:
+            self.interval = min(self.interval * 2, self.base)
+        self.last_faces = nrof_faces
+        return self.interval
+
+
+def scan_video(path, candidates=None, on_progress=None):
+    """First-seen time of every student recognized in a video file.
+
+    A student counts once ``VIDEO_REQUIRED_HITS`` faces matched them with at
+    least ``VIDEO_THRESHOLD`` confidence, as in the live check-in; their
+    ``first_seen_sec`` is the earliest of those matches.
+    """
+    from services.face_recognition import face_recognition_service
+
+    sampler = AdaptiveSampler(VIDEO_SAMPLE_SEC, VIDEO_MIN_SAMPLE_SEC, VIDEO_MAX_SAMPLE_SEC)
+    # The decoder runs ahead on the finest grid; the adaptive gap is applied
+    # here so a change takes effect at once instead of after the queued frames
+    reader = VideoFrameReader(path, sampler.minimum, VIDEO_QUEUE_FRAMES)
+    seen = {}
+    counts = {"detected": 0, "faces": 0}
+    next_sample = [0.0]
+    started = time.perf_counter()
+
+    def sampled_frames():
+        for timestamp, frame in reader:
+            if timestamp + 1e-6 >= next_sample[0]:
+                yield timestamp, frame
+
+    def on_detect(timestamp, faces):
+        next_sample[0] = timestamp + sampler.update(faces)
+        counts["detected"] += 1
+        counts["faces"] += faces
+        if on_progress is not None:
+            elapsed = time.perf_counter() - started
+            on_progress({
+                "position_sec": round(timestamp, 2),
+                "duration_sec": reader.duration,
+                "fps": round(reader.frames_decoded / elapsed, 1) if elapsed > 0 else None
+            })
+
+    try:
+        for results in face_recognition_service.recognize_stream(
+                sampled_frames(), candidates=candidates, profile="classroom",
+                batch_size=VIDEO_BATCH_SIZE, on_detect=on_detect):
+            for timestamp, name, confidence in results:
+                if name is None or confidence < VIDEO_THRESHOLD:
+                    continue
+                entry = seen.setdefault(name, {"hits": 0, "first_seen_sec": timestamp, "confidence": 0.0})
+                entry["hits"] += 1
+                entry["first_seen_sec"] = min(entry["first_seen_sec"], timestamp)
+                entry["confidence"] = max(entry["confidence"], confidence)
+    finally:
+        reader.close()
+    elapsed = time.perf_counter() - started
+
+    students = sorted(
+        ({"student_code": name, **entry, "first_seen_sec": round(entry["first_seen_sec"], 2)}
+         for name, entry in seen.items() if entry["hits"] >= VIDEO_REQUIRED_HITS),
+        key=lambda s: s["first_seen_sec"]
+    )
+    return {
+        "students": students,
+        "duration_sec": round(reader.frames_decoded / reader.fps, 2),
+        "frames_decoded": reader.frames_decoded,
+        "frames_detected": counts["detected"],
+        "faces": counts["faces"],
+        "elapsed_sec": round(elapsed, 2),
+        "fps": round(reader.frames_decoded / elapsed, 1) if elapsed > 0 else None,
+        "detected_fps": round(counts["detected"] / elapsed, 2) if elapsed > 0 else None
+    }
+
+
+def class_roster(db, class_id):
+    """student_code -> Student for the students enrolled in a class."""
+    from models import Student, ClassStudent
+
+    return {
+        s.student_code: s for s in db.query(Student).join(
+            ClassStudent, ClassStudent.student_id == Student.id
+        ).filter(ClassStudent.class_id == class_id).all()
+    }
+
+
+def record_attendance(db, class_id, roster, scan, session_id=None, started_at=None, created_by=None):
+    """Write the students of a scan_video result as AttendanceRecords.
+
+    Check-in time is ``started_at`` (the wall-clock time of the first video
+    frame) plus the student's first-seen offset. Without ``started_at`` the
+    video is taken to start at the given session's start time or, when the
+    class has no session that day yet, to have ended just now.
+    """
+    from models import AttendanceSession, AttendanceRecord
+
+    duration = timedelta(seconds=scan["duration_sec"])
+    if session_id is not None:
+        attendance_session = db.query(AttendanceSession).filter(
+            AttendanceSession.id == session_id,
+            AttendanceSession.class_id == class_id
+        ).first()
+        if attendance_session is None:
+            raise ValueError("Attendance session not found for this class")
+    else:
+        day = (started_at or datetime.now()).date()
+        attendance_session = db.query(AttendanceSession).filter(
+            AttendanceSession.class_id == class_id,
+            AttendanceSession.session_date == day
+        ).first()
+
+    if started_at is None:
+        if attendance_session is not None:
+            started_at = datetime.combine(attendance_session.session_date, attendance_session.start_time)
+        else:
+            started_at = datetime.now().replace(microsecond=0) - duration
+    if attendance_session is None:
+        attendance_session = AttendanceSession(
+            class_id=class_id,
+            session_date=started_at.date(),
+            start_time=started_at.time(),
+            end_time=(started_at + duration).time(),
+            created_by=created_by
+        )
+        db.add(attendance_session)
+        db.flush()
+
+    already_marked = {
+        r.student_id for r in db.query(AttendanceRecord.student_id).filter(
+            AttendanceRecord.session_id == attendance_session.id
+        ).all()
+    }
+    new_records = []
+    for seen in scan["students"]:
+        student = roster.get(seen["student_code"])
+        if student is None or student.id in already_marked:
+            continue
+        new_records.append(AttendanceRecord(
+            session_id=attendance_session.id,
+            student_id=student.id,
+            status="present",
+            confidence=seen["confidence"],
+            check_in_time=(started_at + timedelta(seconds=seen["first_seen_sec"])).replace(microsecond=0)
+        ))
+    db.add_all(new_records)
+    db.commit()
+    return {"session_id": attendance_session.id, "marked_count": len(new_records)}
+
+
+class VideoJob:
+    def __init__(self, class_id, path, session_id, started_at, created_by, remove_file):
+        self.id = uuid.uuid4().hex[:12]
+        self.class_id = class_id
+        self.path = str(path)
+        self.session_id = session_id
+        self.started_at = started_at
+        self.created_by = created_by
+        self.remove_file = remove_file
+        self.status = "queued"
+        self.progress = {}
+        self.message = None
+        self.result = None
+        self.submitted_at = time.time()
+        self.finished_at = None
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "class_id": self.class_id,
+            "status": self.status,
+            "position_sec": self.progress.get("position_sec"),
+            "duration_sec": self.progress.get("duration_sec"),
+            "fps": self.progress.get("fps"),
+            "message": self.message,
+            "result": self.result
+        }
+
+
+class VideoAttendanceJobs:
+    """Processes uploaded lecture videos one at a time on a background thread.
+
+    Each job scans the video for the class's students and writes their
+    attendance; the uploaded file is removed once the job finishes.
+    """
+
+    def __init__(self, history=50, name="video-attendance"):
+        self.history = history
+        self.name = name
+
+        self._queue = deque()
+        self._jobs = OrderedDict()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._counts = {"succeeded": 0, "failed": 0}
+        self._frames = 0
+        self._seconds = 0.0
+
+    def submit(self, class_id, path, session_id=None, started_at=None, created_by=None, remove_file=True):
+        job = VideoJob(class_id, path, session_id, started_at, created_by, remove_file)
+        with self._cond:
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.history:
+                self._jobs.popitem(last=False)
+            self._queue.append(job)
+            self._cond.notify()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+        return job.to_dict()
+
+    def get(self, job_id):
+        with self._cond:
+            job = self._jobs.get(job_id)
+            return None if job is None else job.to_dict()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "queued": len(self._queue),
+                **self._counts,
+                "fps": round(self._frames / self._seconds, 1) if self._seconds else None
+            }
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                job = self._queue.popleft()
+                job.status = "running"
+
+            def on_progress(progress, job=job):
+                with self._cond:
+                    job.progress = dict(progress)
+
+            try:
+                result = self._process(job, on_progress)
+                status, message = "succeeded", f"Marked {result['marked_count']} of {len(result['students'])} recognized students"
+            except Exception as e:
+                result, status, message = None, "failed", f"Video attendance error: {str(e)}"
+            finally:
+                if job.remove_file:
+                    try:
+                        os.remove(job.path)
+                    except OSError:
+                        pass
+
+            with self._cond:
+                job.status = status
+                job.message = message
+                job.result = result
+                job.finished_at = time.time()
+                self._counts[status] += 1
+                if result is not None:
+                    self._frames += result["frames_decoded"]
+                    self._seconds += result["elapsed_sec"]
+            print(f"Video attendance job {job.id} {status}: {message}")
+
+    def _process(self, job, on_progress):
+        from database import SessionLocal
+
+        db = SessionLocal()
+        try:
+            roster = class_roster(db, job.class_id)
+            if not roster:
+                raise ValueError("Class has no enrolled students")
+            result = scan_video(job.path, candidates=set(roster), on_progress=on_progress)
+            result.update(record_attendance(db, job.class_id, roster, result, session_id=job.session_id,
+                                            started_at=job.started_at, created_by=job.created_by))
+            return result
+        finally:
+            db.close()
+
+
+video_attendance_jobs = VideoAttendanceJobs()
@@ -33,6 +33,7 @@ import tensorflow as tf
 #from math import floor
 import cv2
 import os
+import time
 
 def layer(op):
     """Decorator for composable network layers."""
@@ -295,28 +296,49 @@ def create_mtcnn(sess, model_path):
     onet_fun = lambda img : sess.run(('onet/conv6-2/conv6-2:0', 'onet/conv6-3/conv6-3:0', 'onet/prob1:0'), feed_dict={'onet/input:0':img})
     return pnet_fun, rnet_fun, onet_fun
 
-def detect_face(img, minsize, pnet, rnet, onet, threshold, factor):
+def pyramid_scales(h, w, minsize, factor, maxsize=None):
+    """Scales of the PNet image pyramid for an h x w image.
+    At scale s PNet's 12x12 window matches faces of about 12/s pixels, so the pyramid starts
+    at faces of minsize pixels and stops where the window would exceed the image. With
+    maxsize, scales whose window is already larger than maxsize pixels are left out; the
+    last scale kept still covers faces up to 1/factor times its window.
+    """
+    factor_count=0
+    minl=np.amin([h, w])
+    m=12.0/minsize
+    minl=minl*m
+    scales=[]
+    while minl>=12:
+        scale = m*np.power(factor, factor_count)
+        if maxsize is not None and 12.0/scale>maxsize:
+            break
+        scales += [scale]
+        minl = minl*factor
+        factor_count += 1
+    return scales
+
+def detect_face(img, minsize, pnet, rnet, onet, threshold, factor, maxsize=None, stats=None):
     """Detects faces in an image, and returns bounding boxes and points for them.
     img: input image
     minsize: minimum faces' size
     pnet, rnet, onet: caffemodel
     threshold: threshold=[th1, th2, th3], th1-3 are three steps's threshold
     factor: the factor used to create a scaling pyramid of face sizes to detect in the image.
+    maxsize: optional maximum faces' size; pyramid scales that only find larger faces are skipped
+    stats: optional dict that receives the number of PNet calls, the time spent in each
+      stage (pnet_time, rnet_time, onet_time) and the boxes each stage kept (pnet_boxes, ...);
+      rnet_* and onet_* are only set when the stage ran
     """
-    factor_count=0
     total_boxes=np.empty((0,9))
     points=np.empty(0)
     h=img.shape[0]
     w=img.shape[1]
-    minl=np.amin([h, w])
-    m=12.0/minsize
-    minl=minl*m
     # create scale pyramid
-    scales=[]
-    while minl>=12:
-        scales += [m*np.power(factor, factor_count)]
-        minl = minl*factor
-        factor_count += 1
+    scales = pyramid_scales(h, w, minsize, factor, maxsize)
+    if stats is not None:
+        stats['pnet_calls'] = len(scales)
+        stats['pnet_time'] = 0.0
+        pnet_start = time.time()
 
     # first stage
     for scale in scales:
@@ -337,6 +359,8 @@ def detect_face(img, minsize, pnet, rnet, onet, threshold, factor):
         if boxes.size>0 and pick.size>0:
             boxes = boxes[pick,:]
             total_boxes = np.append(total_boxes, boxes, axis=0)
+    if stats is not None:
+        stats['pnet_time'] = time.time() - pnet_start
 
     numbox = total_boxes.shape[0]
     if numbox>0:
@@ -351,21 +375,18 @@ def detect_face(img, minsize, pnet, rnet, onet, threshold, factor):
         total_boxes = np.transpose(np.vstack([qq1, qq2, qq3, qq4, total_boxes[:,4]]))
         total_boxes = rerec(total_boxes.copy())
         total_boxes[:,0:4] = np.fix(total_boxes[:,0:4]).astype(np.int32)
-        dy, edy, dx, edx, y, ey, x, ex, tmpw, tmph = pad(total_boxes.copy(), w, h)
 
     numbox = total_boxes.shape[0]
+    if stats is not None:
+        stats['pnet_boxes'] = numbox
     if numbox>0:
         # second stage
-        tempimg = np.zeros((24,24,3,numbox))
-        for k in range(0,numbox):
-            tmp = np.zeros((int(tmph[k]),int(tmpw[k]),3))
-            tmp[dy[k]-1:edy[k],dx[k]-1:edx[k],:] = img[y[k]-1:ey[k],x[k]-1:ex[k],:]
-            if tmp.shape[0]>0 and tmp.shape[1]>0 or tmp.shape[0]==0 and tmp.shape[1]==0:
-                tempimg[:,:,:,k] = imresample(tmp, (24, 24))
-            else:
-                return np.empty()
-        tempimg = (tempimg-127.5)*0.0078125
-        tempimg1 = np.transpose(tempimg, (3,1,0,2))
+        if stats is not None:
+            rnet_start = time.time()
+        tempimg = crop_resample(img, total_boxes, 24)
+        tempimg -= 127.5
+        tempimg *= 0.0078125
+        tempimg1 = np.transpose(tempimg, (0,2,1,3))
         out = rnet(tempimg1)
         out0 = np.transpose(out[0])
         out1 = np.transpose(out[1])
@@ -378,22 +399,20 @@ def detect_face(img, minsize, pnet, rnet, onet, threshold, factor):
             total_boxes = total_boxes[pick,:]
             total_boxes = bbreg(total_boxes.copy(), np.transpose(mv[:,pick]))
             total_boxes = rerec(total_boxes.copy())
+        if stats is not None:
+            stats['rnet_time'] = time.time() - rnet_start
+            stats['rnet_boxes'] = total_boxes.shape[0]
 
     numbox = total_boxes.shape[0]
     if numbox>0:
         # third stage
+        if stats is not None:
+            onet_start = time.time()
         total_boxes = np.fix(total_boxes).astype(np.int32)
-        dy, edy, dx, edx, y, ey, x, ex, tmpw, tmph = pad(total_boxes.copy(), w, h)
-        tempimg = np.zeros((48,48,3,numbox))
-        for k in range(0,numbox):
-            tmp = np.zeros((int(tmph[k]),int(tmpw[k]),3))
-            tmp[dy[k]-1:edy[k],dx[k]-1:edx[k],:] = img[y[k]-1:ey[k],x[k]-1:ex[k],:]
-            if tmp.shape[0]>0 and tmp.shape[1]>0 or tmp.shape[0]==0 and tmp.shape[1]==0:
-                tempimg[:,:,:,k] = imresample(tmp, (48, 48))
-            else:
-                return np.empty()
-        tempimg = (tempimg-127.5)*0.0078125
-        tempimg1 = np.transpose(tempimg, (3,1,0,2))
+        tempimg = crop_resample(img, total_boxes, 48)
+        tempimg -= 127.5
+        tempimg *= 0.0078125
+        tempimg1 = np.transpose(tempimg, (0,2,1,3))
         out = onet(tempimg1)
         out0 = np.transpose(out[0])
         out1 = np.transpose(out[1])
@@ -414,6 +433,9 @@ def detect_face(img, minsize, pnet, rnet, onet, threshold, factor):
             pick = nms(total_boxes.copy(), 0.7, 'Min')
             total_boxes = total_boxes[pick,:]
             points = points[:,pick]
+        if stats is not None:
+            stats['onet_time'] = time.time() - onet_start
+            stats['onet_boxes'] = total_boxes.shape[0]
                 
     return total_boxes, points
 
@@ -510,22 +532,14 @@ def bulk_detect_face(images, detection_window_size_ratio, pnet, rnet, onet, thre
             image_obj['total_boxes'] = np.transpose(np.vstack([qq1, qq2, qq3, qq4, image_obj['total_boxes'][:, 4]]))
             image_obj['total_boxes'] = rerec(image_obj['total_boxes'].copy())
             image_obj['total_boxes'][:, 0:4] = np.fix(image_obj['total_boxes'][:, 0:4]).astype(np.int32)
-            dy, edy, dx, edx, y, ey, x, ex, tmpw, tmph = pad(image_obj['total_boxes'].copy(), w, h)
 
             numbox = image_obj['total_boxes'].shape[0]
-            tempimg = np.zeros((24, 24, 3, numbox))
 
             if numbox > 0:
-                for k in range(0, numbox):
-                    tmp = np.zeros((int(tmph[k]), int(tmpw[k]), 3))
-                    tmp[dy[k] - 1:edy[k], dx[k] - 1:edx[k], :] = images[index][y[k] - 1:ey[k], x[k] - 1:ex[k], :]
-                    if tmp.shape[0] > 0 and tmp.shape[1] > 0 or tmp.shape[0] == 0 and tmp.shape[1] == 0:
-                        tempimg[:, :, :, k] = imresample(tmp, (24, 24))
-                    else:
-                        return np.empty()
-
-                tempimg = (tempimg - 127.5) * 0.0078125
-                image_obj['rnet_input'] = np.transpose(tempimg, (3, 1, 0, 2))
+                tempimg = crop_resample(images[index], image_obj['total_boxes'], 24)
+                tempimg -= 127.5
+                tempimg *= 0.0078125
+                image_obj['rnet_input'] = np.transpose(tempimg, (0, 2, 1, 3))
 
     # # # # # # # # # # # # #
     # second stage - refinement of face candidates with rnet
@@ -567,19 +581,11 @@ def bulk_detect_face(images, detection_window_size_ratio, pnet, rnet, onet, thre
             numbox = image_obj['total_boxes'].shape[0]
 
             if numbox > 0:
-                tempimg = np.zeros((48, 48, 3, numbox))
                 image_obj['total_boxes'] = np.fix(image_obj['total_boxes']).astype(np.int32)
-                dy, edy, dx, edx, y, ey, x, ex, tmpw, tmph = pad(image_obj['total_boxes'].copy(), w, h)
-
-                for k in range(0, numbox):
-                    tmp = np.zeros((int(tmph[k]), int(tmpw[k]), 3))
-                    tmp[dy[k] - 1:edy[k], dx[k] - 1:edx[k], :] = images[index][y[k] - 1:ey[k], x[k] - 1:ex[k], :]
-                    if tmp.shape[0] > 0 and tmp.shape[1] > 0 or tmp.shape[0] == 0 and tmp.shape[1] == 0:
-                        tempimg[:, :, :, k] = imresample(tmp, (48, 48))
-                    else:
-                        return np.empty()
-                tempimg = (tempimg - 127.5) * 0.0078125
-                image_obj['onet_input'] = np.transpose(tempimg, (3, 1, 0, 2))
+                tempimg = crop_resample(images[index], image_obj['total_boxes'], 48)
+                tempimg -= 127.5
+                tempimg *= 0.0078125
+                image_obj['onet_input'] = np.transpose(tempimg, (0, 2, 1, 3))
 
         i += rnet_input_count
 
@@ -684,7 +690,41 @@ def generateBoundingBox(imap, reg, scale, t):
     return boundingbox, reg
  
 # function pick = nms(boxes,threshold,type)
+# Above this many boxes nms() sweeps over boxes sorted by x1 instead of building the full overlap matrix
+NMS_MATRIX_MAX_BOXES = 256
+
 def nms(boxes, threshold, method):
+    """Greedy non-maximum suppression.
+    boxes: [x1, y1, x2, y2, score, ...] rows
+    method: 'Min' divides the intersection by the smaller area, anything else by the union
+    Returns the indices of the kept boxes in the order they were picked (highest score first).
+    Picks the overlap-matrix version for small inputs and the sort-and-sweep version for large
+    ones; both give exactly the picks of nms_greedy().
+    """
+    if boxes.size==0:
+        return np.empty((0,3))
+    if boxes.shape[0]<=NMS_MATRIX_MAX_BOXES:
+        return nms_matrix(boxes, threshold, method)
+    area = (boxes[:,2]-boxes[:,0]+1) * (boxes[:,3]-boxes[:,1]+1)
+    if threshold>=0 and np.all(area>0):
+        return nms_sweep(boxes, threshold, method)
+    return nms_greedy(boxes, threshold, method)
+
+def _overlap(x1, y1, x2, y2, area, i, idx, method):
+    """Overlap of box i with the boxes idx, computed exactly as the original MTCNN code does."""
+    xx1 = np.maximum(x1[i], x1[idx])
+    yy1 = np.maximum(y1[i], y1[idx])
+    xx2 = np.minimum(x2[i], x2[idx])
+    yy2 = np.minimum(y2[i], y2[idx])
+    w = np.maximum(0.0, xx2-xx1+1)
+    h = np.maximum(0.0, yy2-yy1+1)
+    inter = w * h
+    if method=='Min':
+        return inter / np.minimum(area[i], area[idx])
+    return inter / (area[i] + area[idx] - inter)
+
+def nms_greedy(boxes, threshold, method):
+    """Reference implementation: re-slices the remaining candidates after every pick."""
     if boxes.size==0:
         return np.empty((0,3))
     x1 = boxes[:,0]
@@ -694,28 +734,74 @@ def nms(boxes, threshold, method):
     s = boxes[:,4]
     area = (x2-x1+1) * (y2-y1+1)
     I = np.argsort(s)
-    pick = np.zeros_like(s, dtype=np.int16)
+    pick = np.zeros_like(s, dtype=np.intp)
     counter = 0
-    while I.size>0:
-        i = I[-1]
-        pick[counter] = i
-        counter += 1
-        idx = I[0:-1]
-        xx1 = np.maximum(x1[i], x1[idx])
-        yy1 = np.maximum(y1[i], y1[idx])
-        xx2 = np.minimum(x2[i], x2[idx])
-        yy2 = np.minimum(y2[i], y2[idx])
-        w = np.maximum(0.0, xx2-xx1+1)
-        h = np.maximum(0.0, yy2-yy1+1)
-        inter = w * h
-        if method is 'Min':
-            o = inter / np.minimum(area[i], area[idx])
-        else:
-            o = inter / (area[i] + area[idx] - inter)
-        I = I[np.where(o<=threshold)]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        while I.size>0:
+            i = I[-1]
+            pick[counter] = i
+            counter += 1
+            idx = I[0:-1]
+            o = _overlap(x1, y1, x2, y2, area, i, idx, method)
+            I = I[np.where(o<=threshold)]
     pick = pick[0:counter]
     return pick
 
+def nms_matrix(boxes, threshold, method):
+    """All pairwise overlaps in one N x N computation, then a single pass over the score order."""
+    if boxes.size==0:
+        return np.empty((0,3))
+    order = np.argsort(boxes[:,4])[::-1]
+    x1 = boxes[order,0]
+    y1 = boxes[order,1]
+    x2 = boxes[order,2]
+    y2 = boxes[order,3]
+    area = (x2-x1+1) * (y2-y1+1)
+    idx = np.arange(order.size)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        o = _overlap(x1, y1, x2, y2, area, idx[:,np.newaxis], idx[np.newaxis,:], method)
+    # NaN overlaps suppress, like the o<=threshold test of the greedy version
+    suppress = ~(o<=threshold)
+    removed = np.zeros(order.size, dtype=bool)
+    pick = []
+    for k in range(order.size):
+        if removed[k]:
+            continue
+        pick.append(k)
+        removed[k+1:] |= suppress[k,k+1:]
+    return order[np.array(pick, dtype=np.intp)]
+
+def nms_sweep(boxes, threshold, method):
+    """Overlaps are only computed against the boxes whose x1 lies in the x-range a pick can reach,
+    found by binary search over the boxes sorted by x1. Boxes outside that range do not intersect
+    the pick and have zero overlap, so this needs positive areas and a non-negative threshold.
+    """
+    if boxes.size==0:
+        return np.empty((0,3))
+    by_x1 = np.argsort(boxes[:,0], kind='mergesort')
+    x1 = boxes[by_x1,0]
+    y1 = boxes[by_x1,1]
+    x2 = boxes[by_x1,2]
+    y2 = boxes[by_x1,3]
+    area = (x2-x1+1) * (y2-y1+1)
+    # Box j intersects box i only if x1[j] < x2[i]+1 and x2[j] > x1[i]-1, where x2[j] <= x1[j]+max_width
+    max_width = np.amax(x2-x1)
+    lo = np.searchsorted(x1, x1-max_width-1, side='left')
+    hi = np.searchsorted(x1, x2+1, side='right')
+    position = np.empty(by_x1.size, dtype=np.intp)
+    position[by_x1] = np.arange(by_x1.size)
+    removed = np.zeros(by_x1.size, dtype=bool)
+    pick = []
+    for i in position[np.argsort(boxes[:,4])[::-1]].tolist():
+        if removed[i]:
+            continue
+        pick.append(i)
+        # Overlap is symmetric, so boxes picked earlier are never above the threshold here
+        # and the whole window can be updated without filtering it first
+        o = _overlap(x1, y1, x2, y2, area, i, slice(lo[i], hi[i]), method)
+        removed[lo[i]:hi[i]] |= ~(o<=threshold)
+    return by_x1[np.array(pick, dtype=np.intp)]
+
 # function [dy edy dx edx y ey x ex tmpw tmph] = pad(total_boxes,w,h)
 def pad(total_boxes, w, h):
     """Compute the padding coordinates (pad the bounding boxes to square)"""
@@ -762,6 +848,52 @@ def rerec(bboxA):
     bboxA[:,2:4] = bboxA[:,0:2] + np.transpose(np.tile(l,(2,1)))
     return bboxA
 
+def crop_resample(img, total_boxes, size):
+    """Crop every box out of img and resample it to size x size in one pass.
+    total_boxes: integer box corners [x1, y1, x2, y2] in the 1-based inclusive convention used by pad()
+    Returns a float32 array of shape (numbox, size, size, 3). Parts of a box outside the
+    image are zero, as with the per-box buffers filled through pad(). Crops are resampled
+    straight into their slot of the output buffer, read either from one float copy of the
+    zero-padded image (many boxes) or from a single reused scratch buffer (few boxes),
+    whichever copies fewer pixels.
+    """
+    numbox = total_boxes.shape[0]
+    tempimg = np.zeros((numbox, size, size, 3), dtype=np.float32)
+    if numbox == 0:
+        return tempimg
+    h, w = img.shape[0], img.shape[1]
+    x1 = total_boxes[:,0].astype(np.int32) - 1
+    y1 = total_boxes[:,1].astype(np.int32) - 1
+    x2 = total_boxes[:,2].astype(np.int32)
+    y2 = total_boxes[:,3].astype(np.int32)
+    boxw = np.maximum(x2-x1, 0)
+    boxh = np.maximum(y2-y1, 0)
+
+    if np.sum(boxw.astype(np.int64)*boxh) >= h*w:
+        left = max(0, -int(np.amin(x1)))
+        top = max(0, -int(np.amin(y1)))
+        right = max(0, int(np.amax(x2)) - w)
+        bottom = max(0, int(np.amax(y2)) - h)
+        padded = np.zeros((h+top+bottom, w+left+right, 3), dtype=np.float32)
+        padded[top:top+h,left:left+w,:] = img
+        for k in range(numbox):
+            if boxh[k]>0 and boxw[k]>0:
+                cv2.resize(padded[y1[k]+top:y2[k]+top,x1[k]+left:x2[k]+left,:], (size, size), dst=tempimg[k], interpolation=cv2.INTER_AREA) #@UndefinedVariable
+        return tempimg
+
+    scratch = np.empty((int(np.amax(boxh)), int(np.amax(boxw)), 3), dtype=np.float32)
+    for k in range(numbox):
+        if boxh[k]==0 or boxw[k]==0:
+            continue
+        tmp = scratch[:boxh[k],:boxw[k],:]
+        sx1, sy1 = max(x1[k], 0), max(y1[k], 0)
+        sx2, sy2 = min(x2[k], w), min(y2[k], h)
+        if sx1!=x1[k] or sy1!=y1[k] or sx2!=x2[k] or sy2!=y2[k]:
+            tmp.fill(0)
+        tmp[sy1-y1[k]:sy2-y1[k],sx1-x1[k]:sx2-x1[k],:] = img[sy1:sy2,sx1:sx2,:]
+        cv2.resize(tmp, (size, size), dst=tempimg[k], interpolation=cv2.INTER_AREA) #@UndefinedVariable
+    return tempimg
+
 def imresample(img, sz):
     im_data = cv2.resize(img, (sz[1], sz[0]), interpolation=cv2.INTER_AREA) #@UndefinedVariable
     return im_data
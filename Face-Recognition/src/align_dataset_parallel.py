@@ -0,0 +1,302 @@
+"""Aligns a dataset with a pool of worker processes and only re-aligns new or changed images.
+
+Works like align_dataset_mtcnn.py, with three differences:
+- the images are sharded over --nrof_workers processes, each with its own MTCNN session;
+- images of the same resolution go through bulk_detect_face together;
+- a manifest in the output directory, keyed by the SHA-1 of every source image, lets a
+  rerun skip images that are unchanged and drop the crops of images that were removed.
+
+Progress is printed as it happens, one line per finished chunk of images:
+    PROGRESS {"done": 120, "total": 5000, "aligned": 117, "failed": 3, "images_per_sec": 35.2, "eta_sec": 138.6}
+
+Usage:
+    python src/align_dataset_parallel.py Dataset/FaceData/raw Dataset/FaceData/processed \
+        --image_size 160 --margin 32 --nrof_workers 4
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import sys
+import os
+import json
+import time
+import hashlib
+import argparse
+import multiprocessing
+import numpy as np
+import facenet
+
+MANIFEST_FILENAME = 'align_manifest.json'
+MINSIZE = 20 # minimum size of face
+THRESHOLD = [0.6, 0.7, 0.7] # three steps's threshold
+FACTOR = 0.709 # scale factor
+
+# Set in every worker process by init_worker()
+_mtcnn = None
+_worker_args = None
+
+def main(args):
+    input_dir = os.path.expanduser(args.input_dir)
+    output_dir = os.path.expanduser(args.output_dir)
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    manifest_path = os.path.join(output_dir, MANIFEST_FILENAME)
+    manifest = load_manifest(manifest_path, args)
+
+    dataset = facenet.get_dataset(input_dir)
+    sources = {}
+    for cls in dataset:
+        for image_path in sorted(cls.image_paths):
+            if os.path.isfile(image_path):
+                sources[os.path.relpath(image_path, input_dir)] = image_path
+
+    # Crops of images that disappeared from the input would otherwise keep being trained on
+    removed = [rel for rel in manifest['images'] if rel not in sources]
+    for rel in removed:
+        remove_outputs(output_dir, manifest['images'].pop(rel))
+
+    pending = []
+    for rel, image_path in sources.items():
+        stat = os.stat(image_path)
+        entry = manifest['images'].get(rel)
+        if entry is not None and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime \
+                and outputs_exist(output_dir, entry):
+            continue
+        # Size or mtime changed: the worker hashes the file and skips it when the content did not
+        known_hash = entry['sha1'] if entry is not None and outputs_exist(output_dir, entry) else None
+        pending.append((rel, image_path, stat.st_size, stat.st_mtime, known_hash))
+
+    total = len(pending)
+    print('Found %d images in %d classes: %d to align, %d unchanged, %d removed' % (
+        len(sources), len(dataset), total, len(sources) - total, len(removed)))
+    sys.stdout.flush()
+
+    chunks = make_chunks(pending, args.chunk_size)
+    counters = {'done': 0, 'total': total, 'aligned': 0, 'failed': 0, 'unchanged': 0}
+    start_time = time.time()
+    last_save = start_time
+    if chunks:
+        ctx = multiprocessing.get_context('spawn')
+        nrof_workers = max(1, min(args.nrof_workers, len(chunks)))
+        pool = ctx.Pool(nrof_workers, initializer=init_worker, initargs=(args,))
+        try:
+            for results in pool.imap_unordered(align_chunk, chunks):
+                for rel, entry in results:
+                    old_entry = manifest['images'].get(rel)
+                    if entry['status'] == 'unchanged':
+                        counters['unchanged'] += 1
+                        old_entry.update(size=entry['size'], mtime=entry['mtime'])
+                        continue
+                    if old_entry is not None:
+                        remove_outputs(output_dir, old_entry, keep=entry['outputs'])
+                    manifest['images'][rel] = entry
+                    counters['aligned' if entry['status'] == 'aligned' else 'failed'] += 1
+                counters['done'] += len(results)
+                report_progress(counters, start_time)
+                if time.time() - last_save > args.manifest_save_interval:
+                    save_manifest(manifest_path, manifest)
+                    last_save = time.time()
+        finally:
+            pool.close()
+            pool.join()
+
+    save_manifest(manifest_path, manifest)
+    write_bounding_boxes(os.path.join(output_dir, 'bounding_boxes.txt'), output_dir, manifest)
+
+    nrof_aligned = sum(1 for entry in manifest['images'].values() if entry['status'] == 'aligned')
+    print('Total number of images: %d' % len(sources))
+    print('Number of successfully aligned images: %d' % nrof_aligned)
+    print('Aligned %d new or changed images in %.1f seconds' % (counters['aligned'], time.time() - start_time))
+
+def load_manifest(manifest_path, args):
+    """The manifest is only reused when the crops were made with the same settings."""
+    settings = {'image_size': args.image_size, 'margin': args.margin,
+                'detect_multiple_faces': bool(args.detect_multiple_faces)}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+        if manifest.get('settings') == settings:
+            return manifest
+        print('Alignment settings changed, re-aligning every image')
+    return {'settings': settings, 'images': {}}
+
+def save_manifest(manifest_path, manifest):
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, manifest_path)
+
+def outputs_exist(output_dir, entry):
+    return all(os.path.exists(os.path.join(output_dir, output['file'])) for output in entry['outputs'])
+
+def remove_outputs(output_dir, entry, keep=()):
+    keep = set(output['file'] for output in keep)
+    for output in entry['outputs']:
+        path = os.path.join(output_dir, output['file'])
+        if output['file'] not in keep and os.path.exists(path):
+            os.remove(path)
+
+def make_chunks(pending, chunk_size):
+    """Chunks of consecutive images; images of one class usually share a resolution and
+    end up in the same bulk_detect_face call."""
+    return [pending[i:i+chunk_size] for i in range(0, len(pending), chunk_size)]
+
+def report_progress(counters, start_time):
+    elapsed = time.time() - start_time
+    rate = counters['done'] / elapsed if elapsed > 0 else 0.0
+    progress = dict(counters)
+    progress['elapsed_sec'] = round(elapsed, 1)
+    progress['images_per_sec'] = round(rate, 2)
+    progress['eta_sec'] = round((counters['total'] - counters['done']) / rate, 1) if rate > 0 else None
+    print('PROGRESS %s' % json.dumps(progress))
+    sys.stdout.flush()
+
+def write_bounding_boxes(filename, output_dir, manifest):
+    with open(filename, 'w') as text_file:
+        for rel in sorted(manifest['images']):
+            entry = manifest['images'][rel]
+            if entry['status'] != 'aligned':
+                text_file.write('%s\n' % os.path.join(output_dir, entry['target']))
+            for output in entry['outputs']:
+                text_file.write('%s %d %d %d %d\n' % ((os.path.join(output_dir, output['file']),) + tuple(output['bb'])))
+
+def init_worker(args):
+    global _mtcnn, _worker_args
+    import tensorflow as tf
+    import align.detect_face
+    _worker_args = args
+    with tf.Graph().as_default():
+        gpu_options = tf.compat.v1.GPUOptions(per_process_gpu_memory_fraction=args.gpu_memory_fraction)
+        sess = tf.compat.v1.Session(config=tf.compat.v1.ConfigProto(gpu_options=gpu_options, log_device_placement=False))
+        with sess.as_default():
+            _mtcnn = align.detect_face.create_mtcnn(sess, None)
+
+def read_image(data):
+    import imageio
+    img = imageio.imread(data)
+    if img.ndim<2:
+        return None
+    if img.ndim == 2:
+        img = facenet.to_rgb(img)
+    return img[:,:,0:3]
+
+def align_chunk(chunk):
+    """Hash, decode, detect and crop one chunk of images. Returns (rel, manifest entry) pairs."""
+    import align.detect_face
+    args = _worker_args
+    pnet, rnet, onet = _mtcnn
+    output_dir = os.path.expanduser(args.output_dir)
+    results = []
+    by_resolution = {}
+    for rel, image_path, size, mtime, known_hash in chunk:
+        with open(image_path, 'rb') as f:
+            data = f.read()
+        sha1 = hashlib.sha1(data).hexdigest()
+        if sha1 == known_hash:
+            results.append((rel, {'status': 'unchanged', 'size': size, 'mtime': mtime}))
+            continue
+        class_name = os.path.split(os.path.dirname(rel))[1]
+        filename = os.path.splitext(os.path.basename(rel))[0]
+        entry = {'sha1': sha1, 'size': size, 'mtime': mtime, 'status': 'failed', 'outputs': [],
+                 'target': os.path.join(class_name, filename+'.png')}
+        try:
+            img = read_image(data)
+        except (IOError, ValueError, IndexError) as e:
+            print('{}: {}'.format(image_path, e))
+            img = None
+        if img is None:
+            print('Unable to align "%s"' % image_path)
+            results.append((rel, entry))
+            continue
+        by_resolution.setdefault(img.shape, []).append((rel, image_path, img, entry))
+
+    for shape, items in by_resolution.items():
+        images = [img for _, _, img, _ in items]
+        if len(images) > 1:
+            # Same minimum face size as detect_face(minsize=20); +0.5 keeps int() from rounding down
+            ratio = (MINSIZE + 0.5) / min(shape[0], shape[1])
+            detections = align.detect_face.bulk_detect_face(images, ratio, pnet, rnet, onet, THRESHOLD, FACTOR)
+        else:
+            detections = [align.detect_face.detect_face(images[0], MINSIZE, pnet, rnet, onet, THRESHOLD, FACTOR)]
+
+        for (rel, image_path, img, entry), detection in zip(items, detections):
+            bounding_boxes = detection[0] if detection is not None else np.empty((0, 5))
+            entry['outputs'] = write_crops(img, bounding_boxes, os.path.join(output_dir, entry['target']), args)
+            if entry['outputs']:
+                entry['status'] = 'aligned'
+            else:
+                print('Unable to align "%s"' % image_path)
+            results.append((rel, entry))
+    return results
+
+def write_crops(img, bounding_boxes, output_filename, args):
+    import imageio
+    from PIL import Image
+    nrof_faces = bounding_boxes.shape[0]
+    if nrof_faces == 0:
+        return []
+    det = bounding_boxes[:,0:4]
+    det_arr = []
+    img_size = np.asarray(img.shape)[0:2]
+    if nrof_faces>1:
+        if args.detect_multiple_faces:
+            for i in range(nrof_faces):
+                det_arr.append(np.squeeze(det[i]))
+        else:
+            bounding_box_size = (det[:,2]-det[:,0])*(det[:,3]-det[:,1])
+            img_center = img_size / 2
+            offsets = np.vstack([ (det[:,0]+det[:,2])/2-img_center[1], (det[:,1]+det[:,3])/2-img_center[0] ])
+            offset_dist_squared = np.sum(np.power(offsets,2.0),0)
+            index = np.argmax(bounding_box_size-offset_dist_squared*2.0) # some extra weight on the centering
+            det_arr.append(det[index,:])
+    else:
+        det_arr.append(np.squeeze(det))
+
+    output_class_dir = os.path.dirname(output_filename)
+    if not os.path.exists(output_class_dir):
+        os.makedirs(output_class_dir, exist_ok=True)
+    outputs = []
+    for i, det in enumerate(det_arr):
+        det = np.squeeze(det)
+        bb = np.zeros(4, dtype=np.int32)
+        bb[0] = np.maximum(det[0]-args.margin/2, 0)
+        bb[1] = np.maximum(det[1]-args.margin/2, 0)
+        bb[2] = np.minimum(det[2]+args.margin/2, img_size[1])
+        bb[3] = np.minimum(det[3]+args.margin/2, img_size[0])
+        cropped = Image.fromarray(img[bb[1]:bb[3],bb[0]:bb[2],:])
+        scaled = cropped.resize((args.image_size, args.image_size), Image.BILINEAR)
+        filename_base, file_extension = os.path.splitext(output_filename)
+        if args.detect_multiple_faces:
+            output_filename_n = "{}_{}{}".format(filename_base, i, file_extension)
+        else:
+            output_filename_n = "{}{}".format(filename_base, file_extension)
+        imageio.imwrite(output_filename_n, np.asarray(scaled))
+        outputs.append({'file': os.path.relpath(output_filename_n, os.path.expanduser(args.output_dir)),
+                        'bb': [int(v) for v in bb]})
+    return outputs
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('input_dir', type=str, help='Directory with unaligned images.')
+    parser.add_argument('output_dir', type=str, help='Directory with aligned face thumbnails.')
+    parser.add_argument('--image_size', type=int,
+        help='Image size (height, width) in pixels.', default=182)
+    parser.add_argument('--margin', type=int,
+        help='Margin for the crop around the bounding box (height, width) in pixels.', default=44)
+    parser.add_argument('--nrof_workers', type=int,
+        help='Number of alignment processes, each with its own MTCNN session.', default=max(1, min(4, os.cpu_count() or 1)))
+    parser.add_argument('--chunk_size', type=int,
+        help='Images handed to a worker at a time; same-resolution images in a chunk are detected together.', default=16)
+    parser.add_argument('--manifest_save_interval', type=float,
+        help='Seconds between manifest checkpoints while aligning.', default=10.0)
+    parser.add_argument('--gpu_memory_fraction', type=float,
+        help='Upper bound on the amount of GPU memory that will be used by each worker.', default=1.0)
+    parser.add_argument('--detect_multiple_faces', type=bool,
+                        help='Detect and align multiple faces per image.', default=False)
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    main(parse_arguments(sys.argv[1:]))
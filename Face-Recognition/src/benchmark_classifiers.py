@@ -0,0 +1,104 @@
+"""Benchmark of the classifier backends on synthetic FaceNet-like embeddings.
+
+Every class is a random direction on the 512-d unit sphere and its images are noisy copies of it,
+renormalised like FaceNet embeddings. For each backend and class count the table shows fit time,
+the latency of classifying one face, the pickled model size and the accuracy on held-out images.
+Backends are skipped above their --max_classes limit: the SVCs need hours at 10,000 classes and
+logistic regression holds several (images x classes) float64 matrices while fitting. Pass e.g.
+--max_classes logistic=10000 to run them anyway.
+
+Usage:
+    python src/benchmark_classifiers.py --nrof_classes 100 1000 10000
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import pickle
+import sys
+import time
+import numpy as np
+from classifier_backends import BACKENDS, train_classifier
+
+DEFAULT_MAX_CLASSES = {
+    'svc': 1000,
+    'linear_svc': 1000,
+    'logistic': 1000,
+    'knn': 100000,
+    'centroid': 100000,
+}
+
+def synthetic_embeddings(rng, nrof_classes, nrof_images, dim, noise):
+    centers = rng.normal(size=(nrof_classes, dim)).astype(np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    labels = np.repeat(np.arange(nrof_classes), nrof_images)
+    embs = centers[labels] + rng.normal(scale=noise/np.sqrt(dim), size=(len(labels), dim)).astype(np.float32)
+    embs /= np.linalg.norm(embs, axis=1, keepdims=True)
+    return embs, labels
+
+def benchmark_backend(backend, train_embs, train_labels, test_embs, test_labels, nrof_queries):
+    start = time.perf_counter()
+    model = train_classifier(backend, train_embs, train_labels)
+    fit_seconds = time.perf_counter() - start
+
+    timings = []
+    for i in range(min(nrof_queries, len(test_embs))):
+        start = time.perf_counter()
+        model.predict_proba(test_embs[i:i+1])
+        timings.append(time.perf_counter() - start)
+
+    predictions = np.argmax(model.predict_proba(test_embs), axis=1)
+    accuracy = np.mean(np.equal(predictions, test_labels))
+    size_mb = len(pickle.dumps(model)) / float(1 << 20)
+    return fit_seconds, 1000.0*np.median(timings), size_mb, accuracy
+
+def main(args):
+    max_classes = dict(DEFAULT_MAX_CLASSES)
+    for limit in args.max_classes:
+        backend, value = limit.split('=')
+        max_classes[backend] = int(value)
+    backends = args.backends or sorted(BACKENDS)
+
+    print('%8s %12s %10s %14s %10s %10s' % ('classes', 'backend', 'fit s', 'predict ms/q', 'size MB', 'accuracy'))
+    for nrof_classes in args.nrof_classes:
+        rng = np.random.RandomState(args.seed)
+        embs, labels = synthetic_embeddings(rng, nrof_classes, args.nrof_train_images + args.nrof_test_images,
+                                            args.embedding_size, args.noise)
+        is_test = np.tile(np.arange(args.nrof_train_images + args.nrof_test_images) >= args.nrof_train_images, nrof_classes)
+        for backend in backends:
+            if nrof_classes > max_classes.get(backend, 0):
+                print('%8d %12s %10s %14s %10s %10s' % (nrof_classes, backend, '-', '-', '-', '-'))
+                continue
+            fit_seconds, predict_ms, size_mb, accuracy = benchmark_backend(
+                backend, embs[~is_test], labels[~is_test], embs[is_test], labels[is_test], args.nrof_queries)
+            print('%8d %12s %10.2f %14.3f %10.2f %10.3f' % (nrof_classes, backend, fit_seconds, predict_ms, size_mb, accuracy))
+            sys.stdout.flush()
+    return 0
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--nrof_classes', type=int, nargs='+',
+        help='Numbers of synthetic people to benchmark.', default=[100, 1000, 10000])
+    parser.add_argument('--backends', type=str, nargs='+', choices=sorted(BACKENDS),
+        help='Backends to benchmark (all by default).')
+    parser.add_argument('--max_classes', type=str, nargs='*', default=[],
+        help='Per-backend class limits as backend=N, overriding the defaults.')
+    parser.add_argument('--nrof_train_images', type=int,
+        help='Training images per class.', default=8)
+    parser.add_argument('--nrof_test_images', type=int,
+        help='Held-out images per class.', default=2)
+    parser.add_argument('--embedding_size', type=int,
+        help='Dimensionality of the embeddings.', default=512)
+    parser.add_argument('--noise', type=float,
+        help='Norm of the per-image noise relative to the class direction.', default=3.0)
+    parser.add_argument('--nrof_queries', type=int,
+        help='Single-face queries timed per backend (the median is reported).', default=200)
+    parser.add_argument('--seed', type=int,
+        help='Random seed.', default=666)
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    sys.exit(main(parse_arguments(sys.argv[1:])))
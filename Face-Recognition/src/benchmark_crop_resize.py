@@ -0,0 +1,98 @@
+"""Benchmarks the batched crop-and-resample used by the MTCNN refinement stages against
+the original per-box loop, and checks that both produce the same network input.
+
+Usage:
+    python src/benchmark_crop_resize.py --image_width 1280 --image_height 720
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import sys
+import time
+import numpy as np
+import align.detect_face as detect_face
+
+def legacy_crop_resample(img, total_boxes, size):
+    """The per-box loop previously inlined in detect_face, including normalisation and transpose."""
+    h, w = img.shape[0], img.shape[1]
+    numbox = total_boxes.shape[0]
+    dy, edy, dx, edx, y, ey, x, ex, tmpw, tmph = detect_face.pad(total_boxes.copy(), w, h)
+    tempimg = np.zeros((size,size,3,numbox))
+    for k in range(0,numbox):
+        tmp = np.zeros((int(tmph[k]),int(tmpw[k]),3))
+        tmp[dy[k]-1:edy[k],dx[k]-1:edx[k],:] = img[y[k]-1:ey[k],x[k]-1:ex[k],:]
+        tempimg[:,:,:,k] = detect_face.imresample(tmp, (size, size))
+    tempimg = (tempimg-127.5)*0.0078125
+    return np.transpose(tempimg, (3,1,0,2))
+
+def batched_crop_resample(img, total_boxes, size):
+    tempimg = detect_face.crop_resample(img, total_boxes, size)
+    tempimg -= 127.5
+    tempimg *= 0.0078125
+    return np.transpose(tempimg, (0,2,1,3))
+
+def random_boxes(rng, nrof_boxes, w, h, min_size, max_size):
+    """Square boxes like those after rerec(), some of them crossing the image border."""
+    sizes = rng.randint(min_size, max_size + 1, size=nrof_boxes)
+    x1 = (rng.uniform(size=nrof_boxes) * (w + sizes // 4) - sizes // 4).astype(np.int32)
+    y1 = (rng.uniform(size=nrof_boxes) * (h + sizes // 4) - sizes // 4).astype(np.int32)
+    boxes = np.zeros((nrof_boxes, 5))
+    boxes[:,0] = x1
+    boxes[:,1] = y1
+    boxes[:,2] = x1 + sizes - 1
+    boxes[:,3] = y1 + sizes - 1
+    boxes[:,4] = rng.uniform(size=nrof_boxes)
+    return boxes
+
+def time_call(fn, nrof_runs):
+    timings = []
+    for _ in range(nrof_runs):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return 1000.0*np.median(timings), result
+
+def main(args):
+    rng = np.random.RandomState(args.seed)
+    img = rng.randint(0, 256, size=(args.image_height, args.image_width, 3)).astype(np.uint8)
+
+    print('%8s %6s %12s %12s %9s %12s' % ('boxes', 'size', 'loop ms', 'batched ms', 'speedup', 'max diff'))
+    for nrof_boxes in args.nrof_boxes:
+        boxes = random_boxes(rng, nrof_boxes, args.image_width, args.image_height, args.min_box_size, args.max_box_size)
+        for size in (24, 48):
+            legacy_ms, expected = time_call(lambda: legacy_crop_resample(img, boxes, size), args.nrof_runs)
+            batched_ms, actual = time_call(lambda: batched_crop_resample(img, boxes, size), args.nrof_runs)
+            max_diff = np.max(np.abs(expected - actual))
+            print('%8d %6d %12.2f %12.2f %8.1fx %12.2e' % (
+                nrof_boxes, size, legacy_ms, batched_ms, legacy_ms / batched_ms, max_diff))
+            if max_diff > args.tolerance:
+                print('Batched output differs from the per-box loop by more than %g' % args.tolerance)
+                return 1
+    return 0
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--nrof_boxes', type=int, nargs='+',
+        help='Candidate counts to benchmark.', default=[10, 100, 1000])
+    parser.add_argument('--image_width', type=int,
+        help='Width of the synthetic frame.', default=1280)
+    parser.add_argument('--image_height', type=int,
+        help='Height of the synthetic frame.', default=720)
+    parser.add_argument('--min_box_size', type=int,
+        help='Smallest candidate box side in pixels.', default=12)
+    parser.add_argument('--max_box_size', type=int,
+        help='Largest candidate box side in pixels.', default=240)
+    parser.add_argument('--nrof_runs', type=int,
+        help='Timed runs per configuration (the median is reported).', default=5)
+    parser.add_argument('--tolerance', type=float,
+        help='Largest accepted absolute difference of the normalised network input.', default=1e-4)
+    parser.add_argument('--seed', type=int,
+        help='Random seed.', default=666)
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    sys.exit(main(parse_arguments(sys.argv[1:])))
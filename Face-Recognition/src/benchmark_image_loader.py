@@ -0,0 +1,104 @@
+"""Benchmark of the embedding input pipeline: facenet.load_data versus the prefetching ImageLoader.
+
+Both loaders feed the same batches of aligned crops to a stand-in for sess.run that sleeps
+--consumer_ms per batch (like a session waiting on the device, it releases the GIL), so the
+numbers show how much of the decoding the prefetcher hides behind the embedding net. Each
+loader runs in its own subprocess so the reported peak RSS is its own.
+
+Usage:
+    python src/benchmark_image_loader.py ~/datasets/processed --batch_size 1000 --consumer_ms 400
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+import numpy as np
+import facenet
+from image_loader import ImageLoader
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+def run_load_data(paths, args):
+    checksum = 0.0
+    for start in range(0, len(paths), args.batch_size):
+        images = facenet.load_data(paths[start:start+args.batch_size], False, False, args.image_size)
+        time.sleep(args.consumer_ms / 1000.0)
+        checksum += float(images[:,0,0,0].sum())
+    return checksum
+
+def run_image_loader(paths, args):
+    checksum = 0.0
+    loader = ImageLoader(args.image_size, args.batch_size, nrof_threads=args.nrof_threads, prefetch=args.prefetch)
+    for _, images in loader.batches(paths):
+        time.sleep(args.consumer_ms / 1000.0)
+        checksum += float(images[:,0,0,0].sum())
+    return checksum
+
+LOADERS = {
+    'load_data': run_load_data,
+    'image_loader': run_image_loader,
+}
+
+def run_one(paths, args):
+    baseline_mb = peak_rss_mb()
+    start = time.perf_counter()
+    checksum = LOADERS[args.loader](paths, args)
+    elapsed = time.perf_counter() - start
+    print(json.dumps({'loader': args.loader, 'images_per_sec': len(paths) / elapsed, 'seconds': elapsed,
+                      'peak_rss_mb': peak_rss_mb(), 'baseline_rss_mb': baseline_mb, 'checksum': checksum}))
+
+def main(args):
+    dataset = facenet.get_dataset(args.data_dir)
+    paths, _ = facenet.get_image_paths_and_labels(dataset)
+    paths = paths[:args.max_images] if args.max_images else paths
+    if args.loader:
+        run_one(paths, args)
+        return 0
+
+    print('%d images, batch size %d, consumer %.0f ms per batch' % (len(paths), args.batch_size, args.consumer_ms))
+    print('%14s %12s %10s %14s' % ('loader', 'images/sec', 'seconds', 'peak RSS MB'))
+    results = []
+    for loader in sorted(LOADERS):
+        output = subprocess.check_output([sys.executable, __file__] + sys.argv[1:] + ['--loader', loader])
+        result = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+        results.append(result)
+        print('%14s %12.1f %10.2f %14.1f' % (loader, result['images_per_sec'], result['seconds'], result['peak_rss_mb']))
+    # Both loaders see the same pixels; only float32 rounding may differ
+    checksums = [result['checksum'] for result in results]
+    if not np.allclose(checksums[0], checksums[1], rtol=1e-4, atol=1e-2):
+        print('Checksums differ: %s' % checksums)
+        return 1
+    return 0
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('data_dir', type=str,
+        help='Directory with aligned face crops, one subdirectory per class.')
+    parser.add_argument('--batch_size', type=int,
+        help='Number of images per batch.', default=90)
+    parser.add_argument('--image_size', type=int,
+        help='Image size (height, width) in pixels.', default=160)
+    parser.add_argument('--nrof_threads', type=int,
+        help='ImageLoader decode threads.', default=4)
+    parser.add_argument('--prefetch', type=int,
+        help='Batches the ImageLoader prepares ahead.', default=2)
+    parser.add_argument('--consumer_ms', type=float,
+        help='Simulated sess.run time per batch in milliseconds.', default=0.0)
+    parser.add_argument('--max_images', type=int,
+        help='Only use the first images of the dataset.', default=0)
+    parser.add_argument('--loader', type=str, choices=sorted(LOADERS),
+        help='Run only this loader and print its result as JSON (used internally).')
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    sys.exit(main(parse_arguments(sys.argv[1:])))
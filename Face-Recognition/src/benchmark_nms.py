@@ -0,0 +1,154 @@
+"""Micro-benchmark of the MTCNN non-maximum suppression implementations.
+
+With --image_dir the candidate sets are recorded from real detect_face runs (every nms call of
+the PNet pyramid and the refinement stages), e.g. on classroom photos; otherwise synthetic
+PNet-like candidate sets are generated: dense clusters of boxes around each face plus
+scattered background boxes. Every implementation must return the same picks as the
+original greedy loop.
+
+Usage:
+    python src/benchmark_nms.py --image_dir ~/classroom_photos
+    python src/benchmark_nms.py --nrof_boxes 100 1000 5000 20000 50000
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import time
+import numpy as np
+import align.detect_face as detect_face
+
+IMPLEMENTATIONS = [
+    ('greedy', detect_face.nms_greedy),
+    ('matrix', detect_face.nms_matrix),
+    ('sweep', detect_face.nms_sweep),
+    ('auto', detect_face.nms),
+]
+
+def synthetic_candidates(rng, nrof_boxes, w, h, nrof_faces):
+    """PNet-like candidates: 80% in clusters around face positions, the rest scattered."""
+    nrof_clustered = int(0.8 * nrof_boxes)
+    face_size = rng.uniform(16, 80, size=nrof_faces)
+    face_x = rng.uniform(0, w - 80, size=nrof_faces)
+    face_y = rng.uniform(0, h - 80, size=nrof_faces)
+    face = rng.randint(0, nrof_faces, size=nrof_clustered)
+    size = np.concatenate([face_size[face] * rng.uniform(0.7, 1.3, size=nrof_clustered),
+                           rng.uniform(12, 120, size=nrof_boxes - nrof_clustered)])
+    x1 = np.concatenate([face_x[face] + rng.normal(0, 0.15, size=nrof_clustered) * face_size[face],
+                         rng.uniform(0, w, size=nrof_boxes - nrof_clustered)])
+    y1 = np.concatenate([face_y[face] + rng.normal(0, 0.15, size=nrof_clustered) * face_size[face],
+                         rng.uniform(0, h, size=nrof_boxes - nrof_clustered)])
+    boxes = np.zeros((nrof_boxes, 9))
+    boxes[:,0] = np.fix(x1)
+    boxes[:,1] = np.fix(y1)
+    boxes[:,2] = np.fix(x1 + size)
+    boxes[:,3] = np.fix(y1 + size)
+    boxes[:,4] = rng.uniform(0.6, 1.0, size=nrof_boxes)
+    return boxes
+
+def recorded_candidates(image_dir, max_images, minsize):
+    """Run detect_face on the images and record the arguments of every nms call."""
+    import tensorflow as tf
+    import imageio
+    calls = []
+    original_nms = detect_face.nms
+    def recording_nms(boxes, threshold, method):
+        calls.append((boxes.copy(), threshold, method))
+        return original_nms(boxes, threshold, method)
+
+    paths = sorted(os.path.join(image_dir, name) for name in os.listdir(image_dir)
+                   if name.lower().endswith(('.jpg', '.jpeg', '.png')))[:max_images]
+    with tf.Graph().as_default():
+        sess = tf.compat.v1.Session()
+        with sess.as_default():
+            pnet, rnet, onet = detect_face.create_mtcnn(sess, None)
+        detect_face.nms = recording_nms
+        try:
+            for path in paths:
+                img = imageio.imread(path)[:,:,0:3]
+                detect_face.detect_face(img, minsize, pnet, rnet, onet, [0.6, 0.7, 0.7], 0.709)
+        finally:
+            detect_face.nms = original_nms
+    return [call for call in calls if call[0].size > 0]
+
+def time_call(fn, boxes, threshold, method, nrof_runs):
+    timings = []
+    for _ in range(nrof_runs):
+        start = time.perf_counter()
+        pick = fn(boxes, threshold, method)
+        timings.append(time.perf_counter() - start)
+    return 1000.0*np.median(timings), pick
+
+def main(args):
+    if args.image_dir:
+        calls = recorded_candidates(os.path.expanduser(args.image_dir), args.max_images, args.minsize)
+        print('Recorded %d nms calls from %s' % (len(calls), args.image_dir))
+        # Group by size so the table stays readable: report the largest call of each decade
+        by_bucket = {}
+        for call in calls:
+            bucket = int(np.log10(call[0].shape[0]))
+            if bucket not in by_bucket or call[0].shape[0] > by_bucket[bucket][0].shape[0]:
+                by_bucket[bucket] = call
+        cases = [by_bucket[bucket] for bucket in sorted(by_bucket)]
+    else:
+        rng = np.random.RandomState(args.seed)
+        cases = []
+        for nrof_boxes in args.nrof_boxes:
+            boxes = synthetic_candidates(rng, nrof_boxes, args.image_width, args.image_height, args.nrof_faces)
+            cases += [(boxes, 0.5, 'Union'), (boxes, 0.7, 'Min')]
+
+    print('%8s %6s %6s %8s' % ('boxes', 'method', 'thresh', 'picks') +
+          ''.join('%12s' % (name + ' ms') for name, _ in IMPLEMENTATIONS))
+    for boxes, threshold, method in cases:
+        reference = None
+        row = ''
+        for name, fn in IMPLEMENTATIONS:
+            if name == 'greedy' and boxes.shape[0] > args.max_greedy_boxes:
+                row += '%12s' % '-'
+                continue
+            if name == 'matrix' and boxes.shape[0] > args.max_matrix_boxes:
+                row += '%12s' % '-'
+                continue
+            ms, pick = time_call(fn, boxes, threshold, method, args.nrof_runs)
+            if reference is None:
+                reference = pick
+            elif not np.array_equal(reference, pick):
+                print('%s picks differ from the reference for %d boxes (%s, %g)' % (name, boxes.shape[0], method, threshold))
+                return 1
+            row += '%12.3f' % ms
+        print('%8d %6s %6.2f %8d' % (boxes.shape[0], method, threshold, len(reference)) + row)
+    return 0
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--image_dir', type=str,
+        help='Photos to record real candidate sets from (requires the MTCNN weights).')
+    parser.add_argument('--max_images', type=int,
+        help='Number of photos to record from.', default=10)
+    parser.add_argument('--minsize', type=int,
+        help='Minimum face size used when recording.', default=20)
+    parser.add_argument('--nrof_boxes', type=int, nargs='+',
+        help='Synthetic candidate counts to benchmark.', default=[50, 300, 1000, 5000, 20000])
+    parser.add_argument('--nrof_faces', type=int,
+        help='Faces per synthetic frame.', default=40)
+    parser.add_argument('--image_width', type=int,
+        help='Width of the synthetic frame.', default=1920)
+    parser.add_argument('--image_height', type=int,
+        help='Height of the synthetic frame.', default=1080)
+    parser.add_argument('--max_greedy_boxes', type=int,
+        help='Skip the greedy loop above this many boxes.', default=50000)
+    parser.add_argument('--max_matrix_boxes', type=int,
+        help='Skip the overlap matrix above this many boxes (it needs N^2 memory).', default=6000)
+    parser.add_argument('--nrof_runs', type=int,
+        help='Timed runs per case (the median is reported).', default=5)
+    parser.add_argument('--seed', type=int,
+        help='Random seed.', default=666)
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    sys.exit(main(parse_arguments(sys.argv[1:])))
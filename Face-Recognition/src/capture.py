@@ -1,6 +1,9 @@
 import cv2
 import os
 import sys
+import argparse
+import json
+from face_diversity import DiversityFilter
 
 def create_directory(directory):
     """
@@ -12,11 +15,24 @@ def create_directory(directory):
     if not os.path.exists(directory):
         os.makedirs(directory)
 
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('student_code', type=str, nargs='?',
+        help='Student code the images are saved under, e.g. SV001.')
+    parser.add_argument('--target', type=int,
+        help='Stop once this many distinct poses are saved.', default=30)
+    parser.add_argument('--max_frames', type=int,
+        help='Stop after this many detected faces even if the target is not reached.', default=300)
+    parser.add_argument('--max_hash_distance', type=int,
+        help='Faces within this many dHash bits of a saved face are skipped as duplicates.', default=6)
+    return parser.parse_args(argv)
+
 if __name__ == "__main__":
+    args = parse_arguments(sys.argv[1:])
     # Nhận student_code từ command line argument hoặc input
     # PHẢI là student_code (VD: SV001) để đồng bộ với database
-    if len(sys.argv) > 1:
-        student_code = sys.argv[1].upper()  # Uppercase để chuẩn hóa
+    if args.student_code:
+        student_code = args.student_code.upper()  # Uppercase để chuẩn hóa
     else:
         student_code = str(input("Enter Student Code (e.g., SV001): ")).upper()
 
@@ -28,6 +44,9 @@ if __name__ == "__main__":
     video = cv2.VideoCapture(0)
     facedetect = cv2.CascadeClassifier('haarcascade_frontalface_default.xml')
     count = 0
+    nrof_faces = 0
+    # Consecutive frames are mostly the same pose; only distinct ones are saved
+    diversity = DiversityFilter(max_hash_distance=args.max_hash_distance, target=args.target)
 
     # Lưu vào thư mục với student_code để đồng bộ với database
     path = '../Dataset/FaceData/raw/' + student_code
@@ -44,25 +63,33 @@ if __name__ == "__main__":
 
         faces = facedetect.detectMultiScale(frame, 1.3, 5)
         for x, y, w, h in faces:
-            count = count + 1
-            # Tên file dùng student_code
-            image_path = f"{path}/{student_code}-{count}.jpg"
-            print(f"Capturing image {count}/100: {image_path}")
-            cv2.imwrite(image_path, frame[y:y + h, x:x + w])
-            cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 3)
+            nrof_faces += 1
+            face = frame[y:y + h, x:x + w]
+            kept, _ = diversity.offer(face)
+            if kept:
+                count = count + 1
+                # Tên file dùng student_code
+                image_path = f"{path}/{student_code}-{count}.jpg"
+                print(f"Capturing image {count}/{args.target}: {image_path}")
+                cv2.imwrite(image_path, face)
+            cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0) if kept else (0, 165, 255), 3)
 
         # Hiển thị student_code và số ảnh đã chụp
-        cv2.putText(frame, f"{student_code}: {count}/100", (10, 30),
+        cv2.putText(frame, f"{student_code}: {count}/{args.target}", (10, 30),
                     cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
         cv2.imshow("Capture Face - Press 'q' to quit", frame)
 
         # Nhấn 'q' để thoát sớm
         if cv2.waitKey(1) & 0xFF == ord('q'):
             break
-        if count >= 100:
+        if diversity.done or nrof_faces >= args.max_frames:
             break
 
     video.release()
     cv2.destroyAllWindows()
+    stats = diversity.stats()
     print(f"Capture completed! Total images: {count}")
+    print(f"Kept {stats['kept']} distinct faces, rejected {stats['rejected']} near-duplicates "
+          f"({stats['reduction'] * 100:.0f}% less alignment and embedding work per training)")
     print(f"Images saved to: {path}")
+    print("DIVERSITY " + json.dumps(stats))
@@ -32,9 +32,11 @@ import argparse
 import facenet
 import os
 import sys
-import math
-import pickle
-from sklearn.svm import SVC
+import json
+import time
+from classifier_backends import BACKENDS, train_classifier, save_classifier, load_classifier, backend_name
+from embedding_store import EmbeddingStore, model_version
+from image_loader import ImageLoader
 
 def main(args):
   
@@ -63,53 +65,69 @@ def main(args):
             
             print('Number of classes: %d' % len(dataset))
             print('Number of images: %d' % len(paths))
+            if len(paths) == 0:
+                # Nothing to embed: new_emb_array would never be computed below
+                raise ValueError('No images found in %s' % args.data_dir)
             
-            # Load the model
-            print('Loading feature extraction model')
-            facenet.load_model(args.model)
-            
-            # Get input and output tensors
-            images_placeholder = tf.compat.v1.get_default_graph().get_tensor_by_name("input:0")
-            embeddings = tf.compat.v1.get_default_graph().get_tensor_by_name("embeddings:0")
-            phase_train_placeholder = tf.compat.v1.get_default_graph().get_tensor_by_name("phase_train:0")
-            embedding_size = embeddings.get_shape()[1]
-            
-            # Run forward pass to calculate embeddings
-            print('Calculating features for images')
-            nrof_images = len(paths)
-            nrof_batches_per_epoch = int(math.ceil(1.0*nrof_images / args.batch_size))
-            emb_array = np.zeros((nrof_images, embedding_size))
-            for i in range(nrof_batches_per_epoch):
-                start_index = i*args.batch_size
-                end_index = min((i+1)*args.batch_size, nrof_images)
-                paths_batch = paths[start_index:end_index]
-                images = facenet.load_data(paths_batch, False, False, args.image_size)
-                feed_dict = { images_placeholder:images, phase_train_placeholder:False }
-                emb_array[start_index:end_index,:] = sess.run(embeddings, feed_dict=feed_dict)
-            
+            if args.embedding_store:
+                store = EmbeddingStore(args.embedding_store, model_version(args.model))
+                hashes = store.hash_files(paths)
+                missing = store.missing(hashes)
+                print('Embedding store has %d of %d images' % (len(paths) - len(missing), len(paths)))
+            else:
+                store = None
+                missing = list(range(len(paths)))
+
+            if missing:
+                # Load the model
+                print('Loading feature extraction model')
+                embed, embedding_size = load_embedder(args.model, sess)
+
+                # Run forward pass to calculate embeddings
+                print('Calculating features for %d images' % len(missing))
+                nrof_images = len(missing)
+                new_emb_array = np.zeros((nrof_images, embedding_size), dtype=np.float32)
+                loader = ImageLoader(args.image_size, args.batch_size, nrof_threads=args.nrof_loader_threads)
+                start_time = time.time()
+                for start_index, images in loader.batches([paths[j] for j in missing]):
+                    new_emb_array[start_index:start_index+len(images),:] = embed(images)
+                    if args.progress:
+                        print_progress(start_index+len(images), nrof_images, time.time() - start_time)
+
+            if store is not None:
+                if missing:
+                    store.add([hashes[j] for j in missing], new_emb_array)
+                if args.mode == 'TRAIN' and not args.use_split_dataset:
+                    # Only the full training dataset tells which files were deleted; a CLASSIFY
+                    # run sees a test directory and must not drop the training embeddings
+                    dropped = store.retain(paths)
+                    if dropped:
+                        print('Dropped %d embeddings of deleted images' % dropped)
+                store.save()
+                emb_array = store.get(hashes)
+            else:
+                emb_array = new_emb_array
+
             classifier_filename_exp = os.path.expanduser(args.classifier_filename)
 
             if (args.mode=='TRAIN'):
                 # Train classifier
-                print('Training classifier')
-                model = SVC(kernel='linear', probability=True)
-                model.fit(emb_array, labels)
+                print('Training %s classifier' % args.classifier)
+                model = train_classifier(args.classifier, emb_array, labels)
             
                 # Create a list of class names
                 class_names = [ cls.name.replace('_', ' ') for cls in dataset]
 
                 # Saving classifier model
-                with open(classifier_filename_exp, 'wb') as outfile:
-                    pickle.dump((model, class_names), outfile)
+                save_classifier(classifier_filename_exp, model, class_names)
                 print('Saved classifier model to file "%s"' % classifier_filename_exp)
                 
             elif (args.mode=='CLASSIFY'):
                 # Classify images
                 print('Testing classifier')
-                with open(classifier_filename_exp, 'rb') as infile:
-                    (model, class_names) = pickle.load(infile)
+                (model, class_names) = load_classifier(classifier_filename_exp)
 
-                print('Loaded classifier model from file "%s"' % classifier_filename_exp)
+                print('Loaded %s classifier model from file "%s"' % (backend_name(model), classifier_filename_exp))
 
                 predictions = model.predict_proba(emb_array)
                 best_class_indices = np.argmax(predictions, axis=1)
@@ -122,6 +140,39 @@ def main(args):
                 print('Accuracy: %.3f' % accuracy)
                 
             
+def print_progress(done, total, elapsed):
+    rate = done / elapsed if elapsed > 0 else 0.0
+    progress = {'done': done, 'total': total, 'elapsed_sec': round(elapsed, 1), 'images_per_sec': round(rate, 2),
+                'eta_sec': round((total - done) / rate, 1) if rate > 0 else None}
+    print('PROGRESS %s' % json.dumps(progress))
+    sys.stdout.flush()
+
+def load_embedder(model, sess):
+    """Returns (embed function, embedding size) for the model the API serves: a frozen graph
+    or checkpoint directory, an inference-only export without phase_train, or a .tflite variant
+    from export_inference_graph.py. The classifier must be fitted on the embeddings of the
+    model that produces them at serving time."""
+    if model.endswith('.tflite'):
+        embedder = facenet.TFLiteEmbedder(model)
+        return embedder.embed, embedder.embedding_size
+
+    facenet.load_model(model)
+    graph = tf.compat.v1.get_default_graph()
+    images_placeholder = graph.get_tensor_by_name("input:0")
+    embeddings = graph.get_tensor_by_name("embeddings:0")
+    try:
+        phase_train_placeholder = graph.get_tensor_by_name("phase_train:0")
+    except KeyError:
+        # Inference-only graphs have phase_train folded away
+        phase_train_placeholder = None
+
+    def embed(images):
+        feed_dict = { images_placeholder:images }
+        if phase_train_placeholder is not None:
+            feed_dict[phase_train_placeholder] = False
+        return sess.run(embeddings, feed_dict=feed_dict)
+    return embed, embeddings.get_shape()[1]
+
 def split_dataset(dataset, min_nrof_images_per_class, nrof_train_images_per_class):
     train_set = []
     test_set = []
@@ -144,17 +195,26 @@ def parse_arguments(argv):
     parser.add_argument('data_dir', type=str,
         help='Path to the data directory containing aligned LFW face patches.')
     parser.add_argument('model', type=str, 
-        help='Could be either a directory containing the meta_file and ckpt_file or a model protobuf (.pb) file')
+        help='Could be either a directory containing the meta_file and ckpt_file, a model protobuf (.pb) file ' +
+        'or a .tflite variant from export_inference_graph.py')
     parser.add_argument('classifier_filename', 
         help='Classifier model file name as a pickle (.pkl) file. ' + 
         'For training this is the output and for classification this is an input.')
+    parser.add_argument('--classifier', type=str, choices=sorted(BACKENDS),
+        help='Classifier backend trained in TRAIN mode (see classifier_backends.py).', default='svc')
     parser.add_argument('--use_split_dataset', 
         help='Indicates that the dataset specified by data_dir should be split into a training and test set. ' +  
         'Otherwise a separate test set can be specified using the test_data_dir option.', action='store_true')
     parser.add_argument('--test_data_dir', type=str,
         help='Path to the test data directory containing aligned images used for testing.')
+    parser.add_argument('--embedding_store', type=str,
+        help='Directory of a persistent embedding store; only images missing from it are run through the model.')
     parser.add_argument('--batch_size', type=int,
         help='Number of images to process in a batch.', default=90)
+    parser.add_argument('--nrof_loader_threads', type=int,
+        help='Threads decoding and prewhitening the next batches while the current one is embedded.', default=4)
+    parser.add_argument('--progress',
+        help='Print a PROGRESS json line after every embedded batch.', action='store_true')
     parser.add_argument('--image_size', type=int,
         help='Image size (height, width) in pixels.', default=160)
     parser.add_argument('--seed', type=int,
@@ -0,0 +1,197 @@
+"""Classifier backends for identifying people from FaceNet embeddings.
+
+Every backend is an sklearn-style estimator with fit/predict_proba and is saved in the format
+classifier.py has always written: a pickled (model, class_names) tuple, where column i of
+predict_proba belongs to class_names[i]. Older SVC pickles therefore load unchanged.
+
+- svc:        SVC(kernel='linear', probability=True), the original backend. One-vs-one models
+              plus a 5-fold Platt scaling; training cost grows quickly with the number of classes.
+- centroid:   nearest class centroid on L2-normalised embeddings, softmax over cosine similarity.
+- knn:        cosine k-nearest neighbours over all training embeddings, similarity weighted votes.
+- logistic:   multinomial logistic regression.
+- linear_svc: one-vs-rest LinearSVC; a single sigmoid fitted on cross-validated decision values
+              turns its scores into probabilities.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import pickle
+import sys
+import numpy as np
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import StratifiedKFold, cross_val_predict
+from sklearn.svm import SVC, LinearSVC
+
+def l2_normalize(x):
+    x = np.asarray(x, dtype=np.float32)
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    return x / np.maximum(norms, 1e-10)
+
+class CentroidClassifier():
+    """Nearest class centroid with cosine similarity.
+
+    temperature: softmax temperature over the similarities; lower values give more confident
+    probabilities for the same margin between the best and second best class.
+    """
+    def __init__(self, temperature=0.05):
+        self.temperature = temperature
+
+    def fit(self, X, y):
+        X = l2_normalize(X)
+        y = np.asarray(y)
+        self.classes_, inverse = np.unique(y, return_inverse=True)
+        centroids = np.zeros((len(self.classes_), X.shape[1]), dtype=np.float32)
+        np.add.at(centroids, inverse, X)
+        self.centroids_ = l2_normalize(centroids)
+        return self
+
+    def decision_function(self, X):
+        return np.dot(l2_normalize(X), self.centroids_.T)
+
+    def predict_proba(self, X):
+        logits = self.decision_function(X) / self.temperature
+        logits -= np.max(logits, axis=1, keepdims=True)
+        np.exp(logits, out=logits)
+        logits /= np.sum(logits, axis=1, keepdims=True)
+        return logits
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.decision_function(X), axis=1)]
+
+class CosineKNNClassifier():
+    """k nearest training embeddings by cosine similarity; each neighbour votes for its class
+    with its similarity and the votes are normalised to probabilities."""
+    def __init__(self, k=5):
+        self.k = k
+
+    def fit(self, X, y):
+        self.embeddings_ = l2_normalize(X)
+        self.classes_, self.labels_ = np.unique(np.asarray(y), return_inverse=True)
+        return self
+
+    def predict_proba(self, X):
+        X = l2_normalize(X)
+        proba = np.zeros((X.shape[0], len(self.classes_)), dtype=np.float32)
+        k = min(self.k, self.embeddings_.shape[0])
+        # Bound the similarity matrix to about 32M entries
+        block_size = max(1, (1 << 25) // self.embeddings_.shape[0])
+        for start in range(0, X.shape[0], block_size):
+            sims = np.dot(X[start:start+block_size], self.embeddings_.T)
+            neighbours = np.argpartition(-sims, k-1, axis=1)[:,:k]
+            rows = np.arange(sims.shape[0])[:,np.newaxis]
+            votes = np.maximum(sims[rows, neighbours], 1e-6)
+            np.add.at(proba, (start + np.broadcast_to(rows, neighbours.shape), self.labels_[neighbours]), votes)
+        proba /= np.sum(proba, axis=1, keepdims=True)
+        return proba
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+class CalibratedLinearSVC():
+    """One-vs-rest LinearSVC with probabilities from one sigmoid shared by all classes.
+
+    sklearn's CalibratedClassifierCV fits and evaluates a sigmoid per class, which dominates
+    both training and prediction time with thousands of classes; a shared sigmoid is
+    vectorised and needs only the held-out scores of nrof_folds extra LinearSVC fits.
+    """
+    def __init__(self, C=1.0, nrof_folds=3):
+        self.C = C
+        self.nrof_folds = nrof_folds
+
+    def fit(self, X, y):
+        y = np.asarray(y)
+        self.svc_ = LinearSVC(C=self.C).fit(X, y)
+        self.classes_ = self.svc_.classes_
+        folds = StratifiedKFold(n_splits=self.nrof_folds, shuffle=True, random_state=0)
+        scores = cross_val_predict(LinearSVC(C=self.C), X, y, cv=folds, method='decision_function')
+        if scores.ndim == 1:
+            scores = np.stack([-scores, scores], axis=1)
+        targets = np.equal(y[:,np.newaxis], self.classes_[np.newaxis,:])
+        sigmoid = LogisticRegression(C=1e6).fit(scores.reshape(-1, 1), targets.ravel())
+        self.a_ = float(sigmoid.coef_[0,0])
+        self.b_ = float(sigmoid.intercept_[0])
+        return self
+
+    def decision_function(self, X):
+        scores = self.svc_.decision_function(X)
+        if scores.ndim == 1:
+            scores = np.stack([-scores, scores], axis=1)
+        return scores
+
+    def predict_proba(self, X):
+        proba = 1.0 / (1.0 + np.exp(-(self.a_ * self.decision_function(X) + self.b_)))
+        proba /= np.sum(proba, axis=1, keepdims=True)
+        return proba
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.decision_function(X), axis=1)]
+
+def create_svc(labels, params):
+    return SVC(kernel='linear', probability=True)
+
+def create_centroid(labels, params):
+    return CentroidClassifier(temperature=params.get('temperature', 0.05))
+
+def create_knn(labels, params):
+    return CosineKNNClassifier(k=params.get('k', 5))
+
+def create_logistic(labels, params):
+    return LogisticRegression(C=params.get('C', 10.0), max_iter=params.get('max_iter', 300))
+
+def create_linear_svc(labels, params):
+    min_count = np.min(np.unique(labels, return_counts=True)[1])
+    if min_count < 2:
+        raise ValueError('The linear_svc backend needs at least 2 images per class for calibration')
+    return CalibratedLinearSVC(C=params.get('C', 1.0), nrof_folds=min(3, min_count))
+
+BACKENDS = {
+    'svc': create_svc,
+    'centroid': create_centroid,
+    'knn': create_knn,
+    'logistic': create_logistic,
+    'linear_svc': create_linear_svc,
+}
+
+BACKEND_TYPES = [
+    (SVC, 'svc'),
+    (CentroidClassifier, 'centroid'),
+    (CosineKNNClassifier, 'knn'),
+    (LogisticRegression, 'logistic'),
+    (CalibratedLinearSVC, 'linear_svc'),
+]
+
+def create_classifier(backend, labels, **params):
+    """Unfitted estimator of the named backend for the given training labels."""
+    if backend not in BACKENDS:
+        raise ValueError('Unknown classifier backend "%s", expected one of %s' % (backend, ', '.join(sorted(BACKENDS))))
+    return BACKENDS[backend](labels, params)
+
+def train_classifier(backend, emb_array, labels, **params):
+    model = create_classifier(backend, labels, **params)
+    model.fit(emb_array, labels)
+    return model
+
+def backend_name(model):
+    for model_type, name in BACKEND_TYPES:
+        if isinstance(model, model_type):
+            return name
+    return type(model).__name__
+
+def save_classifier(path, model, class_names):
+    with open(path, 'wb') as outfile:
+        pickle.dump((model, class_names), outfile)
+
+class _Unpickler(pickle.Unpickler):
+    # This module is imported as classifier_backends by the scripts in src and as
+    # src.classifier_backends by the API; models pickled by either load in both.
+    def find_class(self, module, name):
+        if module in ('classifier_backends', 'src.classifier_backends'):
+            return getattr(sys.modules[__name__], name)
+        return pickle.Unpickler.find_class(self, module, name)
+
+def load_classifier(path):
+    """(model, class_names) of a classifier file written by classifier.py."""
+    with open(path, 'rb') as infile:
+        return _Unpickler(infile).load()
@@ -26,15 +26,15 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-from scipy import misc
 import tensorflow as tf
 import numpy as np
 import sys
-import os
 import copy
 import argparse
+from PIL import Image
 import facenet
 import align.detect_face
+from image_loader import ImageLoader, prewhiten_into
 
 def main(args):
 
@@ -90,9 +90,11 @@ def load_and_align_data(image_paths, image_size, margin, gpu_memory_fraction):
             pnet, rnet, onet = align.detect_face.create_mtcnn(sess, None)
   
     tmp_image_paths=copy.copy(image_paths)
-    img_list = []
-    for image in tmp_image_paths:
-        img = misc.imread(os.path.expanduser(image), mode='RGB')
+    # The next images are decoded while MTCNN runs on the current one
+    loader = ImageLoader(image_size, batch_size=4)
+    images = np.empty((len(tmp_image_paths), image_size, image_size, 3), dtype=np.float32)
+    nrof_aligned = 0
+    for image, img in loader.images(tmp_image_paths):
         img_size = np.asarray(img.shape)[0:2]
         bounding_boxes, _ = align.detect_face.detect_face(img, minsize, pnet, rnet, onet, threshold, factor)
         if len(bounding_boxes) < 1:
@@ -106,11 +108,10 @@ def load_and_align_data(image_paths, image_size, margin, gpu_memory_fraction):
         bb[2] = np.minimum(det[2]+margin/2, img_size[1])
         bb[3] = np.minimum(det[3]+margin/2, img_size[0])
         cropped = img[bb[1]:bb[3],bb[0]:bb[2],:]
-        aligned = misc.imresize(cropped, (image_size, image_size), interp='bilinear')
-        prewhitened = facenet.prewhiten(aligned)
-        img_list.append(prewhitened)
-    images = np.stack(img_list)
-    return images
+        aligned = np.asarray(Image.fromarray(cropped).resize((image_size, image_size), Image.BILINEAR))
+        prewhiten_into(aligned, images[nrof_aligned])
+        nrof_aligned += 1
+    return images[:nrof_aligned]
 
 def parse_arguments(argv):
     parser = argparse.ArgumentParser()
@@ -0,0 +1,160 @@
+"""Persistent FaceNet embeddings keyed by (image content hash, model version).
+
+Every model version gets its own directory holding
+- vectors.<generation>.f32: float32 rows, only ever appended to; compaction writes the next
+  generation instead of rewriting it in place,
+- index.json: the vectors file, the row of each image hash and the hash of each known file path.
+The index is replaced atomically after the vectors are appended, so rows written by a run
+that crashed before saving are simply ignored (and truncated) on the next load.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import json
+import hashlib
+import numpy as np
+
+VECTORS_FILENAME = 'vectors.%d.f32'
+INDEX_FILENAME = 'index.json'
+
+def file_sha1(path, block_size=1 << 20):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+def model_version(model):
+    """Version key of a FaceNet model: the content hash of a .pb file, or of the checkpoint
+    files of a model directory."""
+    model_exp = os.path.expanduser(model)
+    if os.path.isfile(model_exp):
+        return file_sha1(model_exp)
+    sha1 = hashlib.sha1()
+    for name in sorted(os.listdir(model_exp)):
+        path = os.path.join(model_exp, name)
+        if os.path.isfile(path):
+            sha1.update(name.encode('utf-8'))
+            sha1.update(file_sha1(path).encode('ascii'))
+    return sha1.hexdigest()
+
+class EmbeddingStore():
+    "Embeddings of one model version, looked up by the SHA-1 of the image file"
+    def __init__(self, store_dir, version):
+        self.store_dir = os.path.join(os.path.expanduser(store_dir), version)
+        self.version = version
+        self.dim = None
+        self.rows = {}      # image sha1 -> row in the vectors file
+        self.files = {}     # path -> {'sha1', 'size', 'mtime'}, so unchanged files are not re-hashed
+        self.generation = 0
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.load()
+
+    @property
+    def vectors_path(self):
+        return os.path.join(self.store_dir, VECTORS_FILENAME % self.generation)
+
+    @property
+    def index_path(self):
+        return os.path.join(self.store_dir, INDEX_FILENAME)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def load(self):
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, 'r') as f:
+            index = json.load(f)
+        self.dim = index['dim']
+        self.rows = index['rows']
+        self.files = index['files']
+        self.generation = index['generation']
+        nrof_rows = index['nrof_rows']
+        if nrof_rows and self.dim:
+            self.vectors = np.fromfile(self.vectors_path, dtype=np.float32, count=nrof_rows*self.dim).reshape(nrof_rows, self.dim)
+        # Rows appended by a run that did not get to save its index
+        if os.path.exists(self.vectors_path) and os.path.getsize(self.vectors_path) > self.vectors.nbytes:
+            with open(self.vectors_path, 'r+b') as f:
+                f.truncate(self.vectors.nbytes)
+
+    def save(self):
+        if not os.path.exists(self.store_dir):
+            os.makedirs(self.store_dir)
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': self.version, 'dim': self.dim, 'generation': self.generation,
+                       'nrof_rows': int(self.vectors.shape[0]), 'rows': self.rows, 'files': self.files}, f)
+        os.replace(tmp_path, self.index_path)
+
+    def hash_files(self, paths):
+        """Content hash of every path; files whose size and mtime did not change are not read."""
+        hashes = []
+        for path in paths:
+            stat = os.stat(path)
+            known = self.files.get(path)
+            if known is None or known['size'] != stat.st_size or known['mtime'] != stat.st_mtime:
+                known = {'sha1': file_sha1(path), 'size': stat.st_size, 'mtime': stat.st_mtime}
+                self.files[path] = known
+            hashes.append(known['sha1'])
+        return hashes
+
+    def missing(self, hashes):
+        """Indices of the hashes that have no stored embedding (duplicates are listed once)."""
+        seen = set()
+        indices = []
+        for i, sha1 in enumerate(hashes):
+            if sha1 not in self.rows and sha1 not in seen:
+                seen.add(sha1)
+                indices.append(i)
+        return indices
+
+    def add(self, hashes, embeddings):
+        """Append the embeddings of new images to the vectors file."""
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        if len(hashes) == 0:
+            return
+        if self.dim is None:
+            self.dim = int(embeddings.shape[1])
+            self.vectors = np.zeros((0, self.dim), dtype=np.float32)
+        elif embeddings.shape[1] != self.dim:
+            raise ValueError('Embedding size %d does not match the store (%d)' % (embeddings.shape[1], self.dim))
+        if not os.path.exists(self.store_dir):
+            os.makedirs(self.store_dir)
+        first_row = self.vectors.shape[0]
+        with open(self.vectors_path, 'ab') as f:
+            f.truncate(first_row*self.dim*4)
+            f.write(embeddings.tobytes())
+        self.vectors = np.concatenate([self.vectors, embeddings])
+        for i, sha1 in enumerate(hashes):
+            self.rows[sha1] = first_row + i
+
+    def get(self, hashes):
+        return self.vectors[[self.rows[sha1] for sha1 in hashes]]
+
+    def retain(self, paths):
+        """Forget files that no longer exist in the dataset and drop the embeddings only they used.
+        The vectors file is compacted once more than a quarter of its rows are dead."""
+        paths = set(paths)
+        self.files = dict((path, known) for path, known in self.files.items() if path in paths)
+        live = set(known['sha1'] for known in self.files.values())
+        dead = [sha1 for sha1 in self.rows if sha1 not in live]
+        for sha1 in dead:
+            del self.rows[sha1]
+        if self.vectors.shape[0] > 0 and self.vectors.shape[0] - len(self.rows) > self.vectors.shape[0] // 4:
+            self.compact()
+        return len(dead)
+
+    def compact(self):
+        """Write the live rows to the next generation of the vectors file and switch the index to it."""
+        hashes = sorted(self.rows, key=self.rows.get)
+        vectors = self.get(hashes) if hashes else np.zeros((0, self.dim), dtype=np.float32)
+        old_path = self.vectors_path
+        self.generation += 1
+        vectors.tofile(self.vectors_path)
+        self.rows = dict((sha1, i) for i, sha1 in enumerate(hashes))
+        self.vectors = vectors
+        self.save()
+        os.remove(old_path)
@@ -0,0 +1,287 @@
+"""Exports an inference-only FaceNet graph, optionally with an int8 TFLite variant,
+and reports accuracy parity and CPU latency against the original model.
+
+Usage:
+    python src/export_inference_graph.py Models/20180402-114759.pb Models/inference \
+        --quantize --calibration_dir Dataset/FaceData/processed --report
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import tensorflow as tf
+import numpy as np
+import argparse
+import facenet
+import lfw
+import os
+import sys
+import json
+import time
+import random
+from tensorflow.core.protobuf import config_pb2
+from tensorflow.core.protobuf import meta_graph_pb2
+from tensorflow.core.protobuf import rewriter_config_pb2
+from tensorflow.python.grappler import tf_optimizer
+from tensorflow.python.tools import optimize_for_inference_lib
+import freeze_graph
+
+INPUT_NODE = 'input'
+OUTPUT_NODE = 'embeddings'
+
+def main(args):
+    output_dir = os.path.expanduser(args.output_dir)
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    print('Loading %s' % args.model)
+    graph_def = load_frozen_graph_def(os.path.expanduser(args.model))
+    print('%d ops in the input graph' % len(graph_def.node))
+
+    graph_def = strip_training_branches(graph_def)
+    print('%d ops after fixing phase_train to False' % len(graph_def.node))
+
+    graph_def = run_grappler(graph_def, [OUTPUT_NODE])
+    graph_def = optimize_for_inference_lib.optimize_for_inference(
+        graph_def, [INPUT_NODE], [OUTPUT_NODE], tf.float32.as_datatype_enum)
+    graph_def = run_grappler(graph_def, [OUTPUT_NODE])
+    print('%d ops after batch norm and constant folding' % len(graph_def.node))
+
+    optimized_path = os.path.join(output_dir, 'facenet_inference.pb')
+    with tf.io.gfile.GFile(optimized_path, 'wb') as f:
+        f.write(graph_def.SerializeToString())
+    print('Saved inference graph to "%s"' % optimized_path)
+
+    artifacts = {'original': os.path.expanduser(args.model), 'optimized': optimized_path}
+
+    if args.quantize:
+        calibration_paths = sample_image_paths(args.calibration_dir, args.nrof_calibration_images, args.seed)
+        print('Quantizing with %d calibration crops from %s' % (len(calibration_paths), args.calibration_dir))
+        quantized_path = os.path.join(output_dir, 'facenet_int8.tflite')
+        with open(quantized_path, 'wb') as f:
+            f.write(quantize(optimized_path, calibration_paths, args.image_size))
+        print('Saved int8 model to "%s"' % quantized_path)
+        artifacts['int8'] = quantized_path
+
+    if args.report:
+        report = parity_report(artifacts, args)
+        report_path = os.path.join(output_dir, 'report.json')
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print_report(report)
+        print('Saved report to "%s"' % report_path)
+
+def load_frozen_graph_def(model):
+    """Returns a frozen GraphDef for a .pb file or a metagraph/checkpoint directory."""
+    if os.path.isfile(model):
+        graph_def = tf.compat.v1.GraphDef()
+        with tf.io.gfile.GFile(model, 'rb') as f:
+            graph_def.ParseFromString(f.read())
+        return graph_def
+
+    with tf.Graph().as_default():
+        with tf.compat.v1.Session() as sess:
+            meta_file, ckpt_file = facenet.get_model_filenames(model)
+            saver = tf.compat.v1.train.import_meta_graph(os.path.join(model, meta_file), clear_devices=True)
+            saver.restore(sess, os.path.join(model, ckpt_file))
+            return freeze_graph.freeze_graph_def(sess, sess.graph.as_graph_def(), OUTPUT_NODE)
+
+def strip_training_branches(graph_def):
+    """Binds phase_train to a constant False and drops everything embeddings does not need."""
+    with tf.Graph().as_default() as graph:
+        phase_train = tf.constant(False, dtype=tf.bool, name='phase_train_inference')
+        tf.import_graph_def(graph_def, input_map={'phase_train:0': phase_train}, name='')
+        bound_graph_def = graph.as_graph_def()
+    return tf.compat.v1.graph_util.extract_sub_graph(bound_graph_def, [OUTPUT_NODE])
+
+def run_grappler(graph_def, output_names):
+    """Constant folding (which resolves the now-constant batch norm Switch/Merge pairs and
+    pushes the batch norm multipliers into the conv weights), arithmetic and dependency
+    simplification and pruning of dead nodes."""
+    with tf.Graph().as_default() as graph:
+        tf.import_graph_def(graph_def, name='')
+        meta_graph = tf.compat.v1.train.export_meta_graph(graph_def=graph.as_graph_def(), graph=graph)
+    fetch_collection = meta_graph_pb2.CollectionDef()
+    fetch_collection.node_list.value.extend(output_names)
+    meta_graph.collection_def['train_op'].CopyFrom(fetch_collection)
+
+    config = config_pb2.ConfigProto()
+    rewrite_options = config.graph_options.rewrite_options
+    rewrite_options.optimizers.extend(['pruning', 'constfold', 'arithmetic', 'dependency', 'constfold'])
+    rewrite_options.meta_optimizer_iterations = rewriter_config_pb2.RewriterConfig.TWO
+    return tf_optimizer.OptimizeGraph(config, meta_graph)
+
+def sample_image_paths(data_dir, nrof_images, seed):
+    dataset = facenet.get_dataset(os.path.expanduser(data_dir))
+    paths, _ = facenet.get_image_paths_and_labels(dataset)
+    random.Random(seed).shuffle(paths)
+    return paths[:nrof_images]
+
+def quantize(graph_path, calibration_paths, image_size):
+    """Post-training int8 quantization of weights and activations; input and output stay float32."""
+    converter = tf.compat.v1.lite.TFLiteConverter.from_frozen_graph(
+        graph_path, [INPUT_NODE], [OUTPUT_NODE], input_shapes={INPUT_NODE: [1, image_size, image_size, 3]})
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
+    def representative_dataset():
+        for path in calibration_paths:
+            image = facenet.load_data([path], False, False, image_size)
+            yield [image.astype(np.float32)]
+
+    converter.representative_dataset = representative_dataset
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8, tf.lite.OpsSet.TFLITE_BUILTINS]
+    return converter.convert()
+
+class GraphEmbedder():
+    def __init__(self, model_path):
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            # Latency is reported for CPU serving, so keep the GPU out of it
+            self.sess = tf.compat.v1.Session(graph=self.graph, config=tf.compat.v1.ConfigProto(device_count={'GPU': 0}))
+            facenet.load_model(model_path)
+            self.images_placeholder = self.graph.get_tensor_by_name(INPUT_NODE + ':0')
+            self.embeddings = self.graph.get_tensor_by_name(OUTPUT_NODE + ':0')
+            try:
+                self.phase_train_placeholder = self.graph.get_tensor_by_name('phase_train:0')
+            except KeyError:
+                self.phase_train_placeholder = None
+
+    def embed(self, images):
+        feed_dict = {self.images_placeholder: images}
+        if self.phase_train_placeholder is not None:
+            feed_dict[self.phase_train_placeholder] = False
+        return self.sess.run(self.embeddings, feed_dict=feed_dict)
+
+def load_embedder(path):
+    if path.endswith('.tflite'):
+        return facenet.TFLiteEmbedder(path)
+    return GraphEmbedder(path)
+
+def compute_embeddings(embedder, paths, batch_size, image_size):
+    emb_array = []
+    for start in range(0, len(paths), batch_size):
+        images = facenet.load_data(paths[start:start+batch_size], False, False, image_size)
+        emb_array.append(embedder.embed(images.astype(np.float32)))
+    return np.concatenate(emb_array)
+
+def measure_latency(embedder, image_size, batch_size, nrof_runs):
+    images = np.random.RandomState(0).normal(size=(batch_size, image_size, image_size, 3)).astype(np.float32)
+    embedder.embed(images)  # first call pays for graph optimisation / allocation
+    timings = []
+    for _ in range(nrof_runs):
+        start = time.perf_counter()
+        embedder.embed(images)
+        timings.append(time.perf_counter() - start)
+    return {'mean_ms': 1000.0*float(np.mean(timings)), 'p95_ms': 1000.0*float(np.percentile(timings, 95))}
+
+def nearest_centroid_accuracy(embeddings, labels):
+    """Leave-one-out nearest class centroid accuracy on L2-normalised embeddings."""
+    embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    labels = np.asarray(labels)
+    classes = np.unique(labels)
+    sums = np.stack([embeddings[labels==c].sum(axis=0) for c in classes])
+    counts = np.array([np.sum(labels==c) for c in classes], dtype=np.float64)
+    correct = 0
+    for i in range(len(embeddings)):
+        own = np.searchsorted(classes, labels[i])
+        centroids = sums.copy()
+        centroids[own] -= embeddings[i]
+        n = counts.copy()
+        n[own] -= 1
+        valid = n > 0
+        centroids = centroids / np.maximum(n, 1)[:, np.newaxis]
+        dist = np.sum(np.square(centroids - embeddings[i]), axis=1)
+        dist[~valid] = np.inf
+        correct += classes[np.argmin(dist)] == labels[i]
+    return float(correct) / len(embeddings)
+
+def parity_report(artifacts, args):
+    report = {'artifacts': artifacts, 'models': {}}
+
+    if args.lfw_dir and args.lfw_pairs:
+        pairs = lfw.read_pairs(os.path.expanduser(args.lfw_pairs))
+        paths, actual_issame = lfw.get_paths(os.path.expanduser(args.lfw_dir), pairs)
+        labels = None
+        report['dataset'] = {'type': 'lfw', 'images': len(paths)}
+    else:
+        dataset = facenet.get_dataset(os.path.expanduser(args.calibration_dir))
+        paths, labels = facenet.get_image_paths_and_labels(dataset)
+        if len(paths) > args.nrof_report_images:
+            order = random.Random(args.seed).sample(range(len(paths)), args.nrof_report_images)
+            paths = [paths[i] for i in order]
+            labels = [labels[i] for i in order]
+        report['dataset'] = {'type': 'local', 'images': len(paths), 'classes': len(set(labels))}
+
+    reference = None
+    for name, path in artifacts.items():
+        print('Evaluating %s model' % name)
+        embedder = load_embedder(path)
+        embeddings = compute_embeddings(embedder, paths, args.batch_size, args.image_size)
+        result = {
+            'size_mb': os.path.getsize(path) / (1024.0 * 1024.0),
+            'latency_batch1': measure_latency(embedder, args.image_size, 1, args.nrof_latency_runs),
+            'latency_batch16': measure_latency(embedder, args.image_size, 16, args.nrof_latency_runs)
+        }
+        if labels is None:
+            _, _, accuracy, val, _, far = lfw.evaluate(embeddings, actual_issame, nrof_folds=10)
+            result['lfw_accuracy'] = float(np.mean(accuracy))
+            result['lfw_val_at_far'] = float(val)
+        else:
+            result['nearest_centroid_accuracy'] = nearest_centroid_accuracy(embeddings, labels)
+
+        if reference is None:
+            reference = embeddings
+        else:
+            dist = np.sqrt(np.sum(np.square(embeddings - reference), axis=1))
+            cos = np.sum(embeddings*reference, axis=1) / (
+                np.linalg.norm(embeddings, axis=1) * np.linalg.norm(reference, axis=1))
+            result['embedding_l2_vs_original'] = {'mean': float(np.mean(dist)), 'max': float(np.max(dist))}
+            result['embedding_cosine_vs_original'] = {'mean': float(np.mean(cos)), 'min': float(np.min(cos))}
+        report['models'][name] = result
+    return report
+
+def print_report(report):
+    print('')
+    print('%-10s %9s %12s %12s %10s %12s' % ('model', 'size MB', 'b1 ms', 'b16 ms', 'accuracy', 'L2 vs orig'))
+    for name, result in report['models'].items():
+        accuracy = result.get('lfw_accuracy', result.get('nearest_centroid_accuracy'))
+        l2 = result.get('embedding_l2_vs_original', {}).get('mean')
+        print('%-10s %9.1f %12.2f %12.2f %10.4f %12s' % (
+            name, result['size_mb'], result['latency_batch1']['mean_ms'], result['latency_batch16']['mean_ms'],
+            accuracy, '-' if l2 is None else '%.4f' % l2))
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('model', type=str,
+        help='Frozen FaceNet protobuf (.pb) or a directory containing the meta_file and ckpt_file')
+    parser.add_argument('output_dir', type=str,
+        help='Directory for the exported inference graph, int8 model and report')
+    parser.add_argument('--quantize',
+        help='Also export a post-training int8 quantized TFLite model.', action='store_true')
+    parser.add_argument('--calibration_dir', type=str,
+        help='Aligned face crops used for int8 calibration and the local parity report.',
+        default='Dataset/FaceData/processed')
+    parser.add_argument('--nrof_calibration_images', type=int,
+        help='Number of calibration crops for quantization.', default=200)
+    parser.add_argument('--report',
+        help='Compare accuracy and CPU latency of every exported model against the original.', action='store_true')
+    parser.add_argument('--lfw_dir', type=str,
+        help='Aligned LFW directory; when given with --lfw_pairs the report uses the LFW protocol.')
+    parser.add_argument('--lfw_pairs', type=str,
+        help='The file containing the LFW pairs to use for validation.')
+    parser.add_argument('--nrof_report_images', type=int,
+        help='Maximum number of local images used in the report.', default=1000)
+    parser.add_argument('--nrof_latency_runs', type=int,
+        help='Timed forward passes per batch size.', default=20)
+    parser.add_argument('--batch_size', type=int,
+        help='Number of images to process in a batch.', default=90)
+    parser.add_argument('--image_size', type=int,
+        help='Image size (height, width) in pixels.', default=160)
+    parser.add_argument('--seed', type=int,
+        help='Random seed.', default=666)
+    return parser.parse_args(argv)
+
+if __name__ == '__main__':
+    main(parse_arguments(sys.argv[1:]))
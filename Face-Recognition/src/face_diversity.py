@@ -0,0 +1,98 @@
+"""Near-duplicate filtering of enrolment frames.
+
+Consecutive webcam frames of a student sitting still are almost identical; keeping all of them
+only adds alignment and embedding work to every training. A DiversityFilter keeps a frame only
+if its difference hash (dHash) and, when an embed function is given, its FaceNet embedding are
+far enough from every frame kept so far, and stops accepting once a target number of distinct
+poses has been kept.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import cv2
+import numpy as np
+
+def dhash(img, hash_size=8):
+    """Difference hash of an image: one bit per horizontally adjacent pixel pair of the
+    (hash_size+1) x hash_size grayscale thumbnail, set where brightness increases."""
+    if img.ndim == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(img, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:,1:] > small[:,:-1]).ravel()
+    return int(np.packbits(bits).tobytes().hex(), 16)
+
+def hash_distance(a, b):
+    return bin(a ^ b).count('1')
+
+class DiversityFilter():
+    """Keeps frames that differ from every kept frame.
+
+    max_hash_distance: frames whose dHash is at most this many bits (of 64) from a kept frame
+        are duplicates
+    min_embedding_distance: frames whose embedding is closer than this (L2) to a kept frame are
+        duplicates; only checked when embed is given and finds a face
+    target: stop accepting once this many new frames are kept (None: no limit); frames
+        registered with add_existing are not counted
+    embed: image -> embedding, or None when it finds no face
+    """
+    def __init__(self, max_hash_distance=6, min_embedding_distance=0.0, target=None, embed=None):
+        self.max_hash_distance = max_hash_distance
+        self.min_embedding_distance = min_embedding_distance
+        self.target = target
+        self.embed = embed if min_embedding_distance > 0 else None
+        self.hashes = []
+        self.embeddings = []
+        self.nrof_existing = 0
+        self.rejected = {'hash': 0, 'embedding': 0, 'target': 0}
+
+    @property
+    def nrof_kept(self):
+        return len(self.hashes) - self.nrof_existing
+
+    @property
+    def done(self):
+        return self.target is not None and self.nrof_kept >= self.target
+
+    def add_existing(self, image_hash, embedding=None):
+        """Register a frame kept earlier (e.g. already on disk). New frames must differ from it,
+        but it does not count towards the target, so a student with a full folder can still
+        enrol new poses (e.g. after a change of appearance)."""
+        self.hashes.append(image_hash)
+        if embedding is not None:
+            self.embeddings.append(embedding)
+        self.nrof_existing += 1
+
+    def offer(self, img):
+        """Returns (kept, reason); reason is 'hash', 'embedding' or 'target' for rejected frames."""
+        if self.done:
+            self.rejected['target'] += 1
+            return False, 'target'
+        image_hash = dhash(img)
+        if any(hash_distance(image_hash, kept) <= self.max_hash_distance for kept in self.hashes):
+            self.rejected['hash'] += 1
+            return False, 'hash'
+        embedding = self.embed(img) if self.embed is not None else None
+        if embedding is not None and self.embeddings:
+            distances = np.linalg.norm(np.asarray(self.embeddings) - embedding, axis=1)
+            if np.min(distances) < self.min_embedding_distance:
+                self.rejected['embedding'] += 1
+                return False, 'embedding'
+        self.hashes.append(image_hash)
+        if embedding is not None:
+            self.embeddings.append(embedding)
+        return True, None
+
+    def stats(self):
+        nrof_rejected = sum(self.rejected.values())
+        nrof_offered = self.nrof_kept + nrof_rejected
+        return {
+            'kept': self.nrof_kept,
+            'rejected': nrof_rejected,
+            'rejected_by': dict(self.rejected),
+            'existing': self.nrof_existing,
+            'target': self.target,
+            # Alignment and embedding cost is per image, so this is the share of their time saved
+            'reduction': round(nrof_rejected / float(nrof_offered), 3) if nrof_offered else 0.0
+        }
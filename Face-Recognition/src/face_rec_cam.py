@@ -17,13 +17,19 @@ import pickle
 import align.detect_face
 import numpy as np
 import cv2
-import collections
 from sklearn.svm import SVC
+from face_tracker import FaceTracker
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--path', help='Path of the video you want to test on.', default=0)
+    parser.add_argument('--detect_every', type=int, default=5,
+        help='Run MTCNN every this many frames and track faces in between.')
+    parser.add_argument('--identify_every', type=int, default=5,
+        help='Frames between two identifications of a face that is not recognized yet.')
+    parser.add_argument('--width', type=int, default=600,
+        help='Width the camera frames are resized to.')
     args = parser.parse_args()
 
     MINSIZE = 20
@@ -60,67 +66,62 @@ def main():
 
             pnet, rnet, onet = align.detect_face.create_mtcnn(sess, "src/align")
 
-            people_detected = set()
-            person_detected = collections.Counter()
+            tracker = FaceTracker(detect_every=args.detect_every, identify_every=args.identify_every)
+
+            def detect(frame):
+                bounding_boxes, _ = align.detect_face.detect_face(frame, MINSIZE, pnet, rnet, onet, THRESHOLD, FACTOR)
+                return bounding_boxes
 
             cap  = VideoStream(src=0).start()
 
             while (True):
                 frame = cap.read()
-                frame = imutils.resize(frame, width=600)
+                frame = imutils.resize(frame, width=args.width)
                 frame = cv2.flip(frame, 1)
 
-                bounding_boxes, _ = align.detect_face.detect_face(frame, MINSIZE, pnet, rnet, onet, THRESHOLD, FACTOR)
+                # MTCNN only runs every few frames; boxes are carried by optical flow in between
+                tracks = tracker.update(frame, detect)
 
-                faces_found = bounding_boxes.shape[0]
+                faces_found = len(tracks)
                 try:
                     if faces_found > 1:
                         cv2.putText(frame, "Only one face", (0, 100), cv2.FONT_HERSHEY_COMPLEX_SMALL,
                                     1, (255, 255, 255), thickness=1, lineType=2)
                     elif faces_found > 0:
-                        det = bounding_boxes[:, 0:4]
-                        bb = np.zeros((faces_found, 4), dtype=np.int32)
-                        for i in range(faces_found):
-                            bb[i][0] = det[i][0]
-                            bb[i][1] = det[i][1]
-                            bb[i][2] = det[i][2]
-                            bb[i][3] = det[i][3]
-                            print(bb[i][3]-bb[i][1])
-                            print(frame.shape[0])
-                            print((bb[i][3]-bb[i][1])/frame.shape[0])
-                            if (bb[i][3]-bb[i][1])/frame.shape[0]>0.25:
-                                cropped = frame[bb[i][1]:bb[i][3], bb[i][0]:bb[i][2], :]
-                                scaled = cv2.resize(cropped, (INPUT_IMAGE_SIZE, INPUT_IMAGE_SIZE),
-                                                    interpolation=cv2.INTER_CUBIC)
-                                scaled = facenet.prewhiten(scaled)
-                                scaled_reshape = scaled.reshape(-1, INPUT_IMAGE_SIZE, INPUT_IMAGE_SIZE, 3)
-                                feed_dict = {images_placeholder: scaled_reshape, phase_train_placeholder: False}
-                                emb_array = sess.run(embeddings, feed_dict=feed_dict)
-
-                                predictions = model.predict_proba(emb_array)
-                                best_class_indices = np.argmax(predictions, axis=1)
-                                best_class_probabilities = predictions[
-                                    np.arange(len(best_class_indices)), best_class_indices]
-                                best_name = class_names[best_class_indices[0]]
-                                print("Name: {}, Probability: {}".format(best_name, best_class_probabilities))
-
-
-
-                                #ngưỡng chính xác là 0.8: khi lớn hơn 0.8 thì mới coi là chính xác
-                                if best_class_probabilities > 0.8:
-                                    cv2.rectangle(frame, (bb[i][0], bb[i][1]), (bb[i][2], bb[i][3]), (0, 255, 0), 2)
-                                    text_x = bb[i][0]
-                                    text_y = bb[i][3] + 20
-
-                                    name = class_names[best_class_indices[0]]
+                        for track in tracks:
+                            bb = track.int_box
+                            if (bb[3]-bb[1])/frame.shape[0]>0.25:
+                                # Embed and classify once per new track, then only while it is undecided
+                                if tracker.needs_identity(track):
+                                    cropped = frame[max(bb[1], 0):bb[3], max(bb[0], 0):bb[2], :]
+                                    scaled = cv2.resize(cropped, (INPUT_IMAGE_SIZE, INPUT_IMAGE_SIZE),
+                                                        interpolation=cv2.INTER_CUBIC)
+                                    scaled = facenet.prewhiten(scaled)
+                                    scaled_reshape = scaled.reshape(-1, INPUT_IMAGE_SIZE, INPUT_IMAGE_SIZE, 3)
+                                    feed_dict = {images_placeholder: scaled_reshape, phase_train_placeholder: False}
+                                    emb_array = sess.run(embeddings, feed_dict=feed_dict)
+
+                                    predictions = model.predict_proba(emb_array)
+                                    best_class_indices = np.argmax(predictions, axis=1)
+                                    best_class_probabilities = predictions[
+                                        np.arange(len(best_class_indices)), best_class_indices]
+                                    best_name = class_names[best_class_indices[0]]
+                                    print("Name: {}, Probability: {}".format(best_name, best_class_probabilities))
+
+                                    #ngưỡng chính xác là 0.8: khi lớn hơn 0.8 thì mới coi là chính xác
+                                    tracker.add_vote(track, best_name, best_class_probabilities[0], threshold=0.8)
+
+                                name, probability = track.identity()
+                                if name is not None:
+                                    cv2.rectangle(frame, (bb[0], bb[1]), (bb[2], bb[3]), (0, 255, 0), 2)
+                                    text_x = bb[0]
+                                    text_y = bb[3] + 20
+
                                     cv2.putText(frame, name, (text_x, text_y), cv2.FONT_HERSHEY_COMPLEX_SMALL,
                                                 1, (255, 255, 255), thickness=1, lineType=2)
-                                    cv2.putText(frame, str(round(best_class_probabilities[0], 3)), (text_x, text_y + 17),
+                                    cv2.putText(frame, str(round(probability, 3)), (text_x, text_y + 17),
                                                 cv2.FONT_HERSHEY_COMPLEX_SMALL,
                                                 1, (255, 255, 255), thickness=1, lineType=2)
-                                    person_detected[best_name] += 1
-                                else:
-                                    name = "Unknown"
 
                 except:
                     pass
@@ -129,7 +130,8 @@ def main():
                 if cv2.waitKey(1) & 0xFF == ord('q'):
                     break
 
-            cap.release()
+            print("Tracking: {}".format(tracker.stats()))
+            cap.stop()
             cv2.destroyAllWindows()
 
 
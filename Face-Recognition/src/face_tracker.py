@@ -0,0 +1,223 @@
+"""Detect-once, track-between face tracking for the live camera loops.
+
+MTCNN runs only every detect_every frames, or on the next frame after a track was lost; in
+between, each face box is carried forward with sparse Lucas-Kanade optical flow on a few corner
+points inside the box. Detections are associated with existing tracks by IoU, so a face keeps
+its track, and its identity, across detections. Each track accumulates classifier votes and asks
+for an embedding only while it is undecided (at most every identify_every frames) or after its
+flow quality dropped, instead of on every frame.
+
+Typical use:
+    tracker = FaceTracker(detect_every=5)
+    for frame in frames:
+        for track in tracker.update(frame, detect):
+            if tracker.needs_identity(track):
+                tracker.add_vote(track, *classify(track.box))
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import time
+import cv2
+import numpy as np
+
+def iou(a, b):
+    """Intersection over union of two (x1, y1, x2, y2) boxes."""
+    w = min(a[2], b[2]) - max(a[0], b[0])
+    h = min(a[3], b[3]) - max(a[1], b[1])
+    if w <= 0 or h <= 0:
+        return 0.0
+    inter = w * h
+    return inter / float((a[2]-a[0])*(a[3]-a[1]) + (b[2]-b[0])*(b[3]-b[1]) - inter)
+
+class Track():
+    """One face followed across frames, with the votes of its identifications."""
+    def __init__(self, track_id, box, frame_index):
+        self.id = track_id
+        self.box = np.asarray(box[0:4], dtype=np.float32)
+        self.points = None
+        self.nrof_points = 0
+        self.quality = 1.0
+        self.votes = collections.Counter()
+        self.confidences = {}
+        self.nrof_identifications = 0
+        self.last_identified = None
+        self.stale = False
+        self.created = frame_index
+
+    @property
+    def int_box(self):
+        return self.box.astype(np.int32)
+
+    def identity(self, required_votes=1):
+        """(name, confidence) of the leading identity once it has required_votes votes, else (None, 0.0)."""
+        if not self.votes:
+            return None, 0.0
+        name, count = self.votes.most_common(1)[0]
+        if count < required_votes:
+            return None, 0.0
+        return name, self.confidences[name]
+
+class FaceTracker():
+    """Tracks faces between sparse detections.
+
+    detect_every: run the detector at least every this many frames
+    iou_threshold: minimum IoU to associate a detection with a track
+    required_votes: matching identifications before a track is decided
+    identify_every: frames between two identifications of an undecided track
+    min_quality: share of flow points a track must keep; below it the track is
+        re-detected on the next frame and identified again
+    min_points: a track with fewer surviving flow points is lost
+    """
+    def __init__(self, detect_every=5, iou_threshold=0.3, required_votes=2, identify_every=5,
+                 min_quality=0.5, min_points=4, max_corners=30):
+        self.detect_every = max(1, detect_every)
+        self.iou_threshold = iou_threshold
+        self.required_votes = required_votes
+        self.identify_every = identify_every
+        self.min_quality = min_quality
+        self.min_points = min_points
+        self.max_corners = max_corners
+
+        self.tracks = []
+        self.frame_index = -1
+        self.last_detection = None
+        self.detected = False
+        self._next_id = 0
+        self._prev_gray = None
+        self._force_detection = True
+        self._counts = {'frames': 0, 'detections': 0, 'identifications': 0, 'lost': 0}
+        self._time = {'detect': 0.0, 'track': 0.0}
+
+    def update(self, frame, detect):
+        """Advance to a new frame. detect(frame) returns an (N, 4+) array of boxes and is called
+        only on detection frames. Returns the current tracks."""
+        self.frame_index += 1
+        self._counts['frames'] += 1
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+
+        started = time.perf_counter()
+        if self.tracks and self._prev_gray is not None:
+            self._propagate(gray)
+        self._time['track'] += time.perf_counter() - started
+
+        self.detected = (self._force_detection or self.last_detection is None
+                         or self.frame_index - self.last_detection >= self.detect_every)
+        if self.detected:
+            started = time.perf_counter()
+            boxes = detect(frame)
+            self._time['detect'] += time.perf_counter() - started
+            self._counts['detections'] += 1
+            self.last_detection = self.frame_index
+            self._force_detection = False
+            self._associate(gray, boxes)
+
+        self._prev_gray = gray
+        return list(self.tracks)
+
+    def needs_identity(self, track):
+        """Whether the track should be embedded and classified on this frame."""
+        if track.stale or track.last_identified is None:
+            return True
+        if track.identity(self.required_votes)[0] is not None:
+            return False
+        return self.frame_index - track.last_identified >= self.identify_every
+
+    def add_vote(self, track, name, confidence, threshold=0.0):
+        """Record one identification; votes below threshold count as an attempt only."""
+        self._counts['identifications'] += 1
+        track.nrof_identifications += 1
+        track.last_identified = self.frame_index
+        track.stale = False
+        if name is not None and confidence > threshold:
+            track.votes[name] += 1
+            track.confidences[name] = max(confidence, track.confidences.get(name, 0.0))
+
+    def stats(self):
+        frames = max(self._counts['frames'], 1)
+        return dict(self._counts,
+                    detections_per_frame=round(self._counts['detections'] / float(frames), 3),
+                    identifications_per_frame=round(self._counts['identifications'] / float(frames), 3),
+                    detect_ms_per_frame=round(1000.0 * self._time['detect'] / frames, 2),
+                    track_ms_per_frame=round(1000.0 * self._time['track'] / frames, 2))
+
+    def _features(self, gray, track):
+        x1, y1, x2, y2 = track.int_box
+        x1, y1 = max(x1, 0), max(y1, 0)
+        x2, y2 = min(x2, gray.shape[1]), min(y2, gray.shape[0])
+        track.points = None
+        track.nrof_points = 0
+        if x2 - x1 < 8 or y2 - y1 < 8:
+            return
+        corners = cv2.goodFeaturesToTrack(gray[y1:y2, x1:x2], self.max_corners, 0.01, 3)
+        if corners is not None:
+            track.points = (corners.reshape(-1, 2) + (x1, y1)).astype(np.float32)
+            track.nrof_points = len(track.points)
+        track.quality = 1.0
+
+    def _propagate(self, gray):
+        kept = []
+        for track in self.tracks:
+            if track.points is None or len(track.points) < self.min_points:
+                self._lose(track)
+                continue
+            moved, status, _ = cv2.calcOpticalFlowPyrLK(self._prev_gray, gray, track.points.reshape(-1, 1, 2), None,
+                                                        winSize=(15, 15), maxLevel=2)
+            ok = status.ravel() == 1
+            if np.count_nonzero(ok) < self.min_points:
+                self._lose(track)
+                continue
+            old, new = track.points[ok], moved.reshape(-1, 2)[ok]
+            # Median shift and median scale about the point centroid are robust to a few bad points
+            shift = np.median(new - old, axis=0)
+            old_spread = np.linalg.norm(old - np.median(old, axis=0), axis=1)
+            new_spread = np.linalg.norm(new - np.median(new, axis=0), axis=1)
+            valid = old_spread > 1e-3
+            scale = float(np.median(new_spread[valid] / old_spread[valid])) if np.any(valid) else 1.0
+            center = (track.box[0:2] + track.box[2:4]) / 2.0 + shift
+            half = (track.box[2:4] - track.box[0:2]) / 2.0 * scale
+            track.box = np.concatenate([center - half, center + half]).astype(np.float32)
+            track.points = new
+            track.quality = len(new) / float(track.nrof_points)
+            if track.quality < self.min_quality:
+                track.stale = True
+                self._force_detection = True
+            kept.append(track)
+        self.tracks = kept
+
+    def _lose(self, track):
+        self._counts['lost'] += 1
+        self._force_detection = True
+
+    def _associate(self, gray, boxes):
+        boxes = np.asarray(boxes, dtype=np.float32)
+        if boxes.size == 0:
+            boxes = boxes.reshape(0, 4)
+        pairs = sorted(((iou(track.box, box), t, d) for t, track in enumerate(self.tracks)
+                        for d, box in enumerate(boxes)), reverse=True)
+        matched_tracks, matched_boxes = set(), set()
+        for overlap, t, d in pairs:
+            if overlap < self.iou_threshold:
+                break
+            if t in matched_tracks or d in matched_boxes:
+                continue
+            matched_tracks.add(t)
+            matched_boxes.add(d)
+            self.tracks[t].box = boxes[d, 0:4].copy()
+
+        tracks = []
+        for t, track in enumerate(self.tracks):
+            if t in matched_tracks:
+                tracks.append(track)
+            else:
+                self._counts['lost'] += 1
+        for d in range(len(boxes)):
+            if d not in matched_boxes:
+                tracks.append(Track(self._next_id, boxes[d], self.frame_index))
+                self._next_id += 1
+        for track in tracks:
+            self._features(gray, track)
+        self.tracks = tracks
@@ -383,6 +383,33 @@ def load_model(model, input_map=None):
         saver = tf.train.import_meta_graph(os.path.join(model_exp, meta_file), input_map=input_map)
         saver.restore(tf.get_default_session(), os.path.join(model_exp, ckpt_file))
     
+class TFLiteEmbedder():
+    """Embedding model exported to TensorFlow Lite (e.g. the int8 variant from export_inference_graph.py).
+    
+    The interpreter is not thread safe, so calls are serialised; the input tensor is
+    resized whenever the batch size changes.
+    """
+    def __init__(self, model_path, num_threads=None):
+        import threading
+        self.interpreter = tf.lite.Interpreter(model_path=os.path.expanduser(model_path), num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self.input_index = self.interpreter.get_input_details()[0]['index']
+        self.output_index = self.interpreter.get_output_details()[0]['index']
+        self.embedding_size = self.interpreter.get_output_details()[0]['shape'][-1]
+        self._batch_size = self.interpreter.get_input_details()[0]['shape'][0]
+        self._lock = threading.Lock()
+  
+    def embed(self, images):
+        images = np.asarray(images, dtype=np.float32)
+        with self._lock:
+            if images.shape[0] != self._batch_size:
+                self.interpreter.resize_tensor_input(self.input_index, list(images.shape))
+                self.interpreter.allocate_tensors()
+                self._batch_size = images.shape[0]
+            self.interpreter.set_tensor(self.input_index, images)
+            self.interpreter.invoke()
+            return self.interpreter.get_tensor(self.output_index).copy()
+
 def get_model_filenames(model_dir):
     files = os.listdir(model_dir)
     meta_files = [s for s in files if s.endswith('.meta')]
@@ -0,0 +1,139 @@
+"""Prefetching image loader producing prewhitened float32 batches for the FaceNet embedding net.
+
+Images are decoded and prewhitened by a thread pool straight into a small ring of preallocated
+float32 batch buffers, so batch k+1 is being prepared while sess.run works on batch k and
+memory use does not grow with the batch count. Produces the same values as facenet.load_data
+(prewhiten, center crop) up to float32 rounding.
+
+Usage:
+    loader = ImageLoader(160, batch_size=90)
+    for start, images in loader.batches(paths):
+        emb_array[start:start+len(images)] = sess.run(embeddings, feed_dict={images_placeholder: images, ...})
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import collections
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+def read_rgb(path):
+    """Decode an image file to an RGB uint8 array, like facenet.load_data does."""
+    import imageio
+    img = imageio.imread(os.path.expanduser(path))
+    if img.ndim == 2:
+        img = np.repeat(img[:,:,np.newaxis], 3, axis=2)
+    return img[:,:,0:3]
+
+def prewhiten_into(x, out, stats_of=None):
+    """facenet.prewhiten written into the float32 array out instead of a new float64 array.
+    The mean and standard deviation are taken from stats_of when given (the uncropped image)."""
+    stats_of = x if stats_of is None else stats_of
+    mean = np.mean(stats_of)
+    std = np.std(stats_of)
+    std_adj = np.maximum(std, 1.0/np.sqrt(stats_of.size))
+    np.subtract(x, mean, out=out, casting='unsafe')
+    np.multiply(out, 1.0/std_adj, out=out, casting='unsafe')
+    return out
+
+def center_crop(img, image_size):
+    """facenet.crop without the random offset."""
+    if img.shape[1]>image_size:
+        sz1 = int(img.shape[1]//2)
+        sz2 = int(image_size//2)
+        img = img[(sz1-sz2):(sz1+sz2),(sz1-sz2):(sz1+sz2),:]
+    return img
+
+class ImageLoader():
+    """Loads image files in order as float32 batches of shape (n, image_size, image_size, 3).
+
+    decode: path -> uint8 HxWx3 image; read_rgb by default
+    batch_size: images per batch
+    nrof_threads: decode/prewhiten threads
+    prefetch: batches prepared ahead of the one being consumed
+    do_prewhiten: prewhiten like facenet.prewhiten, otherwise the raw pixel values are returned
+    """
+    def __init__(self, image_size, batch_size=90, nrof_threads=4, prefetch=2, do_prewhiten=True, decode=None):
+        self.image_size = image_size
+        self.batch_size = batch_size
+        self.nrof_threads = max(1, nrof_threads)
+        self.prefetch = max(1, prefetch)
+        self.do_prewhiten = do_prewhiten
+        self.decode = decode or read_rgb
+        self._buffers = None
+
+    def _ensure_buffers(self, nrof_images):
+        # One buffer per batch in flight plus the one handed out to the caller
+        nrof_buffers = min(self.prefetch + 1, int(np.ceil(nrof_images / float(self.batch_size))))
+        if self._buffers is None or len(self._buffers) < nrof_buffers:
+            self._buffers = [np.empty((self.batch_size, self.image_size, self.image_size, 3), dtype=np.float32)
+                             for _ in range(max(nrof_buffers, 1))]
+        return len(self._buffers)
+
+    def _load_into(self, path, out):
+        full = self.decode(path)
+        img = center_crop(full, self.image_size)
+        if img.shape[0]!=self.image_size or img.shape[1]!=self.image_size:
+            raise ValueError('Image %s is %dx%d, expected %dx%d' % (path, img.shape[1], img.shape[0], self.image_size, self.image_size))
+        if self.do_prewhiten:
+            # load_data prewhitens before cropping
+            prewhiten_into(img, out, stats_of=full)
+        else:
+            out[...] = img
+
+    def batches(self, image_paths):
+        """Yield (start_index, images) in order. images is a view of a reused buffer and is only
+        valid until the next batch is requested; copy it if it has to be kept."""
+        nrof_images = len(image_paths)
+        if nrof_images == 0:
+            return
+        nrof_buffers = self._ensure_buffers(nrof_images)
+        starts = list(range(0, nrof_images, self.batch_size))
+        pending = collections.deque()
+        with ThreadPoolExecutor(max_workers=self.nrof_threads) as executor:
+            def submit(batch_index):
+                start = starts[batch_index]
+                end = min(start + self.batch_size, nrof_images)
+                buf = self._buffers[batch_index % nrof_buffers]
+                futures = [executor.submit(self._load_into, image_paths[i], buf[i-start]) for i in range(start, end)]
+                pending.append((start, end, buf, futures))
+
+            for batch_index in range(min(nrof_buffers - 1, len(starts)) or 1):
+                submit(batch_index)
+            next_batch = len(pending)
+            while pending:
+                start, end, buf, futures = pending.popleft()
+                for future in futures:
+                    future.result()
+                # The buffer of the batch handed out previously is free again
+                if next_batch < len(starts):
+                    submit(next_batch)
+                    next_batch += 1
+                yield start, buf[:end-start]
+
+    def images(self, image_paths):
+        """Yield (path, decoded image) in order, decoding up to prefetch * batch_size images ahead."""
+        with ThreadPoolExecutor(max_workers=self.nrof_threads) as executor:
+            window = self.prefetch * self.batch_size
+            pending = collections.deque()
+            paths = iter(image_paths)
+            for path in paths:
+                pending.append((path, executor.submit(self.decode, path)))
+                if len(pending) >= window:
+                    break
+            while pending:
+                path, future = pending.popleft()
+                next_path = next(paths, None)
+                if next_path is not None:
+                    pending.append((next_path, executor.submit(self.decode, next_path)))
+                yield path, future.result()
+
+    def load(self, image_paths):
+        """All images as one float32 array, a drop-in for facenet.load_data without random crop/flip."""
+        images = np.empty((len(image_paths), self.image_size, self.image_size, 3), dtype=np.float32)
+        for start, batch in self.batches(image_paths):
+            images[start:start+len(batch)] = batch
+        return images
@@ -1,6 +1,6 @@
 """
 Face Recognition Script for Attendance
-Usage: python recognize.py
+Usage: python recognize.py [--detect_every 5] [--width 600]
 Output: Prints recognized student_code to stdout
 """
 from __future__ import absolute_import
@@ -30,12 +30,12 @@ import pickle
 import align.detect_face
 import numpy as np
 import cv2
-import collections
 from sklearn.svm import SVC
+from face_tracker import FaceTracker
 import time
 
 
-def main():
+def main(args):
     MINSIZE = 20
     THRESHOLD = [0.6, 0.7, 0.7]
     FACTOR = 0.709
@@ -88,9 +88,13 @@ def main():
             align_path = os.path.join(script_dir, "align")
             pnet, rnet, onet = align.detect_face.create_mtcnn(sess, align_path)
 
-            person_detected = collections.Counter()
             recognized_person = None
-            recognition_count = 0
+            tracker = FaceTracker(detect_every=args.detect_every, required_votes=2,
+                                  identify_every=args.identify_every)
+
+            def detect(frame):
+                bounding_boxes, _ = align.detect_face.detect_face(frame, MINSIZE, pnet, rnet, onet, THRESHOLD, FACTOR)
+                return bounding_boxes
 
             print("Opening camera...", file=sys.stderr)
             cap = VideoStream(src=0).start()
@@ -106,28 +110,25 @@ def main():
                     time.sleep(0.1)  # Wait a bit before trying again
                     continue
 
-                frame = imutils.resize(frame, width=600)
+                frame = imutils.resize(frame, width=args.width)
                 frame = cv2.flip(frame, 1)
 
-                bounding_boxes, _ = align.detect_face.detect_face(frame, MINSIZE, pnet, rnet, onet, THRESHOLD, FACTOR)
+                # MTCNN only runs every few frames; boxes are carried by optical flow in between
+                tracks = tracker.update(frame, detect)
 
-                faces_found = bounding_boxes.shape[0]
                 try:
-                    if faces_found > 1:
+                    if len(tracks) > 1:
                         cv2.putText(frame, "Only one face allowed", (10, 30), cv2.FONT_HERSHEY_COMPLEX_SMALL,
                                     1, (0, 0, 255), thickness=1, lineType=2)
-                    elif faces_found > 0:
-                        det = bounding_boxes[:, 0:4]
-                        bb = np.zeros((faces_found, 4), dtype=np.int32)
-                        for i in range(faces_found):
-                            bb[i][0] = det[i][0]
-                            bb[i][1] = det[i][1]
-                            bb[i][2] = det[i][2]
-                            bb[i][3] = det[i][3]
-                            
-                            # Check if face is large enough
-                            if (bb[i][3]-bb[i][1])/frame.shape[0] > 0.25:
-                                cropped = frame[bb[i][1]:bb[i][3], bb[i][0]:bb[i][2], :]
+                    elif tracks:
+                        track = tracks[0]
+                        bb = track.int_box
+
+                        # Check if face is large enough
+                        if (bb[3]-bb[1])/frame.shape[0] > 0.25:
+                            # Embed and classify once per new track, then only while it is undecided
+                            if tracker.needs_identity(track):
+                                cropped = frame[max(bb[1], 0):bb[3], max(bb[0], 0):bb[2], :]
                                 scaled = cv2.resize(cropped, (INPUT_IMAGE_SIZE, INPUT_IMAGE_SIZE),
                                                     interpolation=cv2.INTER_CUBIC)
                                 scaled = facenet.prewhiten(scaled)
@@ -139,33 +140,32 @@ def main():
                                 best_class_indices = np.argmax(predictions, axis=1)
                                 best_class_probabilities = predictions[
                                     np.arange(len(best_class_indices)), best_class_indices]
-                                best_name = class_names[best_class_indices[0]]
 
                                 # Threshold for recognition (lowered from 0.8 to 0.75 for faster recognition)
-                                if best_class_probabilities[0] > 0.75:
-                                    cv2.rectangle(frame, (bb[i][0], bb[i][1]), (bb[i][2], bb[i][3]), (0, 255, 0), 2)
-                                    text_x = bb[i][0]
-                                    text_y = bb[i][3] + 20
-
-                                    name = class_names[best_class_indices[0]]
-                                    cv2.putText(frame, name, (text_x, text_y), cv2.FONT_HERSHEY_COMPLEX_SMALL,
-                                                1, (0, 255, 0), thickness=2, lineType=2)
-                                    cv2.putText(frame, f"{round(best_class_probabilities[0], 3)}", (text_x, text_y + 20),
-                                                cv2.FONT_HERSHEY_COMPLEX_SMALL,
-                                                1, (0, 255, 0), thickness=2, lineType=2)
-
-                                    person_detected[best_name] += 1
-
-                                    # If recognized 2 times (reduced from 3), confirm
-                                    if person_detected[best_name] >= 2:
-                                        recognized_person = best_name
-                                        print(f"Recognized: {best_name}", file=sys.stderr)
-                                        break
-                                else:
-                                    cv2.rectangle(frame, (bb[i][0], bb[i][1]), (bb[i][2], bb[i][3]), (0, 0, 255), 2)
-                                    cv2.putText(frame, "Unknown", (bb[i][0], bb[i][3] + 20), 
-                                                cv2.FONT_HERSHEY_COMPLEX_SMALL,
-                                                1, (0, 0, 255), thickness=1, lineType=2)
+                                tracker.add_vote(track, class_names[best_class_indices[0]],
+                                                 best_class_probabilities[0], threshold=0.75)
+
+                            name, probability = track.identity()
+                            if name is not None:
+                                cv2.rectangle(frame, (bb[0], bb[1]), (bb[2], bb[3]), (0, 255, 0), 2)
+                                text_x = bb[0]
+                                text_y = bb[3] + 20
+
+                                cv2.putText(frame, name, (text_x, text_y), cv2.FONT_HERSHEY_COMPLEX_SMALL,
+                                            1, (0, 255, 0), thickness=2, lineType=2)
+                                cv2.putText(frame, f"{round(probability, 3)}", (text_x, text_y + 20),
+                                            cv2.FONT_HERSHEY_COMPLEX_SMALL,
+                                            1, (0, 255, 0), thickness=2, lineType=2)
+
+                                # If the track was recognized 2 times (reduced from 3), confirm
+                                if track.identity(tracker.required_votes)[0] is not None:
+                                    recognized_person = name
+                                    print(f"Recognized: {name}", file=sys.stderr)
+                            else:
+                                cv2.rectangle(frame, (bb[0], bb[1]), (bb[2], bb[3]), (0, 0, 255), 2)
+                                cv2.putText(frame, "Unknown", (bb[0], bb[3] + 20),
+                                            cv2.FONT_HERSHEY_COMPLEX_SMALL,
+                                            1, (0, 0, 255), thickness=1, lineType=2)
                     else:
                         cv2.putText(frame, "No face detected", (10, 30), cv2.FONT_HERSHEY_COMPLEX_SMALL,
                                     1, (0, 0, 255), thickness=1, lineType=2)
@@ -194,6 +194,7 @@ def main():
 
                 frame_count += 1
 
+            print(f"Tracking: {tracker.stats()}", file=sys.stderr)
             cap.stop()
             cv2.destroyAllWindows()
 
@@ -206,6 +207,18 @@ def main():
                 sys.exit(1)
 
 
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--detect_every', type=int,
+        help='Run MTCNN every this many frames and track the face in between.', default=5)
+    parser.add_argument('--identify_every', type=int,
+        help='Frames between two identifications of a face that is not confirmed yet.', default=5)
+    parser.add_argument('--width', type=int,
+        help='Width the camera frames are resized to.', default=600)
+    return parser.parse_args(argv)
+
+
 if __name__ == '__main__':
-    main()
+    main(parse_arguments(sys.argv[1:]))
 